@@ -0,0 +1,175 @@
+"""Time and memory-profile the numbered scripts on synthetic workspaces.
+
+Usage: python benchmarks/pipeline.py [--nodes 80 400] [--stages 01 05 07] [--history FILE]
+
+For every node count a seeded synthetic month (see synthetic.py) is written
+to a temporary directory and each selected script runs there in its own
+process; wall time and the peak RSS of that process (measured inside it by
+yas.instrument) are recorded. Every run
+is appended to a JSON history, and stages that got slower than the previous
+run with the same parameters (by more than --tolerance) are reported.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CODE_DIR = os.path.join(BENCH_DIR, '..', 'codes')
+sys.path.insert(0, BENCH_DIR)
+from synthetic import MAX_SGG_NODES, write_workspace
+
+# Stage -> (script, extra settings), in run order; 01/02 also write the per-band flows
+# used by 09, and 03 reads the housing supply of 04
+STAGES = {'01': ('01_pop_preprocessing.py', {'POP_TIME_BAND': 'type'}),
+          '02': ('02_card_preprocessing.py', {'CARD_TIME_BAND': 'TIME_CCD'}),
+          '04': ('04_happy_housing_preprocessing.py', {}),
+          '03': ('03_youth_resident_preprocessing.py', {}),
+          '12': ('12_coulter_district_table.py', {}),
+          '05': ('05_pop_based_SFlowLISA.py', {}),
+          '06': ('06_card_based_SFlowLISA.py', {}),
+          '07': ('07_Coulter_inequity_index.py', {}),
+          '08': ('08_Coulter_adjustment_coefficient.py', {}),
+          '09': ('09_time_band_SFlowLISA.py', {}),
+          '10': ('10_housing_allocation.py', {}),
+          '11': ('11_bivariate_SFlowLISA.py', {})}
+
+# Stages whose inputs are keyed by SGG codes (see synthetic.MAX_SGG_NODES)
+SGG_STAGES = ('01', '02', '03', '04', '09', '11', '12')
+
+
+def run_stage(script, workspace, settings, log_path):
+    """Run one script in the workspace; return seconds, peak RSS (MB) and return code."""
+    env = dict(os.environ, **{'YAS_' + k: str(v) for k, v in settings.items()},
+               PYTHONPATH = os.pathsep.join([CODE_DIR] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    profile_log = os.path.splitext(log_path)[0] + '.jsonl'
+    if os.path.exists(profile_log):
+        os.remove(profile_log)
+    with open(log_path, 'w') as log:
+        start = time.perf_counter()
+        # The script runs as an instrumented stage, which records the peak RSS of its
+        # own process (VmHWM) in the 'total' record of the profile log
+        proc = subprocess.run([sys.executable, '-m', 'yas.instrument', os.path.join(CODE_DIR, script),
+                               '--log', profile_log],
+                              cwd = workspace, env = env, stdout = log, stderr = subprocess.STDOUT)
+        seconds = time.perf_counter() - start
+
+    peak = None
+    if os.path.exists(profile_log):
+        with open(profile_log, encoding = 'utf-8') as f:
+            totals = [r for r in map(json.loads, f) if r['step'] == 'total']
+        peak = totals[-1]['peak_rss_mb'] if totals else None
+    return {'seconds': round(seconds, 3), 'peak_rss_mb': peak, 'returncode': proc.returncode}
+
+
+def geopandas_available():
+    try:
+        import geopandas  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def run(nodes, stages, pop_rows, card_rows, max_flows, seed = 0, ym = '202211', keep = None):
+    """Benchmark the stages for every node count; returns a list of result dicts."""
+    results = []
+    for n in nodes:
+        with tempfile.TemporaryDirectory() as tmp:
+            workspace = keep or tmp
+            start = time.perf_counter()
+            write_workspace(workspace, n, pop_rows, card_rows, ym = ym, max_flows = max_flows, seed = seed)
+            results.append({'stage': 'generate', 'nodes': n,
+                            'seconds': round(time.perf_counter() - start, 3)})
+
+            base = {'MONTH': ym, 'DAY_TYPE': 'weekday', 'STORE': './store',
+                    'CACHE': os.path.join(workspace, '.stage_cache')}
+            for stage in stages:
+                script, extra = STAGES[stage]
+                row = {'stage': stage, 'nodes': n}
+                if n > MAX_SGG_NODES and stage in SGG_STAGES:
+                    row['skipped'] = 'SGG inputs need at most %d nodes' % MAX_SGG_NODES
+                elif stage == '04' and not geopandas_available():
+                    row['skipped'] = 'geopandas not installed'
+                else:
+                    log_path = os.path.join(workspace, 'stage_' + stage + '.log')
+                    row.update(run_stage(script, workspace, dict(base, **extra), log_path))
+                    if row['returncode'] != 0:
+                        with open(log_path, encoding = 'utf-8', errors = 'replace') as f:
+                            row['error'] = f.read().strip().splitlines()[-1:]
+                results.append(row)
+                print(row, flush = True)
+    return results
+
+
+def compare(results, params, history, tolerance):
+    """Stages slower than in the last run with the same parameters."""
+    previous = [run for run in history if run['params'] == params]
+    if not previous:
+        return []
+    last = {(r['stage'], r['nodes']): r for r in previous[-1]['results'] if 'seconds' in r}
+
+    slower = []
+    for r in results:
+        before = last.get((r['stage'], r['nodes']))
+        if before is None or 'seconds' not in r or r.get('returncode', 0) != 0:
+            continue
+        ratio = r['seconds'] / max(before['seconds'], 1e-9)
+        if ratio > tolerance:
+            slower.append({'stage': r['stage'], 'nodes': r['nodes'], 'before_s': before['seconds'],
+                           'now_s': r['seconds'], 'ratio': round(ratio, 2)})
+    return slower
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = BENCH_DIR,
+                              capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the pipeline stages on synthetic data.')
+    parser.add_argument('--nodes', nargs = '+', type = int, default = [80],
+                        help = 'Node counts (SGG ~80, eup-myeon-dong ~3500)')
+    parser.add_argument('--stages', nargs = '+', default = list(STAGES), choices = list(STAGES))
+    parser.add_argument('--pop-rows', type = int, default = 200_000, help = 'Rows of the raw pop file')
+    parser.add_argument('--card-rows', type = int, default = 100_000, help = 'Rows of the raw card file')
+    parser.add_argument('--max-flows', type = int, default = 20_000,
+                        help = 'OD pairs in the Flow-LISA inputs (all pairs when n x n is smaller)')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--history', default = os.path.join(BENCH_DIR, 'history.json'))
+    parser.add_argument('--tolerance', type = float, default = 1.25,
+                        help = 'Report stages slower than the previous run by this factor')
+    parser.add_argument('--keep', default = None, help = 'Write the workspace here instead of a temp dir')
+    args = parser.parse_args()
+
+    params = {'nodes': args.nodes, 'stages': args.stages, 'pop_rows': args.pop_rows,
+              'card_rows': args.card_rows, 'max_flows': args.max_flows, 'seed': args.seed}
+    results = run(args.nodes, args.stages, args.pop_rows, args.card_rows, args.max_flows,
+                  args.seed, keep = args.keep)
+
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    slower = compare(results, params, history, args.tolerance)
+
+    history.append({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(),
+                    'python': platform.python_version(), 'numpy': np.__version__,
+                    'pandas': pd.__version__, 'params': params, 'results': results})
+    with open(args.history, 'w') as f:
+        json.dump(history, f, indent = 1)
+
+    print(pd.DataFrame(results).to_string(index = False))
+    if slower:
+        print('\nSlower than the previous run:')
+        print(pd.DataFrame(slower).to_string(index = False))
+    sys.exit(1 if slower else 0)
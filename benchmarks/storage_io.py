@@ -0,0 +1,69 @@
+"""Compare write/read time and file size of the CSV and columnar stores.
+
+Usage: python benchmarks/storage_io.py [n_nodes ...]
+
+A synthetic Flow-LISA result table (n_nodes x n_nodes flows, same columns as
+DM_SIG_Fl_*) is written and read back through every TableStore backend.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'codes'))
+from yas.storage import TableStore
+
+
+def flow_table(n_nodes, seed = 0):
+    # Synthetic OD table with the column layout of the Flow-LISA outputs
+    rng = np.random.default_rng(seed)
+    codes = np.arange(11010, 11010 + 10 * n_nodes, 10)
+    xy = rng.random((n_nodes, 2)) + [126.5, 37.0]
+    o = np.repeat(np.arange(n_nodes), n_nodes)
+    d = np.tile(np.arange(n_nodes), n_nodes)
+    pop = rng.gamma(0.5, 200, len(o))
+
+    od = pd.DataFrame({'O': codes[o], 'D': codes[d],
+                       'O_x': xy[o, 0], 'O_y': xy[o, 1], 'D_x': xy[d, 0], 'D_y': xy[d, 1],
+                       'num_x': o + 1, 'num_y': d + 1,
+                       'CODE': codes[o] * 100000 + codes[d], 'POP': pop})
+    od['Zyouth_P'] = (od['POP'] - od['POP'].mean()) / od['POP'].std()
+    od['pop_lag'] = rng.standard_normal(len(od))
+    od['Fl_pop'] = od['pop_lag'] / od['Zyouth_P']
+    od['value_P'] = rng.choice(['HH', 'HL', 'LH', 'LL'], len(od))
+    od['value_P2'] = np.where(rng.random(len(od)) < 0.9, 'NS', od['value_P'])
+    return od
+
+
+def bench(od, fmt, root, repeat = 3):
+    store = TableStore(root, fmt = fmt)
+    write, read = [], []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        path = store.write(od, 'DM_SIG_Fl_weekday', month = '202211', indicator = 'pop')
+        write.append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        back = store.read('DM_SIG_Fl_weekday', month = '202211', indicator = 'pop')
+        read.append(time.perf_counter() - t)
+
+    # Largest absolute float difference after the round-trip
+    floats = od.select_dtypes('float').columns
+    err = float(np.abs(back[floats].to_numpy() - od[floats].to_numpy()).max())
+    return {'format': fmt, 'rows': len(od), 'write_s': min(write), 'read_s': min(read),
+            'size_MB': os.path.getsize(path) / 1024 ** 2, 'max_float_err': err}
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [78, 400]
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        for n in sizes:
+            od = flow_table(n)
+            for fmt in ['csv', 'parquet', 'feather']:
+                results.append(bench(od, fmt, root))
+
+    print(pd.DataFrame(results).to_string(index = False))
@@ -0,0 +1,229 @@
+"""Seeded synthetic inputs with the schemas expected by codes/01-09.
+
+Every generator takes a node table from nodes(), so the raw files, the code
+table, od_xy, the distance matrix and the housing layers all describe the
+same synthetic Seoul Metropolitan Area. write_workspace() writes a complete
+working directory in which the numbered scripts can be run unchanged.
+
+Sizes range from SGG level (~80 nodes) to eup-myeon-dong level (~3,500
+nodes). The raw pop/card files, the code table and the housing layers are
+keyed by 5-digit SGG codes (at most 999 per province), so above 2,997 nodes
+only the node-level inputs (distance matrix, flow tables, Coulter table)
+are written.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+# (raw CODE_AD2 prefix, study CODE prefix, shapefile SIGUNGU_CD prefix, share of nodes)
+PROVINCES = [('11', '11', '11', 0.3), ('28', '23', '23', 0.15), ('41', '31', '31', 0.55)]
+
+# Largest node count with unique 5-digit SGG codes
+MAX_SGG_NODES = 3 * 999
+
+WEEKDAY_NAMES = ['월', '화', '수', '목', '금', '토', '일']
+
+
+def nodes(n_nodes, seed = 0):
+    """Node table: num (1..n), study CODE, CODE_AD2, SIGUNGU_CD and lon/lat."""
+    rng = np.random.default_rng(seed)
+    counts = [int(round(n_nodes * share)) for *_, share in PROVINCES]
+    counts[-1] = n_nodes - sum(counts[:-1])
+
+    rows = []
+    for (ad, code, sig, _), count in zip(PROVINCES, counts):
+        for k in range(count):
+            rows.append([ad + '%03d' % (k + 1), int(code + '%03d' % (k + 1)), sig + '%03d' % (k + 1)])
+    df = pd.DataFrame(rows, columns = ['CODE_AD2', 'CODE', 'SIGUNGU_CD'])
+    df.insert(0, 'num', np.arange(1, n_nodes + 1))
+    df['lon'] = 126.5 + rng.random(n_nodes) * 1.2
+    df['lat'] = 36.9 + rng.random(n_nodes) * 1.2
+    return df
+
+
+def code_table(nd):
+    # CODE_2023.01.01.csv: 10-digit CODE_AD and study region CODE
+    return pd.DataFrame({'CODE_AD': (nd['CODE_AD2'] + '00000').astype(np.int64), 'CODE': nd['CODE']})
+
+
+def od_xy(nd):
+    # od_xy_num_0716.csv: every OD pair with coordinates, num IDs and the OD key
+    o = np.repeat(np.arange(len(nd)), len(nd))
+    d = np.tile(np.arange(len(nd)), len(nd))
+    code = nd['CODE'].to_numpy()
+    return pd.DataFrame({'O': code[o], 'D': code[d],
+                         'ox': nd['lon'].to_numpy()[o], 'oy': nd['lat'].to_numpy()[o],
+                         'dx': nd['lon'].to_numpy()[d], 'dy': nd['lat'].to_numpy()[d],
+                         'num_x': o + 1, 'num_y': d + 1,
+                         'CODE': code[o].astype(np.int64) * 100000 + code[d]})
+
+
+def distance_matrix(nd):
+    # DistanceMatrix.csv: node x node distances (km, roughly), rows in num order
+    xy = nd[['lon', 'lat']].to_numpy() * [88.0, 111.0]
+    dist = np.sqrt(((xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis = 2))
+    return pd.DataFrame(dist, columns = [str(i) for i in range(len(nd))])
+
+
+def month_days(ym):
+    days = pd.date_range(ym + '01', periods = pd.Period(ym, 'M').days_in_month, freq = 'D')
+    return days
+
+
+def raw_pop(nd, n_rows, ym = '202211', seed = 0):
+    """성연령최종파일_<ym>.csv rows (pipe separated) with SGG origins and dong destinations."""
+    rng = np.random.default_rng(seed)
+    days = month_days(ym)
+    day = rng.integers(0, len(days), n_rows)
+    ad2 = nd['CODE_AD2'].to_numpy()
+    return pd.DataFrame({'home_GU_CODE': ad2[rng.integers(0, len(nd), n_rows)].astype(np.int64),
+                         'dst_HCODE': np.char.add(ad2[rng.integers(0, len(nd), n_rows)].astype(str),
+                                                  rng.integers(510, 700, n_rows).astype(str)),
+                         'AGE': rng.choice(['10G', '20G', '30G', '40G', '50G'], n_rows),
+                         'SEX': rng.choice(['M', 'F'], n_rows),
+                         'STD_YMD': days.strftime('%Y%m%d').to_numpy()[day].astype(np.int64),
+                         'DAY': np.array(WEEKDAY_NAMES)[days.dayofweek.to_numpy()[day]],
+                         'type': rng.integers(0, 24, n_rows),
+                         'POP': rng.gamma(0.8, 30, n_rows).round(2)})
+
+
+def raw_card(nd, n_rows, ym = '202211', seed = 0):
+    """KRILA_<ym>.csv card transaction rows."""
+    rng = np.random.default_rng(seed + 1)
+    days = month_days(ym)
+    ad2 = nd['CODE_AD2'].to_numpy().astype(np.int64)
+    return pd.DataFrame({'TA_D': days.strftime('%Y%m%d').to_numpy()[rng.integers(0, len(days), n_rows)].astype(np.int64),
+                         'CLNN_CTY_CD': ad2[rng.integers(0, len(nd), n_rows)],
+                         'MCT_SSG_CD': ad2[rng.integers(0, len(nd), n_rows)],
+                         'AGE_CD': rng.choice(['AGE_1', 'AGE_2', 'AGE_3'], n_rows),
+                         'SEX_CD': rng.choice(['M', 'F'], n_rows),
+                         'RY_CD': rng.choice(['FOOD', 'CAFE', 'SHOP', 'ETC'], n_rows),
+                         'TIME_CCD': rng.choice(['T1', 'T2', 'T3', 'T4', 'T5', 'T6'], n_rows),
+                         'TAMT': rng.gamma(1.0, 50000, n_rows).round(),
+                         'CNT': rng.integers(1, 20, n_rows)})
+
+
+def resident_pop(nd, ym = '202211', seed = 0):
+    # <ym>_연령별인구현황_월간.csv: one row per region with an age column per year of age
+    rng = np.random.default_rng(seed + 2)
+    df = pd.DataFrame({'행정구역': ['지역' + c + ' (' + c + '00000)' for c in nd['CODE_AD2']]})
+    ages = {ym[:4] + '년' + ym[4:] + '월_계_' + str(a) + '세': rng.integers(100, 5000, len(nd))
+            for a in range(0, 101)}
+    return pd.concat([df, pd.DataFrame(ages)], axis = 1)
+
+
+def flow_table(nd, value = 'POP', max_flows = None, seed = 0):
+    """Standardized OD flow table (05/06 input): O, D, num_x, num_y, CODE, value, Zyouth_P.
+
+    max_flows draws a random subset of OD pairs, for node counts whose full
+    n x n flow set is too large for a dense Flow-LISA run.
+    """
+    rng = np.random.default_rng(seed + 3)
+    n = len(nd)
+    if max_flows is None or max_flows >= n * n:
+        pairs = np.arange(n * n)
+    else:
+        pairs = np.sort(rng.choice(n * n, max_flows, replace = False))
+    o, d = pairs // n, pairs % n
+    code = nd['CODE'].to_numpy()
+    od = pd.DataFrame({'O': code[o], 'D': code[d], 'num_x': o + 1, 'num_y': d + 1,
+                       'CODE': code[o].astype(np.int64) * 100000 + code[d],
+                       value: rng.gamma(0.5, 200, len(o))})
+    od['Zyouth_P'] = (od[value] - od[value].mean()) / od[value].std()
+    return od
+
+
+def coulter_table(nd, seed = 0):
+    # SIG_mpoppoppay+roomcount+size_<month>.csv: housing supply and activity shares per district
+    rng = np.random.default_rng(seed + 4)
+    n = len(nd)
+    count = rng.integers(0, 800, n)
+    df = pd.DataFrame({'CODE': nd['CODE'], 'Room_count': count,
+                       'Room_size': count * rng.integers(16, 45, n)})
+    for col in ['POP/allPOP', 'MPOP/allMPOP', 'PAY/allPAY']:
+        v = rng.gamma(1.0, 1.0, n)
+        df[col] = v / v.sum()
+    return df
+
+
+def districts(nd):
+    """SGG polygons (EPSG:5179 squares around the nodes) as a GeoDataFrame."""
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    pts = gpd.GeoSeries(gpd.points_from_xy(nd['lon'], nd['lat']), crs = 4326).to_crs(5179)
+    half = 1500.0
+    return gpd.GeoDataFrame({'SIGUNGU_CD': nd['SIGUNGU_CD'], 'SIGUNGU_NM': nd['SIGUNGU_CD']},
+                            geometry = [box(p.x - half, p.y - half, p.x + half, p.y + half) for p in pts],
+                            crs = 5179)
+
+
+def housing_points(nd, n_projects, seed = 0):
+    """Happy Housing projects (WGS84 points) with the v3 shapefile attributes."""
+    import geopandas as gpd
+
+    rng = np.random.default_rng(seed + 5)
+    at = rng.integers(0, len(nd), n_projects)
+    lon = nd['lon'].to_numpy()[at] + rng.normal(0, 0.005, n_projects)
+    lat = nd['lat'].to_numpy()[at] + rng.normal(0, 0.005, n_projects)
+    df = pd.DataFrame({'행정동코드': (nd['CODE_AD2'].to_numpy()[at] + '51000').astype(np.int64),
+                       'Room_who': rng.choice(['청년', '대학생', '신혼부부', '고령자', '주거급여'], n_projects),
+                       'Room_count': rng.integers(10, 500, n_projects),
+                       'Room_size': rng.integers(16, 45, n_projects),
+                       'X': lon, 'Y': lat})
+    return gpd.GeoDataFrame(df, geometry = gpd.points_from_xy(lon, lat), crs = 4326)
+
+
+def write_workspace(root, n_nodes, pop_rows = 200_000, card_rows = 100_000, projects = 300,
+                    ym = '202211', max_flows = 20_000, seed = 0):
+    """Write every input of the numbered scripts for one synthetic month into root.
+
+    Returns the list of files written. Housing layers need geopandas and are
+    skipped without it.
+    """
+    os.makedirs(root, exist_ok = True)
+    nd = nodes(n_nodes, seed)
+    written = []
+
+    def csv(df, name, **kw):
+        path = os.path.join(root, name)
+        df.to_csv(path, index = False, **kw)
+        written.append(path)
+
+    csv(distance_matrix(nd), 'DistanceMatrix.csv', encoding = 'cp949')
+    for flow, value in [('youthmove', 'POP'), ('youthpay', 'PAY')]:
+        csv(flow_table(nd, value, max_flows, seed), '서울인천경기_' + flow + '_weekday_' + ym + '.csv',
+            encoding = 'cp949')
+    coulter = coulter_table(nd, seed)
+    csv(coulter, 'SIG_mpoppoppay+roomcount+size_' + ym + '.csv', encoding = 'cp949')
+    # District supply as stored by 04, for 11 and 12 when geopandas is missing
+    csv(coulter[['CODE', 'Room_count', 'Room_size']], 'SIG_happyhouse.csv', encoding = 'cp949')
+
+    if n_nodes > MAX_SGG_NODES:
+        return written
+
+    csv(code_table(nd), 'CODE_2023.01.01.csv', encoding = 'cp949')
+    csv(od_xy(nd), 'od_xy_num_0716.csv', encoding = 'cp949')
+    csv(raw_pop(nd, pop_rows, ym, seed), '성연령최종파일_' + ym + '.csv', encoding = 'utf-8', sep = '|')
+    csv(raw_card(nd, card_rows, ym, seed), 'KRILA_' + ym + '.csv', encoding = 'cp949')
+    csv(resident_pop(nd, ym, seed), ym + '_연령별인구현황_월간.csv', encoding = 'cp949')
+    mpop = od_xy(nd)[['O', 'D', 'num_x', 'num_y', 'CODE']].assign(MPOP = 1)
+    csv(mpop, 'SIG_mpop_weekday_' + ym + '.csv', encoding = 'cp949')
+
+    try:
+        import geopandas  # noqa: F401
+    except ImportError:
+        return written
+
+    layers = [(districts(nd), 'bnd_sigungu_00_2022_2022_2Q.shp'),
+              (housing_points(nd, projects, seed), '행복주택_서울+인천+경기_v3_WGS.shp')]
+    youth = housing_points(nd, projects, seed)
+    youth = youth[youth['Room_who'].isin(['청년', '대학생', '신혼부부'])].copy()
+    youth['Room_size2'] = youth['Room_size'] * youth['Room_count']
+    layers.append((youth[['Room_count', 'Room_size2', 'X', 'Y', 'geometry']], 'SIG_happyhouse.shp'))
+    for gdf, name in layers:
+        path = os.path.join(root, name)
+        gdf.to_file(path, encoding = 'cp949')
+        written.append(path)
+    return written
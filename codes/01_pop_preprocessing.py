@@ -4,62 +4,67 @@ import pandas as pd
 # Set float display format for better readability of statistical values
 pd.options.display.float_format = '{:.5f}'.format
 
-from tqdm.auto import tqdm
 import warnings
 
+from yas.crosswalk import load_crosswalk
+from yas.od_aggregation import od_band_grid, od_grid
+from yas.streaming import read_pop_od
+from yas.settings import setting
+from yas.storage import TableStore
+
 # Suppress warnings to maintain a clean output console
 warnings.filterwarnings(action='ignore')
 
+# Analysis period and day type (overridable by the batch runner)
+ym = setting('MONTH', '202204')
+day_type = setting('DAY_TYPE', 'weekday')
+
+# Time-band mode: name of the time slot column (e.g. 'type') whose flows are also kept
+# per band for the time-band Flow-LISA (09); empty keeps the daily totals only.
+# Separate from the card setting (CARD_TIME_BAND), as the raw files name the slots differently
+time_band = setting('POP_TIME_BAND', '') or None
+
+# Hand-off tables are written to a typed (Parquet) store partitioned by indicator and month
+store = TableStore(setting('STORE', './store'), fmt = setting('STORE_FORMAT', 'parquet'))
+
 # 1. Load Administrative Code Mapping Data
 # code: Master mapping table for administrative region codes
-code = pd.read_csv('./CODE_2023.01.01.csv', encoding = 'cp949')
-code['CODE_AD'] = code['CODE_AD'].astype(str)
-code['CODE_AD2'] = code['CODE_AD'].str[:5]  # Extract 5-digit district (SGG) level codes
+# Compiled once into CODE_AD / CODE_AD2 (5-digit SGG) / CODE maps and cached as a binary file
+cw = load_crosswalk('./CODE_2023.01.01.csv')
 
 # 2. Load Coordinate Data for OD (Origin-Destination) Pairs
 # od_xy: Contains spatial coordinates and numeric IDs for each OD pair
 od_xy = pd.read_csv('./od_xy_num_0716.csv', encoding = 'cp949')
 
-# 3. Load Raw Floating Population Data (April 2022)
-pop = pd.read_csv('./성연령최종파일_202204.csv', encoding = 'utf-8', sep = '|')
-
-# Convert code columns to string for consistent prefix filtering
-pop['home_GU_CODE'] = pop['home_GU_CODE'].astype(str)
-pop['dst_HCODE'] = pop['dst_HCODE'].astype(str)
-
-# 4. Filter for Weekday Patterns in the Seoul Metropolitan Area (SMA)
-# Exclude weekends (Saturday and Sunday) to focus on daily activity patterns
-pop = pop[(pop['DAY'] != '토') & (pop['DAY'] != '일')]
-
-# Filter for movements where both Origin and Destination are within Seoul(11), Gyeonggi(41), or Incheon(28)
-pop2 = pop[((pop['home_GU_CODE'].str.startswith('41')) | (pop['home_GU_CODE'].str.startswith('28')) | (pop['home_GU_CODE'].str.startswith('11'))) &
-           ((pop['dst_HCODE'].str.startswith('41')) | (pop['dst_HCODE'].str.startswith('28')) | (pop['dst_HCODE'].str.startswith('11')))]
+# 3. Stream Raw Floating Population Data (e.g., April 2022)
+# The file is read in chunks of 'chunksize' rows with narrow dtypes, so peak
+# memory is bounded by the chunk size rather than by the multi-GB file
+chunksize = 1_000_000
 
+# 4. Filter for Weekday (or Weekend) Patterns in the Seoul Metropolitan Area (SMA)
+# Within each chunk: keep the days of 'day_type' and movements where
+# both Origin and Destination are within Seoul(11), Gyeonggi(41), or Incheon(28)
 # 5. Extract Youth Population (20s and 30s)
-# AGE '20G' and '30G' represent the target demographic group
-pop_y = pop2[(pop2['AGE'] == '20G') | (pop2['AGE'] == '30G')].reset_index()
-pop_y['dst_HCODE2'] = pop_y['dst_HCODE'].str[:5] # Standardize destination to 5-digit SGG level
-pop_y2 = pop_y[['home_GU_CODE', 'dst_HCODE2', 'AGE', 'SEX', 'STD_YMD', 'DAY', 'type', 'POP']]
+# AGE '20G' and '30G' represent the target demographic group; destinations are
+# standardized to 5-digit SGG level and folded into running OD sums
+y_sums, y_o, y_d, report = read_pop_od('./성연령최종파일_' + ym + '.csv', chunksize = chunksize,
+                                      day_type = day_type, ages = ('20G', '30G'), band_col = time_band)
+
+# Rows read and kept after each filter
+print(report)
 
 # 6. Aggregate Population Flows by OD Pair
-y_o = pop_y2['home_GU_CODE'].unique()
-y_d = pop_y2['dst_HCODE2'].unique()
-
-y_od = []
-# Nested loop to calculate the total flow for each unique OD combination
-for i in tqdm(range(len(y_o))):
-    for j in tqdm(range(len(y_d))):
-        # Sum population for specific Origin (home_GU_CODE) and Destination (dst_HCODE2)
-        y_sum = pop_y2[(pop_y2['home_GU_CODE'] == y_o[i]) & (pop_y2['dst_HCODE2'] == y_d[j])]['POP'].sum()
-        
-        # Convert administrative AD codes back to standard region IDs
-        y_co = code[code['CODE_AD2'] == y_o[i]]['CODE'].tolist()[0]
-        y_cd = code[code['CODE_AD2'] == y_d[j]]['CODE'].tolist()[0]
-        y_od.append([y_co, y_cd, y_sum])
-        
-# Create a DataFrame for aggregated youth flows
-col = ['O', 'D', 'POP']
-p_y = pd.DataFrame(y_od, columns = col)
+# Streamed sums laid out on the full origin x destination grid (zero flows kept)
+# and mapped back to standard region IDs
+# Code-change rules are applied first; codes without a study region are dropped and reported
+y_sums, y_o, y_d = cw.normalize_od(y_sums, y_o, y_d)
+print(cw.report())
+
+# In time-band mode the same pass produced sums per (band, O, D); the daily totals are their sum
+if time_band:
+    y_band_sums = y_sums
+    y_sums = y_band_sums.groupby(level = [1, 2], sort = False).sum()
+p_y = od_grid(y_sums, y_o, y_d, cw.lookup('CODE_AD2', 'CODE'), 'POP')
 
 # 7. Final Data Integration and Normalization
 p_y['O'] = p_y['O'].astype(str)
@@ -79,4 +84,13 @@ p_y2.columns = ['O', 'D', 'O_x', 'O_y', 'D_x', 'D_y', 'num_x', 'num_y', 'CODE',
 p_y2['Zpop_P'] = (p_y2['POP'] - p_y2['POP'].mean()) / p_y2['POP'].std()
 
 # Export the processed dataset for Flow-LISA or other spatial association analysis
-p_y2.to_csv('./SIG_pop_weekday_202204.csv', encoding = 'cp949', index = False)
\ No newline at end of file
+store.write(p_y2, 'SIG_pop_' + day_type, month = ym, indicator = 'pop')
+
+# 8. Time-Band Flows (time-band mode only)
+# Per-band flows on the same OD grid, keyed like the daily table for the time-band Flow-LISA
+if time_band:
+    bands = sorted(y_band_sums.index.get_level_values(0).unique())
+    p_b = od_band_grid(y_band_sums, bands, y_o, y_d, cw.lookup('CODE_AD2', 'CODE'), 'POP')
+    p_b['CODE'] = p_b['O'].astype(str) + p_b['D'].astype(str)
+    p_b = pd.merge(p_y2[['O', 'D', 'num_x', 'num_y', 'CODE']], p_b[['band', 'CODE', 'POP']], on = 'CODE')
+    store.write(p_b, 'SIG_pop_' + day_type + '_bands', month = ym, indicator = 'pop')
\ No newline at end of file
@@ -4,66 +4,82 @@ import pandas as pd
 # Set display format for floating point numbers to 5 decimal places
 pd.options.display.float_format = '{:.5f}'.format
 
-from tqdm.auto import tqdm
 import warnings
 
+from yas.crosswalk import load_crosswalk
+from yas.od_aggregation import od_band_grid, od_grid
+from yas.period import month_dates, parse_holidays
+from yas.settings import setting
+from yas.storage import TableStore
+from yas.streaming import read_card_od
+
 # Ignore warning messages for a cleaner output
 warnings.filterwarnings(action='ignore')
 
+# Analysis period and day type (overridable by the batch runner)
+ym = setting('MONTH', '202204')
+day_type = setting('DAY_TYPE', 'weekend')
+
+# Time-band mode: name of the transaction time code column (e.g. 'TIME_CCD') whose flows
+# are also kept per band for the time-band Flow-LISA (09); empty keeps the daily totals only
+time_band = setting('CARD_TIME_BAND', '') or None
+
+# Category mode: flows are also kept per consumption category (RY_CD)
+by_category = setting('BY_CATEGORY', '') not in ('', '0')
+
+# Public holidays (YYYYMMDD) counted as weekend days; day type 'holiday' keeps only these
+holidays = parse_holidays(setting('HOLIDAYS', ''))
+
+# Hand-off tables are written to a typed (Parquet) store partitioned by indicator and month
+store = TableStore(setting('STORE', './store'), fmt = setting('STORE_FORMAT', 'parquet'))
+
 # 1. Load Administrative Code Mapping Data
 # 'CODE_2023.01.01.csv' contains mapping between different administrative code systems
-code = pd.read_csv('./CODE_2023.01.01.csv', encoding = 'cp949')
-code['CODE_AD'] = code['CODE_AD'].astype(str)
-code['CODE_AD2'] = code['CODE_AD'].str[:5] # Extract 5-digit district (SGG) level codes
+# Compiled once into CODE_AD / CODE_AD2 (5-digit SGG) / CODE maps and cached as a binary file
+cw = load_crosswalk('./CODE_2023.01.01.csv')
 
 # 2. Load Coordinate and Index Data for OD Pairs
 # 'od_xy_num_0716.csv' contains spatial coordinates and numeric IDs for Origin-Destination pairs
 od_xy = pd.read_csv('./od_xy_num_0716.csv', encoding = 'cp949')
 
-# 3. Load Raw Credit Card Transaction Data (April 2022)
-card = pd.read_csv('./KRILA_202204.csv', encoding = 'cp949')
+# 3. Stream Raw Credit Card Transaction Data (e.g., April 2022)
+# The file is read in chunks of 'chunksize' rows with narrow dtypes, so peak
+# memory is bounded by the chunk size rather than by the file size
+chunksize = 1_000_000
 
 # 4. Filter Data by Specific Criteria
-# Filter for Weekends in April 2022, Youth Age Group (AGE_2), and exclude 'ETC' category
-card2 = card[((card['TA_D'] == 20220402) | (card['TA_D'] == 20220403) | (card['TA_D'] == 20220409) | (card['TA_D'] == 202204010) | 
-            (card['TA_D'] == 20220416) | (card['TA_D'] == 20220417) | (card['TA_D'] == 20220423) | (card['TA_D'] == 20220430)) & 
-            ((card['AGE_CD'] == 'AGE_2') & (card['RY_CD'] != 'ETC'))]
-
-# Convert region codes to string for prefix filtering
-card2['CLNN_CTY_CD'] = card2['CLNN_CTY_CD'].astype(str)
-card2['MCT_SSG_CD'] = card2['MCT_SSG_CD'].astype(str)
-
-# 5. Filter for Seoul Metropolitan Area (SMA)
-# Region codes starting with 11 (Seoul), 28 (Incheon), and 41 (Gyeonggi)
-card3 = card2[((card2['CLNN_CTY_CD'].str.startswith('41')) | (card2['CLNN_CTY_CD'].str.startswith('28')) | (card2['CLNN_CTY_CD'].str.startswith('11'))) &
-              ((card2['MCT_SSG_CD'].str.startswith('41')) | (card2['MCT_SSG_CD'].str.startswith('28')) | (card2['MCT_SSG_CD'].str.startswith('11')))].reset_index()
-
-# Select relevant columns for aggregation
-card_y = card3[['CLNN_CTY_CD', 'MCT_SSG_CD', 'RY_CD', 'TIME_CCD', 'SEX_CD', 'TAMT', 'CNT']]
-c_o = card_y['CLNN_CTY_CD'].unique().tolist()
-c_d = card_y['MCT_SSG_CD'].unique().tolist()
-
-# 6. Manual Data Correction
-# Specific handling for regional code '41670' (Yeoju-si) due to code system updates or inconsistencies
-c_o = c_o[:82] + c_o[84:86]
-c_o[82] = '41670'
-c_d[30] = '41670'
-
-# 7. Aggregate Consumption Flow (Total Transaction Amount) by OD Pair
-c_od = []
-for i in tqdm(range(len(c_o)), desc="Aggregating Origins"):
-    for j in tqdm(range(len(c_d)), desc="Aggregating Destinations", leave=False):
-        # Calculate the total transaction amount (TAMT) for each OD pair
-        c_sum = card_y[(card_y['CLNN_CTY_CD'] == c_o[i]) & (card_y['MCT_SSG_CD'] == c_d[j])]['TAMT'].sum()
-        
-        # Map back to standard administrative codes using the master code table
-        c_co = code[code['CODE_AD2'] == c_o[i]]['CODE'].tolist()[0]
-        c_cd = code[code['CODE_AD2'] == c_d[j]]['CODE'].tolist()[0]
-        c_od.append([c_co, c_cd, c_sum])
-        
-# Create a DataFrame for the aggregated consumption flows
-col = ['O', 'D', 'PAY']
-c_y = pd.DataFrame(c_od, columns = col)
+# Within each chunk: the days of 'day_type' in the month (derived from the calendar),
+# Youth Age Group (AGE_2), every category except 'ETC', and both card holder and
+# merchant regions in Seoul(11), Incheon(28) or Gyeonggi(41)
+# 5. Aggregate Consumption Flows (Transaction Amount and Count) by OD Pair
+# TAMT and CNT are summed per (CLNN_CTY_CD, MCT_SSG_CD) in the same pass
+# (with RY_CD and/or the time code as leading levels in category / time-band mode)
+dates = month_dates(ym, day_type, holidays)
+by = (['RY_CD'] if by_category else []) + ([time_band] if time_band else [])
+c_sums, c_o, c_d, report = read_card_od('./KRILA_' + ym + '.csv', dates, chunksize = chunksize,
+                                        ages = ('AGE_2',), exclude_categories = ('ETC',), by = by)
+
+# Rows read and kept after each filter
+print(report)
+
+# 6. Code Corrections
+# Code-change rules (e.g. the former Yeoju-gun code 41730 -> Yeoju-si 41670) are applied
+# declaratively; codes without a study region are dropped and listed in the report
+c_sums, c_o, c_d = cw.normalize_od(c_sums, c_o, c_d)
+print(cw.report())
+
+# 7. Daily Totals, and the per-Category / per-Band Sums derived from the same pass
+n_by = len(by)
+c_full_sums = c_sums
+c_sums = c_full_sums.groupby(level = [n_by, n_by + 1], sort = False).sum() if n_by else c_full_sums
+if time_band:
+    c_band_sums = c_full_sums.groupby(level = [n_by - 1, n_by, n_by + 1], sort = False).sum()
+if by_category:
+    c_cat_sums = c_full_sums.groupby(level = [0, n_by, n_by + 1], sort = False).sum()
+
+# Flows on the full origin x destination grid, mapped back to standard administrative codes
+c_y = od_grid(c_sums['TAMT'], c_o, c_d, cw.lookup('CODE_AD2', 'CODE'), 'PAY')
+c_y['CNT'] = od_grid(c_sums['CNT'], c_o, c_d, cw.lookup('CODE_AD2', 'CODE'), 'CNT')['CNT'].to_numpy()
 
 # Create a unique key for merging with coordinate data
 c_y['CODE'] = c_y['O'].astype(str) + c_y['D'].astype(str)
@@ -78,14 +94,35 @@ od_xy = od_xy[((od_xy['O2'].str.startswith('11')) | (od_xy['O2'].str.startswith(
 od_xy['CODE'] = od_xy['CODE'].astype(str)
 
 # 9. Merge Aggregated Flows with Spatial Metadata
-c_y2 = pd.merge(od_xy, c_y, how = 'left', on = 'CODE')
-c_y2 = c_y2.iloc[:, [0, 1, 2, 3, 4, 5, 6, 7, 8, 11]]
-c_y2.columns = ['O', 'D', 'O_x', 'O_y', 'D_x', 'D_y', 'num_x', 'num_y', 'CODE', 'PAY']
+# (the helper O2/D2 columns and the flow's own O/D are dropped first; with them the
+# positional selection used to pick the origin code of the flow instead of PAY)
+c_y2 = pd.merge(od_xy.drop(columns = ['O2', 'D2']), c_y.drop(columns = ['O', 'D']), how = 'left', on = 'CODE')
+c_y2 = c_y2.iloc[:, [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]]
+c_y2.columns = ['O', 'D', 'O_x', 'O_y', 'D_x', 'D_y', 'num_x', 'num_y', 'CODE', 'PAY', 'CNT']
 
 # 10. Statistical Normalization (Z-score)
 # Standardize the transaction amount (PAY) for subsequent spatial association analysis (e.g., Flow-LISA)
 c_y2['Zpay_P'] = (c_y2['PAY'] - c_y2['PAY'].mean()) / c_y2['PAY'].std()
 
 # 11. Export the Final Processed Dataset
-# Note: Input data is from April 2022, though the filename mentions November
-c_y2.to_csv('./서울인천경기_youthpay_weekend_202204.csv', encoding = 'cp949', index = False)
\ No newline at end of file
+store.write(c_y2, 'youthpay_' + day_type, month = ym, indicator = 'card')
+
+# 12. Time-Band Flows (time-band mode only)
+# Per-time-code flows on the same OD grid, keyed like the daily table for the time-band Flow-LISA
+if time_band:
+    bands = sorted(c_band_sums.index.get_level_values(0).unique())
+    c_b = od_band_grid(c_band_sums['TAMT'], bands, c_o, c_d, cw.lookup('CODE_AD2', 'CODE'), 'PAY')
+    c_b['CODE'] = c_b['O'].astype(str) + c_b['D'].astype(str)
+    c_b = pd.merge(c_y2[['O', 'D', 'num_x', 'num_y', 'CODE']], c_b[['band', 'CODE', 'PAY']], on = 'CODE')
+    store.write(c_b, 'youthpay_' + day_type + '_bands', month = ym, indicator = 'card')
+
+# 13. Category Flows (category mode only)
+# Per-RY_CD amount and count on the same OD grid, keyed like the daily table
+if by_category:
+    cats = sorted(c_cat_sums.index.get_level_values(0).unique())
+    c_c = od_band_grid(c_cat_sums['TAMT'], cats, c_o, c_d, cw.lookup('CODE_AD2', 'CODE'), 'PAY')
+    c_c['CNT'] = od_band_grid(c_cat_sums['CNT'], cats, c_o, c_d, cw.lookup('CODE_AD2', 'CODE'), 'CNT')['CNT'].to_numpy()
+    c_c['CODE'] = c_c['O'].astype(str) + c_c['D'].astype(str)
+    c_c = c_c.rename(columns = {'band': 'RY_CD'})
+    c_c = pd.merge(c_y2[['O', 'D', 'num_x', 'num_y', 'CODE']], c_c[['RY_CD', 'CODE', 'PAY', 'CNT']], on = 'CODE')
+    store.write(c_c, 'youthpay_' + day_type + '_categories', month = ym, indicator = 'card')
\ No newline at end of file
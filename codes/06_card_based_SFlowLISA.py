@@ -1,55 +1,166 @@
 import numpy as np
 import pandas as pd
 
+from yas import flow_weights
+from yas.distance_matrix import load_distance_matrix
+from yas.flow_lisa import classify_lisa, cluster_column, flow_lag, permutation_pvalues, update_lag
+from yas.settings import setting, stage_cpus
+from yas.stage_cache import StageCache, value_hash
+from yas.storage import TableStore, export_csv
+from yas.tiled_lag import scheduler_executor, tiled_lag
+
 # Set float display format to 5 decimal places for statistical precision
 pd.options.display.float_format = '{:.5f}'.format
 
-import warnings
-warnings.filterwarnings(action='ignore')
+# Typed (Parquet) store for the hand-off tables between stages, partitioned by
+# indicator and month; final deliverables are still exported as cp949 CSV
+store = TableStore(setting('STORE', './store'), fmt = setting('STORE_FORMAT', 'parquet'))
+
+# Local stage cache (size-limited, least recently used entries are evicted first)
+cache = StageCache(setting('CACHE', './.stage_cache'))
+
+# Define analysis target month (e.g., November 2022) and day type
+# (overridable by the batch runner)
+ym = setting('MONTH', '202211')
+day_type = setting('DAY_TYPE', 'weekday')
+
+# Memory budget (bytes) for one block of flow-to-flow weight tiles
+max_bytes = 256 * 1024 ** 2
+
+# Out-of-core lag for flow sets beyond RAM (e.g. eup-myeon-dong level): directory for the
+# checkpointed tiles ('' keeps the lag in memory); a run started again after an
+# interruption resumes at the last finished tile. The tiles are computed by
+# 'tile_workers' processes (default: the cores of this stage, see 'workers'), or by
+# the workers of a dask.distributed scheduler at 'tile_scheduler' (e.g. tcp://host:8786)
+tile_dir = setting('TILE_DIR', '') or None
+tile_workers = int(setting('TILE_WORKERS', '0')) or None
+tile_scheduler = setting('TILE_SCHEDULER', '') or None
 
-# Define analysis target month (November 2022)
-ym = ['202211']
+# Neighbour definition: None for both keeps every OD pair as a neighbour;
+# set 'knn' (k nearest flows) and/or 'band' (max dist_o + dist_d) to use
+# sparse weights, cached under 'weights_cache' for reruns on the same geography
+knn = None
+band = None
+weights_cache = './weights_cache'
+
+# Incremental lag: month whose stored lag table (DM_SIG_LAG) is updated instead of
+# recomputing the full lag, e.g. the previous release of this month or the previous
+# month ('' for a full computation); used when at most 'max_changed' of the flows changed
+lag_base = setting('LAG_BASE', '') or None
+max_changed = 0.2
+
+# Significance mode: 'zscore' (Z-score of the Flow-LISA scores) or
+# 'permutation' (conditional permutation pseudo p-values)
+inference = 'zscore'
+permutations = 999   # 999 or 9999
+seed = 12345
+workers = stage_cpus()   # CPU cores of this stage (every available core when run by hand)
+
+# Confidence levels of the cluster columns; 0.99 (Z-score +/- 2.58 or p <= 0.01)
+# fills 'value_Y2', other levels add e.g. 'value_Y2_95'
+levels = [0.99]      # e.g. [0.90, 0.95, 0.99]
 
 # 1. Load Inverse Distance Matrix
 # This matrix represents the geographical distance between administrative units
-p_array = np.array(pd.read_csv('./DistanceMatrix.csv', encoding = 'cp949'))
+# Converted once into a float32 .npy next to the CSV and memory-mapped on later runs,
+# with an explicit node ID (num) -> row index
+dm = load_distance_matrix('./DistanceMatrix.csv')
+p_array = dm.array
 
 # 2. Load Processed Youth Consumption Flow Data
 # The dataset contains standardized youth spending flows (Zyouth_P) in the SMA
-od = pd.read_csv('./서울인천경기_youthpay_weekday_202211.csv', encoding = 'cp949')
+od = store.read('youthpay_' + day_type, month = ym, indicator = 'card',
+                legacy_csv = './서울인천경기_youthpay_' + day_type + '_' + ym + '.csv')
+# 02 stores the standardized amount as 'Zpay_P'
+od = od.rename(columns = {'Zpay_P': 'Zyouth_P'})
 
-# Convert columns to lists to optimize the nested loop performance
-O = list(od.loc[:, 'num_x'])      # Numeric ID for Origin
-D = list(od.loc[:, 'num_y'])      # Numeric ID for Destination
+# Extract the node IDs and standardized values used by the spatial lag engine
+O = list(dm.row_numbers(od.loc[:, 'num_x']))      # Numeric ID for Origin
+D = list(dm.row_numbers(od.loc[:, 'num_y']))      # Numeric ID for Destination
 Zyouth = list(od.loc[:, 'Zyouth_P']) # Standardized consumption value
-idx = od.index
 print("Data listing finished")
 
 # 3. Calculate Spatial Lag for Flows (Flow-based Spatial Lag)
 # This measures the influence of neighboring flows using Inverse Distance Weighting (IDW)
-youth_x = []
-for i in range(len(idx)):
-    middle_y = []
-    for j in range(len(idx)):
-        # Proximity between Origin nodes and Destination nodes respectively
-        dist_o = p_array[O[i]-1][O[j]-1]
-        dist_d = p_array[D[i]-1][D[j]-1]
-        
-        # Skip if there is no proximity (avoid division by zero)
-        if(dist_o + dist_d) == 0:
-            continue
-
-        # Apply IDW: Neighbors with shorter distances have higher weights
-        zy = Zyouth[j] * 1 / (dist_o + dist_d)
-        middle_y.append(zy)
-    
-    # Aggregate weighted neighboring flows to obtain the spatial lag for flow 'i'
-    youth_x.append(sum(middle_y))
+# Weight tiles are built in row blocks bounded by 'max_bytes'
+W = None
+if knn is not None or band is not None:
+    W = flow_weights.load_flow_weights('./DistanceMatrix.csv', O, D, k = knn, band = band,
+                                       cache_dir = weights_cache, p_array = p_array, max_bytes = max_bytes)
+
+# Identity of the weights (distances, neighbour settings and dtype); stored with the
+# lag table so an incremental update never starts from a lag of other weights
+weights_fp = value_hash(cache.fingerprint(inputs = {'DistanceMatrix.csv': './DistanceMatrix.csv'},
+                                         params = {'knn': knn, 'band': band, 'distance_dtype': p_array.dtype.name},
+                                         code = flow_weights.LAG_CODE))
+
+tile_executor = scheduler_executor(tile_scheduler) if tile_dir and tile_scheduler else None
+
+def full_lag(z, name = 'lag'):
+    if W is not None:
+        return flow_weights.sparse_lag(W, z)
+    if tile_dir is not None:
+        work_dir = tile_dir + '/' + '_'.join([name, 'card', day_type, ym])
+        return np.asarray(tiled_lag(dm, O, D, z, work_dir, max_bytes = max_bytes,
+                                    workers = tile_workers or workers, executor = tile_executor))
+    return flow_lag(p_array, O, D, z, max_bytes = max_bytes)
+
+def incremental_lag():
+    # The lag is linear in z: update the base lag for the flows whose raw values changed
+    # and for the shift of re-standardizing every flow (None falls back to the full lag)
+    if not store.exists('DM_SIG_LAG_' + day_type, month = lag_base, indicator = 'card'):
+        print("No lag table of", lag_base, "to update")
+        return None
+    base = store.read('DM_SIG_LAG_' + day_type, month = lag_base, indicator = 'card')
+    base = base.drop_duplicates('CODE').set_index('CODE').reindex(od['CODE'])
+
+    # Raw flow values are every column except the OD keys and the Z-score
+    values = [c for c in od.columns if c not in ('O', 'D', 'num_x', 'num_y', 'CODE', 'Zyouth_P')]
+    if base['youth_lag'].isna().any() or not set(values) <= set(base.columns):
+        print("Flow set differs from", lag_base)
+        return None
+    if 'weights_fp' not in base.columns or (base['weights_fp'] != weights_fp).any():
+        print("Weights differ from those of", lag_base)
+        return None
+    # NaN values present in both months are unchanged
+    old, new = base[values], od[values].set_axis(base.index)
+    changed = ~((old == new) | (old.isna() & new.isna())).to_numpy().all(axis = 1)
+    if changed.mean() > max_changed:
+        print("Too many changed flows for an incremental lag:", changed.sum())
+        return None
+
+    # W 1 only depends on the distances and the flow set, so it is cached once per geography
+    sums_fp = cache.fingerprint(inputs = {'DistanceMatrix.csv': './DistanceMatrix.csv'},
+                                params = {'O': O, 'D': D, 'knn': knn, 'band': band,
+                                          'distance_dtype': p_array.dtype.name},
+                                code = flow_weights.LAG_CODE)
+    row_sums = cache.memoize('lag_row_sums', sums_fp, lambda: full_lag(np.ones(len(O)), 'row_sums'))
+    lag = update_lag(p_array, O, D, base['youth_lag'], base['Zyouth_P'], Zyouth, changed, row_sums,
+                     max_bytes = max_bytes, weights = W)
+    if lag is not None:
+        print("Incremental lag update from", lag_base + ":", changed.sum(), "changed flows")
+    return lag
+
+def compute_lag():
+    lag = incremental_lag() if lag_base is not None else None
+    return full_lag(Zyouth) if lag is None else lag
+
+# The lag only depends on the distances, the flows and the neighbour settings,
+# so it is served from the stage cache when only later steps (e.g. the 2.58
+# threshold) change
+lag_stage = 'lag_card_' + day_type + '_' + ym
+lag_fp = cache.fingerprint(inputs = {'DistanceMatrix.csv': './DistanceMatrix.csv'},
+                           params = {'O': O, 'D': D, 'z': Zyouth, 'knn': knn, 'band': band,
+                                     'distance_dtype': p_array.dtype.name},
+                           code = flow_weights.LAG_CODE)
+for reason in cache.explain(lag_stage, lag_fp):
+    print("Spatial lag recomputed:", reason)
+youth_x = cache.memoize(lag_stage, lag_fp, compute_lag)
 print("Youth flow lag calculation finished")
 
 # Store spatial lag results
 od['youth_lag'] = youth_x
-od.to_csv('./DM_SIG_LAG_weekday_pay_0130.csv', encoding = 'cp949', index = False)
+store.write(od.assign(weights_fp = weights_fp), 'DM_SIG_LAG_' + day_type, month = ym, indicator = 'card')
 
 # 4. Calculate Flow-LISA Statistic
 # Compute the local spatial association indicator for flows
@@ -57,35 +168,29 @@ od['Fl_youth'] = (od['Zyouth_P'] * od['youth_lag']) / od['Zyouth_P']**2
 
 # Standardize Flow-LISA scores to identify statistical significance (Z-score)
 od['Fl_youthsig'] = (od['Fl_youth'] - od['Fl_youth'].mean()) / od['Fl_youth'].std()
+
+# Pseudo p-values from conditional permutations (z of each flow held fixed)
+if inference == 'permutation':
+    od['Fl_youth_p'] = permutation_pvalues(p_array, O, D, Zyouth, permutations = permutations,
+                                          seed = seed, workers = workers, max_bytes = max_bytes, weights = W)
 print("Significance calculation finished")
 
 # 5. Classify Clusters based on LISA Quadrants
 # Categorize flows into HH (High-High), HL (High-Low), LH (Low-High), and LL (Low-Low)
-od['value_Y'] = 0
-for i in idx:
-    if (od['Zyouth_P'][i] >= 0):
-        if (od['youth_lag'][i] >= 0):
-            od['value_Y'][i] = 'HH'
-        else:
-            od['value_Y'][i] = 'HL'
-    else:
-        if (od['youth_lag'][i] >= 0):
-            od['value_Y'][i] = 'LH'
-        else:
-            od['value_Y'][i] = 'LL'
 
 # 6. Significance Filtering (Z-score Threshold)
-# Apply a threshold of 2.58 (99% confidence level) to identify significant clusters
+# Apply a threshold of 2.58 (99% confidence level), and of any further 'levels',
+# to identify significant clusters
 # Flows below the threshold are marked as 'NS' (Non-Significant)
-od['value_Y2'] = 0
-for i in idx:
-    if od['Fl_youthsig'][i] <= -2.58:
-        od['value_Y2'][i] = od['value_Y'][i]
-    elif od['Fl_youthsig'][i] >= 2.58:
-        od['value_Y2'][i] = od['value_Y'][i]
-    else:
-        od['value_Y2'][i] = 'NS'
+# Both steps are vectorized (np.select) into categorical columns
+p_values = od['Fl_youth_p'] if inference == 'permutation' else None
+quadrant, clusters = classify_lisa(od['Zyouth_P'], od['youth_lag'], fl_sig = od['Fl_youthsig'],
+                                   p_values = p_values, levels = levels)
+od['value_Y'] = quadrant
+for level, cluster in clusters.items():
+    od[cluster_column('value_Y2', level)] = cluster
 print("Flow-LISA categorization finished")
 
 # Export final result for spatial mapping and visualization
-od.to_csv('./DM_SIG_Fl_weekday_pay_0130.csv', encoding = 'cp949', index = False)
\ No newline at end of file
+store.write(od, 'DM_SIG_Fl_' + day_type, month = ym, indicator = 'card')
+export_csv(od, './DM_SIG_Fl_' + day_type + '_pay_' + ym + '.csv')
\ No newline at end of file
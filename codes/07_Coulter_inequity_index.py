@@ -1,5 +1,21 @@
 import pandas as pd
 
+from yas.coulter import bootstrap_coulter, coulter_index
+from yas.settings import setting
+from yas.storage import TableStore
+
+# Analysis period and day type of the flows (overridable by the batch runner)
+ym = setting('MONTH', '202211')
+day_type = setting('DAY_TYPE', 'weekday')
+
+# Typed (Parquet) store for the hand-off tables; inputs not stored yet are read from the legacy CSV
+store = TableStore(setting('STORE', './store'), fmt = setting('STORE_FORMAT', 'parquet'))
+
+# Bootstrap replicates for confidence intervals (districts resampled with replacement);
+# 0 reports the point values only
+replicates = int(setting('BOOTSTRAP', '0'))
+level = 0.95
+
 # Set float display format to 5 decimal places for precise inequality index values
 pd.options.display.float_format = '{:.5f}'.format
 
@@ -7,64 +23,27 @@ pd.options.display.float_format = '{:.5f}'.format
 # This index measures the spatial disparity between supply (Housing) and demand/activity (Population/Spending).
 
 # Load aggregated data containing housing supply, population mobility, and consumption statistics
-df = pd.read_csv('./SIG_mpoppoppay+roomcount+size.csv', encoding = 'cp949')
-
-### --- Scenario A: Short-term Population Mobility vs. Housing ---
-
-# A-1. Supply (Unit Count) vs. Demand (Short-term Population)
-upper_a = []
-down_b = []
-for i in range(len(df)):
-    # Numerator part: Squared difference between the share of housing units and the share of population
-    a = (df.loc[i, 'Room_count']/df['Room_count'].sum() - df.loc[i, 'POP/allPOP'])**2
-    # Denominator part: Squared share of the population
-    b = df.loc[i, 'POP/allPOP']**2
-    upper_a.append(a)
-    down_b.append(b)
-    
-# Calculate the final Coulter Index for unit counts (Short-term Pop)
-pop_CI_count = (100 * sum(upper_a)**(1/2)) / ((sum(down_b) - 2*min(down_b) + 1)**(1/2))
-
-# A-2. Supply (Total Floor Area) vs. Demand (Short-term Population)
-upper_a = []
-down_b = []
-for i in range(len(df)):
-    a = (df.loc[i, 'Room_size']/df['Room_size'].sum() - df.loc[i, 'POP/allPOP'])**2
-    b = df.loc[i, 'POP/allPOP']**2
-    upper_a.append(a)
-    down_b.append(b)
-    
-# Calculate the final Coulter Index for housing size (Short-term Pop)
-pop_CI_size = (100 * sum(upper_a)**(1/2)) / ((sum(down_b) - 2*min(down_b) + 1)**(1/2))
-
-
-### --- Scenario B: Medium-term Population Mobility vs. Housing ---
-
-# B-1. Supply (Unit Count) vs. Demand (Medium-term Population)
-upper_a = []
-down_b = []
-for i in range(len(df)):
-    a = (df.loc[i, 'Room_count']/df['Room_count'].sum() - df.loc[i, 'MPOP/allMPOP'])**2
-    b = df.loc[i, 'MPOP/allMPOP']**2
-    upper_a.append(a)
-    down_b.append(b)
-
-# Calculate the final Coulter Index for unit counts (Medium-term Pop)
-pop_CI_count = (100 * sum(upper_a)**(1/2)) / ((sum(down_b) - 2*min(down_b) + 1)**(1/2))
-
-# B-2. Supply (Total Floor Area) vs. Demand (Medium-term Population)
-upper_a = []
-down_b = []
-for i in range(len(df)):
-    a = (df.loc[i, 'Room_size']/df['Room_size'].sum() - df.loc[i, 'MPOP/allMPOP'])**2
-    b = df.loc[i, 'MPOP/allMPOP']**2
-    upper_a.append(a)
-    down_b.append(b)
-    
-# Calculate the final Coulter Index for housing size (Medium-term Pop)
-pop_CI_size = (100 * sum(upper_a)**(1/2)) / ((sum(down_b) - 2*min(down_b) + 1)**(1/2))
-
-
-### --- Scenario C: Short-term Consumption Pattern vs. Housing ---
-
-# C-1. Supply (Unit Count) vs
\ No newline at end of file
+# (district table of 12 for the day type; otherwise the legacy CSV of the month,
+# e.g. SIG_mpoppoppay+roomcount+size_202211.csv, or the undated original)
+df = store.read('SIG_mpoppoppay_roomcount_size_' + day_type, month = ym, indicator = 'coulter',
+                legacy_csv = ['./SIG_mpoppoppay+roomcount+size_' + ym + '.csv',
+                              './SIG_mpoppoppay+roomcount+size.csv'])
+
+# Supply: unit count (Room_count) and total floor area (Room_size)
+# Demand: short-term population (POP), medium-term population (MPOP) and consumption (PAY) shares
+supply = ['Room_count', 'Room_size']
+demand = ['POP/allPOP', 'MPOP/allMPOP', 'PAY/allPAY']
+
+## 2. Coulter Index for every Supply x Demand Scenario
+# Numerator: squared differences between the share of housing and the share of activity;
+# Denominator: squared shares of the activity. All scenarios are computed in one pass:
+# A. Short-term Population, B. Medium-term Population, C. Consumption Pattern vs. Housing
+if replicates:
+    # Point values with the lower/upper bounds of the bootstrap percentile interval
+    ci, _ = bootstrap_coulter(df, supply, demand, replicates, level)
+else:
+    ci = coulter_index(df, supply, demand)
+print(ci)
+
+# 3. Export the scenario table
+store.write(ci, 'Coulter_index_' + day_type, month = ym, indicator = 'coulter')
\ No newline at end of file
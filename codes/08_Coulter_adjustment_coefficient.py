@@ -1,5 +1,21 @@
 import pandas as pd
 
+from yas.coulter import adjustment_values, bootstrap_coulter
+from yas.settings import setting
+from yas.storage import TableStore, export_csv
+
+# Analysis period and day type of the flows (overridable by the batch runner)
+ym = setting('MONTH', '202211')
+day_type = setting('DAY_TYPE', 'weekday')
+
+# Typed (Parquet) store for the hand-off tables between stages, partitioned by
+# indicator and month; final deliverables are still exported as cp949 CSV
+store = TableStore(setting('STORE', './store'), fmt = setting('STORE_FORMAT', 'parquet'))
+
+# Bootstrap replicates for confidence intervals of the coefficients; 0 disables
+replicates = int(setting('BOOTSTRAP', '0'))
+level = 0.95
+
 # Set display format for floating point numbers to 5 decimal places
 pd.options.display.float_format = '{:.5f}'.format
 
@@ -8,62 +24,39 @@ pd.options.display.float_format = '{:.5f}'.format
 # required to achieve spatial equity based on youth activity levels.
 
 # Load the aggregated dataset containing housing supply and activity shares
-df = pd.read_csv('./SIG_mpoppoppay+roomcount+size.csv', encoding = 'cp949')
-
-### --- Scenario A: Short-term Population Mobility vs. Housing ---
-
-# A-1. Adjustment for Unit Count based on Short-term Population
-pop_Ci_count = []
-for i in range(len(df)):
-    # Formula: Actual Supply - (Activity Share * Total Supply)
-    # A positive value indicates oversupply, while a negative value indicates a shortage.
-    a = df.loc[i, 'Room_count'] - df.loc[i, 'POP/allPOP'] * df['Room_count'].sum()
-    pop_Ci_count.append(a)
-    
-# A-2. Adjustment for Total Floor Area based on Short-term Population
-pop_Ci_size = []
-for i in range(len(df)):
-    a = df.loc[i, 'Room_size'] - df.loc[i, 'POP/allPOP'] * df['Room_size'].sum()
-    pop_Ci_size.append(a)
-    
-### --- Scenario B: Medium-term Population Mobility vs. Housing ---
-
-# B-1. Adjustment for Unit Count based on Medium-term Population
-mpop_Ci_count = []
-for i in range(len(df)):
-    a = df.loc[i, 'Room_count'] - df.loc[i, 'MPOP/allMPOP'] * df['Room_count'].sum()
-    mpop_Ci_count.append(a)
-    
-# B-2. Adjustment for Total Floor Area based on Medium-term Population
-mpop_Ci_size = []
-for i in range(len(df)):
-    a = df.loc[i, 'Room_size'] - df.loc[i, 'MPOP/allMPOP'] * df['Room_size'].sum()
-    mpop_Ci_size.append(a)
-    
-### --- Scenario C: Short-term Consumption Pattern vs. Housing ---
-
-# C-1. Adjustment for Unit Count based on Consumption (PAY)
-pay_Ci_count = []
-for i in range(len(df)):
-    a = df.loc[i, 'Room_count'] - df.loc[i, 'PAY/allPAY'] * df['Room_count'].sum()
-    pay_Ci_count.append(a)
-    
-# C-2. Adjustment for Total Floor Area based on Consumption (PAY)
-pay_Ci_size = []
-for i in range(len(df)):
-    a = df.loc[i, 'Room_size'] - df.loc[i, 'PAY/allPAY'] * df['Room_size'].sum()
-    pay_Ci_size.append(a)
-    
-# 2. Integrate the calculated coefficients into the main DataFrame
-df['mpop_Ci_count'] = mpop_Ci_count
-df['mpop_Ci_size'] = mpop_Ci_size
-
-df['pop_Ci_count'] = pop_Ci_count
-df['pop_Ci_size'] = pop_Ci_size
-
-df['pay_Ci_count'] = pay_Ci_count
-df['pay_Ci_size'] = pay_Ci_size
+# (district table of 12 for the day type; otherwise the legacy CSV of the month,
+# e.g. SIG_mpoppoppay+roomcount+size_202211.csv, or the undated original)
+df = store.read('SIG_mpoppoppay_roomcount_size_' + day_type, month = ym, indicator = 'coulter',
+                legacy_csv = ['./SIG_mpoppoppay+roomcount+size_' + ym + '.csv',
+                              './SIG_mpoppoppay+roomcount+size.csv'])
+
+# Coefficient name prefix per demand share and suffix per supply measure
+# (A. Short-term Population, B. Medium-term Population, C. Consumption Pattern vs. Housing)
+demand = {'MPOP/allMPOP': 'mpop', 'POP/allPOP': 'pop', 'PAY/allPAY': 'pay'}
+supply = {'Room_count': 'count', 'Room_size': 'size'}
+
+# 2. Adjustment coefficients for every scenario in one pass
+# Formula: Actual Supply - (Activity Share * Total Supply)
+# A positive value indicates oversupply, while a negative value indicates a shortage.
+if replicates:
+    # Tidy (CODE, supply, demand) table with the bootstrap interval bounds
+    _, coef = bootstrap_coulter(df, list(supply), list(demand), replicates, level)
+else:
+    coef = adjustment_values(df[list(supply)], df[list(demand)])
+
+# Integrate the calculated coefficients into the main DataFrame
+for d, (d_col, d_name) in enumerate(demand.items()):
+    for s, (s_col, s_name) in enumerate(supply.items()):
+        name = d_name + '_Ci_' + s_name
+        if replicates:
+            part = coef[(coef['supply'] == s_col) & (coef['demand'] == d_col)]
+            df[name] = part['Ci'].to_numpy()
+            df[name + '_lower'] = part['lower'].to_numpy()
+            df[name + '_upper'] = part['upper'].to_numpy()
+        else:
+            df[name] = coef[:, s, d]
 
 # 3. Export the final dataset with Coulter Adjustment Indices
 # This output serves as the primary data for spatial policy recommendations.
-df.to_csv('./SIG_mpoppoppay+Coulterindex.csv', encoding = 'cp949', index = False)
\ No newline at end of file
+store.write(df, 'SIG_mpoppoppay_Coulterindex_' + day_type, month = ym, indicator = 'coulter')
+export_csv(df, './SIG_mpoppoppay+Coulterindex_' + day_type + '_' + ym + '.csv')
\ No newline at end of file
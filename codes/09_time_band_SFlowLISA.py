@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+from yas.distance_matrix import load_distance_matrix
+from yas.flow_lisa import classify_lisa, cluster_column, flow_lag
+from yas.flow_weights import load_flow_weights, sparse_lag
+from yas.settings import setting
+from yas.storage import TableStore, export_csv
+
+# Set display format for floating point numbers to maintain 5 decimal places
+pd.options.display.float_format = '{:.5f}'.format
+
+# Typed (Parquet) store for the hand-off tables between stages, partitioned by
+# indicator and month; final deliverables are still exported as cp949 CSV
+store = TableStore(setting('STORE', './store'), fmt = setting('STORE_FORMAT', 'parquet'))
+
+# Analysis period, day type and activity indicator (overridable by the batch runner)
+ym = setting('MONTH', '202211')
+day_type = setting('DAY_TYPE', 'weekday')
+indicator = setting('INDICATOR', 'pop')   # 'pop' (floating population) or 'card' (consumption)
+
+# Per-band flow table written by 01 / 02 in time-band mode (YAS_POP_TIME_BAND / YAS_CARD_TIME_BAND) and its value column
+table, value = {'pop': ('SIG_pop_', 'POP'), 'card': ('youthpay_', 'PAY')}[indicator]
+
+# Optional grouping of the raw time codes into coarser bands, e.g.
+# {'morning': ['07', '08', '09'], 'evening': ['18', '19', '20']}; None keeps every code as a band
+bands = None
+
+# Memory budget (bytes) for one block of flow-to-flow weight tiles and the
+# optional sparse neighbour definition (same settings as 05 / 06)
+max_bytes = 256 * 1024 ** 2
+knn = None
+dist_band = None
+weights_cache = './weights_cache'
+
+# Confidence levels of the cluster columns: 0.99 fills 'cluster', others add e.g. 'cluster_95'
+levels = [0.99]
+
+# 1. Load the Distance Matrix (memory-mapped .npy converted from the CSV)
+dm = load_distance_matrix('./DistanceMatrix.csv')
+
+# 2. Load the Per-Band Flows
+flows = store.read(table + day_type + '_bands', month = ym, indicator = indicator)
+flows['band'] = flows['band'].astype(str)
+if bands is not None:
+    # Flows are additive, so coarser bands are the sum of their time codes
+    band_of = {str(code): label for label, codes in bands.items() for code in codes}
+    flows['band'] = flows['band'].map(band_of)
+    flows = flows.dropna(subset = ['band'])
+    flows = flows.groupby(['band', 'O', 'D', 'num_x', 'num_y', 'CODE'], sort = False)[value].sum().reset_index()
+
+# (bands x flows) matrix of the flow values, flows in the order of their first appearance
+x = flows.pivot_table(index = 'band', columns = 'CODE', values = value, aggfunc = 'sum', sort = False).fillna(0)
+keys = flows.drop_duplicates('CODE').set_index('CODE').loc[x.columns, ['O', 'D', 'num_x', 'num_y']]
+
+# Standardize the flows within every band (Z-score per row)
+z = x.to_numpy()
+z = (z - z.mean(axis = 1, keepdims = True)) / z.std(axis = 1, ddof = 1, keepdims = True)
+
+O = list(dm.row_numbers(keys['num_x']))
+D = list(dm.row_numbers(keys['num_y']))
+print("Listing finished:", x.shape[0], "bands x", x.shape[1], "flows")
+
+# 3. Spatial Lag of all Bands at once
+# Every weight tile is built once and applied to the (bands x flows) matrix
+if knn is not None or dist_band is not None:
+    W = load_flow_weights('./DistanceMatrix.csv', O, D, k = knn, band = dist_band,
+                          cache_dir = weights_cache, p_array = dm.array, max_bytes = max_bytes)
+    lag = sparse_lag(W, z)
+else:
+    lag = flow_lag(dm.array, O, D, z, max_bytes = max_bytes)
+print("Flow spatial lag calculation finished")
+
+# 4. Flow-LISA per Band and its Z-score within the band
+fl = (z * lag) / z**2
+fl_sig = (fl - np.nanmean(fl, axis = 1, keepdims = True)) / np.nanstd(fl, axis = 1, ddof = 1, keepdims = True)
+
+# 5. LISA Quadrants and Significant Clusters (99% confidence, Z-score threshold +/- 2.58)
+# Flattened row-major, i.e. in the order of the long table below
+quadrant, clusters = classify_lisa(z, lag, fl_sig = fl_sig, levels = levels)
+
+# 6. Long-Format Cluster Table (one row per band and flow)
+n_bands, n_flows = z.shape
+result = pd.DataFrame({'band': np.repeat(x.index.to_numpy(), n_flows),
+                       'CODE': np.tile(x.columns.to_numpy(), n_bands)})
+for col in ['O', 'D', 'num_x', 'num_y']:
+    result[col] = np.tile(keys[col].to_numpy(), n_bands)
+result[value] = x.to_numpy().ravel()
+result['Z'] = z.ravel()
+result['lag'] = lag.ravel()
+result['Fl'] = fl.ravel()
+result['Fl_sig'] = fl_sig.ravel()
+result['quadrant'] = quadrant
+for level, cluster in clusters.items():
+    result[cluster_column('cluster', level)] = cluster
+
+# Number of flows per cluster and band, to follow the shift across the day
+print(pd.crosstab(result['band'], result['cluster']))
+
+store.write(result, 'DM_SIG_Fl_' + day_type + '_bands', month = ym, indicator = indicator)
+export_csv(result, './DM_SIG_Fl_' + day_type + '_bands_' + indicator + '_' + ym + '.csv')
@@ -0,0 +1,58 @@
+import pandas as pd
+
+from yas.coulter import allocate_housing
+from yas.settings import setting
+from yas.storage import TableStore, export_csv
+
+# Analysis period and day type of the flows (overridable by the batch runner)
+ym = setting('MONTH', '202211')
+day_type = setting('DAY_TYPE', 'weekday')
+
+# Typed (Parquet) store for the hand-off tables; inputs not stored yet are read from the legacy CSV
+store = TableStore(setting('STORE', './store'), fmt = setting('STORE_FORMAT', 'parquet'))
+
+# Number of new housing units to allocate, placed 'step' units at a time
+budget = int(setting('UNITS', '1000'))
+step = int(setting('ALLOCATION_STEP', '1'))
+
+# Optional per-district capacity (CSV with CODE and capacity: the most new units a district can take);
+# without it every district can take any number of units
+capacity_file = setting('CAPACITY', '')
+
+# Set float display format to 5 decimal places for precise inequality index values
+pd.options.display.float_format = '{:.5f}'.format
+
+## 1. Load the District Supply and Activity Shares
+# (district table of 12 for the day type; otherwise the legacy CSV of the month,
+# e.g. SIG_mpoppoppay+roomcount+size_202211.csv, or the undated original)
+df = store.read('SIG_mpoppoppay_roomcount_size_' + day_type, month = ym, indicator = 'coulter',
+                legacy_csv = ['./SIG_mpoppoppay+roomcount+size_' + ym + '.csv',
+                              './SIG_mpoppoppay+roomcount+size.csv'])
+
+if capacity_file:
+    cap = pd.read_csv(capacity_file, encoding = 'cp949')
+    df['capacity'] = df['CODE'].map(cap.set_index('CODE')['capacity']).fillna(0)
+    capacity = 'capacity'
+else:
+    capacity = None
+
+## 2. Allocate the Units to minimize Coulter's Inequity Index
+# Supply is the unit count (Room_count); each demand scenario is solved on its own
+# (A. Short-term Population, B. Medium-term Population, C. Consumption Pattern),
+# and all three together with equal weights
+scenarios = {'pop': ['POP/allPOP'], 'mpop': ['MPOP/allMPOP'], 'pay': ['PAY/allPAY'],
+             'all': ['POP/allPOP', 'MPOP/allMPOP', 'PAY/allPAY']}
+
+result = df[['CODE', 'Room_count']].copy()
+index = []
+for name, demand in scenarios.items():
+    alloc, ci = allocate_housing(df, demand, budget, capacity = capacity, step = step)
+    result['units_' + name] = alloc['units'].to_numpy()
+    index.append(ci.assign(scenario = name))
+index = pd.concat(index, ignore_index = True)[['scenario', 'demand', 'CI_before', 'CI_after']]
+print(index)
+
+# 3. Export the allocation per district and the index before/after per scenario
+store.write(result, 'Housing_allocation_' + day_type, month = ym, indicator = 'coulter')
+store.write(index, 'Housing_allocation_index_' + day_type, month = ym, indicator = 'coulter')
+export_csv(result, './Housing_allocation_' + day_type + '_' + ym + '.csv')
\ No newline at end of file
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from yas.distance_matrix import load_distance_matrix
+from yas.flow_lisa import bivariate_table, flow_lag, permutation_pvalues
+from yas.flow_weights import load_flow_weights, sparse_lag
+from yas.settings import setting, stage_cpus
+from yas.storage import TableStore, export_csv
+
+# Set display format for floating point numbers to maintain 5 decimal places
+pd.options.display.float_format = '{:.5f}'.format
+
+# Typed (Parquet) store for the hand-off tables between stages, partitioned by
+# indicator and month; final deliverables are still exported as cp949 CSV
+store = TableStore(setting('STORE', './store'), fmt = setting('STORE_FORMAT', 'parquet'))
+
+# Define analysis target month (e.g., November 2022) and day type
+# (overridable by the batch runner)
+ym = setting('MONTH', '202211')
+day_type = setting('DAY_TYPE', 'weekday')
+
+# Memory budget (bytes) for one block of flow-to-flow weight tiles
+max_bytes = 256 * 1024 ** 2
+
+# Neighbour definition, as in 05/06: None for both keeps every OD pair as a neighbour
+knn = None
+band = None
+weights_cache = './weights_cache'
+
+# Housing supply of a flow: units (Room_count) or floor area (Room_size) of the
+# origin ('O') or destination ('D') district, or of both ends summed ('OD')
+supply_col = 'Room_count'
+supply_end = setting('SUPPLY_END', 'O')
+
+# Significance mode: 'zscore' (Z-score of the bivariate scores) or
+# 'permutation' (conditional permutation pseudo p-values of the lags)
+inference = 'zscore'
+permutations = 999
+seed = 12345
+workers = stage_cpus()   # CPU cores of this stage (every available core when run by hand)
+
+# Confidence levels of the cluster columns (see 05)
+levels = [0.99]
+
+# 1. Load the Distance Matrix and the Flows of both Indicators
+dm = load_distance_matrix('./DistanceMatrix.csv')
+p_array = dm.array
+
+pop = store.read('SIG_pop_' + day_type, month = ym, indicator = 'pop',
+                 legacy_csv = './서울인천경기_youthmove_' + day_type + '_' + ym + '.csv')
+card = store.read('youthpay_' + day_type, month = ym, indicator = 'card',
+                  legacy_csv = './서울인천경기_youthpay_' + day_type + '_' + ym + '.csv')
+
+# Flows present in both indicators (keyed by origin and destination codes)
+od = pop[['O', 'D', 'num_x', 'num_y', 'POP']].merge(card[['O', 'D', 'PAY']], on = ['O', 'D'])
+print("Flows in both indicators:", len(od), "of", len(pop), "(pop) and", len(card), "(card)")
+
+# 2. Supply-derived Flow Attribute
+# Happy Housing supply per district (04) at the chosen end(s) of every flow
+house = store.read('SIG_happyhouse', indicator = 'housing', legacy_csv = './SIG_happyhouse.csv')
+house = house.set_index(house['CODE'].astype(str))[supply_col]
+ends = {'O': ['O'], 'D': ['D'], 'OD': ['O', 'D']}[supply_end]
+codes = {end: od[end].astype(str) for end in ends}
+# Districts without a housing row count as 0 units; they are listed, since
+# mismatched codes would otherwise silently zero the whole attribute
+unmatched = sorted(set().union(*(c[~c.isin(house.index)] for c in codes.values())))
+if unmatched:
+    print("Districts without housing supply (counted as 0):", len(unmatched), unmatched)
+od['HOUSE'] = sum(codes[end].map(house).fillna(0).to_numpy() for end in ends)
+
+# 3. Standardize every Attribute over the common Flows
+# (Zyouth_P and Zpay_P of 01/02 are re-standardized, as the flow set is the intersection)
+names = ['house', 'pop', 'pay']
+raw = od[['HOUSE', 'POP', 'PAY']].to_numpy(dtype = float).T
+std = raw.std(axis = 1, ddof = 1, keepdims = True)
+constant = [name for name, sd in zip(names, std.ravel()) if not sd > 0]
+if constant:
+    raise ValueError('No variance in %s over the %d common flows (%d districts without housing supply)'
+                     % (', '.join(constant), len(od), len(unmatched)))
+z = (raw - raw.mean(axis = 1, keepdims = True)) / std
+for name, row in zip(names, z):
+    od['Z' + name] = row
+
+# 4. Cross Spatial Lags of all Attributes in one Pass
+# Every weight tile is built once and applied to the (attributes x flows) matrix
+O = list(dm.row_numbers(od.loc[:, 'num_x']))
+D = list(dm.row_numbers(od.loc[:, 'num_y']))
+W = None
+if knn is not None or band is not None:
+    W = load_flow_weights('./DistanceMatrix.csv', O, D, k = knn, band = band,
+                          cache_dir = weights_cache, p_array = p_array, max_bytes = max_bytes)
+lag = flow_lag(p_array, O, D, z, max_bytes = max_bytes) if W is None else sparse_lag(W, z)
+for name, row in zip(names, lag):
+    od[name + '_lag'] = row
+print("Flow spatial lag calculation finished")
+
+# Pseudo p-values of each attribute's lag (shared by every pair with that lagged attribute)
+p_values = None
+if inference == 'permutation':
+    p_values = np.vstack([permutation_pvalues(p_array, O, D, row, permutations = permutations, seed = seed,
+                                              workers = workers, max_bytes = max_bytes, weights = W)
+                          for row in z])
+print("Significance calculation finished")
+
+# 5. Bivariate Flow-LISA Scores and Clusters of every Attribute Pair
+# e.g. value_house_pop: housing supply of the flow (H/L) against the youth movement
+# of neighbouring flows (H/L); value2_house_pop: the same where significant, else 'NS'
+table = bivariate_table(names, z, lag, p_values = p_values, levels = levels)
+od = pd.concat([od, table], axis = 1)
+print(od.filter(like = 'value2_').apply(lambda c: c.value_counts()).T)
+
+# Save the result for visualization (e.g., Mapping)
+store.write(od, 'DM_SIG_Fl_bivariate_' + day_type, month = ym, indicator = 'housing')
+export_csv(od, './DM_SIG_Fl_bivariate_' + day_type + '_' + ym + '.csv')
\ No newline at end of file
@@ -0,0 +1,52 @@
+import pandas as pd
+
+from yas.coulter import demand_shares
+from yas.settings import setting
+from yas.storage import TableStore
+
+# Analysis period and day type of the flows (overridable by the batch runner)
+ym = setting('MONTH', '202211')
+day_type = setting('DAY_TYPE', 'weekday')
+
+# Typed (Parquet) store for the hand-off tables; inputs not stored yet are read from the legacy CSV
+store = TableStore(setting('STORE', './store'), fmt = setting('STORE_FORMAT', 'parquet'))
+
+# Demand share definition: a district's share of an activity (POP, MPOP, PAY) is its share of
+# the flows ending there ('D'), i.e. where young people spend their day and their money.
+# The published SIG_mpoppoppay+roomcount+size.csv was prepared outside this repository and
+# does not record which end it used, so this is a decision of the pipeline, not a
+# reproduction of that table; 'O' (home end) or 'OD' (both ends) are set with YAS_SHARE_END
+share_end = setting('SHARE_END', 'D')
+print('Demand shares at flow end:', share_end)
+
+## 1. Load the Inputs
+# Study districts with their resident youth (03)
+r_df = store.read('SIG_rpop', month = ym, indicator = 'rpop')
+
+# Happy Housing supply per district (04)
+house = store.read('SIG_happyhouse', indicator = 'housing', legacy_csv = './SIG_happyhouse.csv')
+house = house.set_index(house['CODE'].astype(str))
+
+# Short-term population (01), medium-term population (prepared) and consumption (02) flows
+pop = store.read('SIG_pop_' + day_type, month = ym, indicator = 'pop',
+                 legacy_csv = './서울인천경기_youthmove_' + day_type + '_' + ym + '.csv')
+mpop = store.read('SIG_mpop_' + day_type, month = ym, indicator = 'mpop',
+                  legacy_csv = './SIG_mpop_' + day_type + '_' + ym + '.csv')
+card = store.read('youthpay_' + day_type, month = ym, indicator = 'card',
+                  legacy_csv = './서울인천경기_youthpay_' + day_type + '_' + ym + '.csv')
+
+## 2. District Table for the Coulter Index (07, 08 and 10)
+# Supply of every district, with 0 units where there is no Happy Housing
+codes = r_df['CODE'].astype(str)
+print('Regions without Happy Housing:', r_df.loc[~codes.isin(house.index).to_numpy(), 'CODE'].tolist())
+table = r_df[['CODE']].copy()
+for col in ('Room_count', 'Room_size'):
+    table[col] = codes.map(house[col]).fillna(0).astype(house[col].dtype).to_numpy()
+
+# Activity shares at the flows' share_end, and the resident youth share
+for name, flows in (('POP', pop), ('MPOP', mpop), ('PAY', card)):
+    table[name + '/all' + name] = demand_shares(flows, codes, name, share_end)
+table['RPOP/allRPOP'] = r_df['RPOP'] / r_df['RPOP'].sum()
+
+## 3. Export the District Table of the Month and Day Type
+store.write(table, 'SIG_mpoppoppay_roomcount_size_' + day_type, month = ym, indicator = 'coulter')
\ No newline at end of file
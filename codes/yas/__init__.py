@@ -0,0 +1,2 @@
+"""Shared modules of the numbered analysis scripts in codes/ (storage, Flow-LISA,
+Coulter index, stage cache, batch runner and the `yas` CLI)."""
@@ -0,0 +1,291 @@
+"""Batch runner for multi-month / multi-day-type / multi-indicator runs.
+
+Each (month, day type, indicator) chain (preprocessing -> Flow-LISA) runs as
+a sequence of the numbered scripts in its own process; independent chains are
+spread over a process pool. Once every chain of a month has finished, the
+month's Coulter stages (resident population -> district table -> index ->
+coefficients) are scheduled per day type from pipeline.task_graph, each
+reading the flows of its own day type. Outputs land in the store partitions of each month and indicator.
+Scripts whose inputs, code and settings are unchanged are served from the
+stage cache; the chain logs explain why any other script reran, and a
+JSON-lines profile log next to each chain log records the time, peak RSS and
+rows of every step.
+
+Example:
+    python -m yas.batch --months 202201 202202 202203 --day-types weekday weekend \
+                        --indicators pop card --workers 8 --data-dir ../data
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from yas.period import DAY_TYPES
+from yas.pipeline import STAGES, task_graph
+from yas.settings import available_cpus, run_env
+from yas.stage_cache import StageCache, code_files
+from yas.storage import EXTENSIONS
+
+# Directory holding this package: codes/ of a source checkout, or site-packages
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Directory of the numbered scripts: installed with the package as yas/stages/,
+# next to the package in a source checkout
+CODE_DIR = os.path.join(PACKAGE_ROOT, 'yas', 'stages')
+if not os.path.isdir(CODE_DIR):
+    CODE_DIR = PACKAGE_ROOT
+
+# Scripts run in order for each indicator; the mpop flows have no preprocessing
+# script here and are read as prepared (SIG_mpop_<day type>_<month>.csv)
+CHAINS = {'pop': ['01_pop_preprocessing.py', '05_pop_based_SFlowLISA.py'],
+          'mpop': ['05_pop_based_SFlowLISA.py'],
+          'card': ['02_card_preprocessing.py', '06_card_based_SFlowLISA.py']}
+
+# Stages of a month run after all of its indicator chains, in the order of
+# their file dependencies (pipeline.task_graph)
+COULTER_STAGES = ('03', '12', '07', '08')
+
+
+# Input and output files of each script, relative to the data directory.
+# {store}/{ext} are the store root and file extension of the store format;
+# {flow} and {flow_csv} are the flow table and legacy CSV of the pop/mpop
+# indicator used by 05 and {bands} the per-band flow table of the indicator used by 09
+STAGE_FILES = {
+    '01_pop_preprocessing.py': (
+        ['CODE_2023.01.01.csv', 'od_xy_num_0716.csv', '성연령최종파일_{month}.csv'],
+        ['{store}/indicator=pop/month={month}/SIG_pop_{day_type}{ext}',
+         '{store}/indicator=pop/month={month}/SIG_pop_{day_type}_bands{ext}']),
+    '02_card_preprocessing.py': (
+        ['CODE_2023.01.01.csv', 'od_xy_num_0716.csv', 'KRILA_{month}.csv'],
+        ['{store}/indicator=card/month={month}/youthpay_{day_type}{ext}',
+         '{store}/indicator=card/month={month}/youthpay_{day_type}_bands{ext}',
+         '{store}/indicator=card/month={month}/youthpay_{day_type}_categories{ext}']),
+    '03_youth_resident_preprocessing.py': (
+        ['{month}_연령별인구현황_월간.csv', 'CODE_2023.01.01.csv', 'SIG_mpop_{day_type}_{month}.csv',
+         '{store}/indicator=mpop/month={month}/SIG_mpop_{day_type}{ext}'],
+        ['{store}/indicator=rpop/month={month}/SIG_rpop{ext}']),
+    '04_happy_housing_preprocessing.py': (
+        ['bnd_sigungu_00_2022_2022_2Q.shp', '행복주택_서울+인천+경기_v3_WGS.shp', 'SIG_happyhouse.shp'],
+        ['{store}/indicator=housing/SIG_happyhouse{ext}',
+         '{store}/indicator=housing/SIG_happyhouse_districts{ext}',
+         '{store}/indicator=housing/SIG_happyhouse_projects{ext}']),
+    '05_pop_based_SFlowLISA.py': (
+        ['DistanceMatrix.csv', '{flow_csv}', '{store}/indicator={indicator}/month={month}/{flow}_{day_type}{ext}'],
+        ['{store}/indicator={indicator}/month={month}/DM_SIG_LAG_{day_type}{ext}',
+         '{store}/indicator={indicator}/month={month}/DM_SIG_Fl_{day_type}{ext}',
+         'DM_SIG_Fl_{day_type}_{indicator}_{month}.csv']),
+    '06_card_based_SFlowLISA.py': (
+        ['DistanceMatrix.csv', '서울인천경기_youthpay_{day_type}_{month}.csv',
+         '{store}/indicator=card/month={month}/youthpay_{day_type}{ext}'],
+        ['{store}/indicator=card/month={month}/DM_SIG_LAG_{day_type}{ext}',
+         '{store}/indicator=card/month={month}/DM_SIG_Fl_{day_type}{ext}',
+         'DM_SIG_Fl_{day_type}_pay_{month}.csv']),
+    '07_Coulter_inequity_index.py': (
+        ['SIG_mpoppoppay+roomcount+size_{month}.csv', 'SIG_mpoppoppay+roomcount+size.csv',
+         '{store}/indicator=coulter/month={month}/SIG_mpoppoppay_roomcount_size_{day_type}{ext}'],
+        ['{store}/indicator=coulter/month={month}/Coulter_index_{day_type}{ext}']),
+    '08_Coulter_adjustment_coefficient.py': (
+        ['SIG_mpoppoppay+roomcount+size_{month}.csv', 'SIG_mpoppoppay+roomcount+size.csv',
+         '{store}/indicator=coulter/month={month}/SIG_mpoppoppay_roomcount_size_{day_type}{ext}'],
+        ['{store}/indicator=coulter/month={month}/SIG_mpoppoppay_Coulterindex_{day_type}{ext}',
+         'SIG_mpoppoppay+Coulterindex_{day_type}_{month}.csv']),
+    '09_time_band_SFlowLISA.py': (
+        ['DistanceMatrix.csv', '{store}/indicator={indicator}/month={month}/{bands}_{day_type}_bands{ext}'],
+        ['{store}/indicator={indicator}/month={month}/DM_SIG_Fl_{day_type}_bands{ext}',
+         'DM_SIG_Fl_{day_type}_bands_{indicator}_{month}.csv']),
+    '10_housing_allocation.py': (
+        ['SIG_mpoppoppay+roomcount+size_{month}.csv', 'SIG_mpoppoppay+roomcount+size.csv',
+         '{store}/indicator=coulter/month={month}/SIG_mpoppoppay_roomcount_size_{day_type}{ext}'],
+        ['{store}/indicator=coulter/month={month}/Housing_allocation_{day_type}{ext}',
+         '{store}/indicator=coulter/month={month}/Housing_allocation_index_{day_type}{ext}',
+         'Housing_allocation_{day_type}_{month}.csv']),
+    '11_bivariate_SFlowLISA.py': (
+        ['DistanceMatrix.csv', '서울인천경기_youthmove_{day_type}_{month}.csv',
+         '서울인천경기_youthpay_{day_type}_{month}.csv',
+         '{store}/indicator=pop/month={month}/SIG_pop_{day_type}{ext}',
+         '{store}/indicator=card/month={month}/youthpay_{day_type}{ext}',
+         'SIG_happyhouse.csv', '{store}/indicator=housing/SIG_happyhouse{ext}'],
+        ['{store}/indicator=housing/month={month}/DM_SIG_Fl_bivariate_{day_type}{ext}',
+         'DM_SIG_Fl_bivariate_{day_type}_{month}.csv']),
+    '12_coulter_district_table.py': (
+        ['{store}/indicator=rpop/month={month}/SIG_rpop{ext}',
+         'SIG_happyhouse.csv', '{store}/indicator=housing/SIG_happyhouse{ext}',
+         '서울인천경기_youthmove_{day_type}_{month}.csv', '{store}/indicator=pop/month={month}/SIG_pop_{day_type}{ext}',
+         'SIG_mpop_{day_type}_{month}.csv', '{store}/indicator=mpop/month={month}/SIG_mpop_{day_type}{ext}',
+         '서울인천경기_youthpay_{day_type}_{month}.csv', '{store}/indicator=card/month={month}/youthpay_{day_type}{ext}'],
+        ['{store}/indicator=coulter/month={month}/SIG_mpoppoppay_roomcount_size_{day_type}{ext}']),
+}
+
+
+def stage_files(script, context, data_dir = '.'):
+    """Absolute (inputs, outputs) paths of a script for one run context."""
+    values = dict(context, ext = EXTENSIONS[context['store_format']],
+                  flow = {'mpop': 'SIG_mpop'}.get(context['indicator'], 'SIG_pop'),
+                  flow_csv = {'mpop': 'SIG_mpop_{day_type}_{month}.csv'}.get(
+                      context['indicator'], '서울인천경기_youthmove_{day_type}_{month}.csv').format(**context),
+                  bands = {'card': 'youthpay'}.get(context['indicator'], 'SIG_pop'))
+    inputs, outputs = STAGE_FILES[script]
+    resolve = lambda p: os.path.normpath(os.path.join(data_dir, p.format(**values)))
+    return [resolve(p) for p in inputs], [resolve(p) for p in outputs]
+
+
+def check_scripts(scripts):
+    """Raise FileNotFoundError naming the scripts missing from CODE_DIR."""
+    missing = [s for s in scripts if not os.path.exists(os.path.join(CODE_DIR, s))]
+    if missing:
+        raise FileNotFoundError('Stage scripts not found in %s: %s; reinstall the package (pip install .) '
+                                'or run from codes/ of a source checkout' % (CODE_DIR, ', '.join(missing)))
+
+
+def run_chain(scripts, context, data_dir, log_path, cache_dir = None, profile = None, resources = None):
+    """Run scripts one after another; stop at the first failure.
+
+    With a cache directory, a script whose inputs, code and settings are
+    unchanged is skipped and its outputs are restored from the stage cache;
+    otherwise the log records why it reran. Step timings, peak RSS and row
+    counts of every script are appended to <log>.jsonl (see yas.instrument);
+    profile ('cprofile' or 'pyinstrument') also writes a trace per script
+    into the <log> directory. resources are settings that do not change the
+    results (e.g. {'stage_cpus': 2}) and stay out of the cache fingerprint.
+    Returns (returncode, seconds, failed script or None).
+    """
+    env = run_env(**context, **(resources or {}), **({'cache': cache_dir} if cache_dir else {}))
+    # The yas package is importable by the stage processes without installing it
+    python_path = os.pathsep.join([PACKAGE_ROOT] + [p for p in [os.environ.get('PYTHONPATH')] if p])
+    cache = StageCache(cache_dir) if cache_dir else None
+
+    profile_log = os.path.splitext(log_path)[0] + '.jsonl'
+    os.makedirs(os.path.dirname(log_path), exist_ok = True)
+    start = time.perf_counter()
+    with open(log_path, 'w', encoding = 'utf-8') as log:
+        for script in scripts:
+            log.write('### ' + script + '\n')
+
+            if cache is not None:
+                stage = '_'.join([script, context['month'], context['day_type'], context['indicator']])
+                inputs, outputs = stage_files(script, context, data_dir)
+                fingerprint = cache.fingerprint(inputs = {os.path.relpath(p, data_dir): p for p in inputs},
+                                                params = context,
+                                                code = code_files(os.path.join(CODE_DIR, script)))
+                if cache.restore(stage, fingerprint, outputs):
+                    log.write('cached: inputs, code and settings unchanged\n')
+                    continue
+                for reason in cache.explain(stage, fingerprint):
+                    log.write('rerun: ' + reason + '\n')
+            log.flush()
+
+            # Each script runs as an instrumented stage; per-step timings go to the profile log
+            proc = subprocess.run([sys.executable, '-m', 'yas.instrument',
+                                   os.path.join(CODE_DIR, script), '--log', profile_log,
+                                   '--profile-dir', os.path.splitext(log_path)[0]] +
+                                  (['--profile', profile] if profile else []),
+                                  cwd = data_dir, env = {**os.environ, **env, 'PYTHONPATH': python_path},
+                                  stdout = log, stderr = subprocess.STDOUT)
+            if proc.returncode != 0:
+                return proc.returncode, time.perf_counter() - start, script
+            if cache is not None:
+                cache.save(stage, fingerprint, outputs)
+    return 0, time.perf_counter() - start, None
+
+
+def run_batch(months, day_types = ('weekday',), indicators = ('pop', 'card'), workers = None,
+              data_dir = '.', store = './store', coulter = True, cache = './.stage_cache',
+              store_format = 'parquet', bootstrap = 0, profile = None):
+    """Run every chain and return a list of result dicts (one per chain or Coulter stage)."""
+    check_scripts([s for i in indicators for s in CHAINS[i]] +
+                  ([STAGES[s][0] for s in COULTER_STAGES] if coulter else []))
+    data_dir = os.path.abspath(data_dir)
+    store = os.path.abspath(os.path.join(data_dir, store))
+    cache = os.path.abspath(os.path.join(data_dir, cache)) if cache else None
+    log_dir = os.path.join(store, 'logs')
+    # Chains share the cores, so the process pools of a chain (e.g. the tiled lag) get their part
+    workers = workers or available_cpus()
+    resources = {'stage_cpus': max(1, available_cpus() // workers)}
+
+    def submit(pool, month, day_type, indicator, scripts, stage = None):
+        context = {'month': month, 'day_type': day_type, 'indicator': indicator,
+                   'store': store, 'store_format': store_format}
+        if indicator == 'coulter' and bootstrap:
+            context['bootstrap'] = bootstrap
+        log_path = os.path.join(log_dir, '_'.join([month, day_type, indicator] + ([stage] if stage else [])) + '.log')
+        key = (month, day_type, indicator, stage)
+        return pool.submit(run_chain, scripts, context, data_dir, log_path, cache, profile, resources), key
+
+    def result(month, day_type, indicator, stage, code, seconds, failed):
+        return {'month': month, 'day_type': day_type, 'indicator': indicator, 'stage': stage,
+                'returncode': code, 'seconds': round(seconds, 2), 'failed': failed}
+
+    results = []
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        pending = dict(submit(pool, m, t, i, CHAINS[i])
+                       for m in months for t in day_types for i in indicators)
+        # Number of indicator chains still running per month
+        remaining = {m: len(day_types) * len(indicators) for m in months}
+        # Coulter tasks (stage, month, day type) waiting for their upstream tasks, and return codes
+        waiting, status = {}, {}
+
+        while pending:
+            done, _ = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                month, day_type, indicator, stage = pending.pop(future)
+                try:
+                    code, seconds, failed = future.result()
+                except Exception as e:
+                    # The chain could not run (e.g. its log directory is not writable)
+                    code, seconds, failed = 1, 0.0, type(e).__name__ + ': ' + str(e)
+                results.append(result(month, day_type, indicator, stage, code, seconds, failed))
+
+                if stage is not None:
+                    status[(stage, month, day_type)] = code
+                    continue
+                remaining[month] -= 1
+                if coulter and remaining[month] == 0:
+                    waiting.update(task_graph(COULTER_STAGES, [month], day_types, store_format))
+
+            # Coulter tasks run once their upstream tasks succeeded; downstream of a failure they are skipped
+            for task, upstream in list(waiting.items()):
+                stage, month, day_type = task
+                if any(status.get(up) not in (None, 0) for up in upstream):
+                    status[task] = 'skipped'
+                    results.append(result(month, day_type, 'coulter', stage, None, 0, 'upstream failed'))
+                    del waiting[task]
+                elif all(status.get(up) == 0 for up in upstream):
+                    future, key = submit(pool, month, day_type, 'coulter', [STAGES[stage][0]], stage)
+                    pending[future] = key
+                    del waiting[task]
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run the pipeline for several months in parallel.')
+    parser.add_argument('--months', nargs = '+', required = True, help = 'YYYYMM months')
+    parser.add_argument('--day-types', nargs = '+', default = ['weekday'], choices = DAY_TYPES)
+    parser.add_argument('--indicators', nargs = '+', default = ['pop', 'card'], choices = list(CHAINS))
+    parser.add_argument('--workers', type = int, default = None, help = 'Processes (default: available CPU cores)')
+    parser.add_argument('--data-dir', default = '.', help = 'Directory holding the raw input files')
+    parser.add_argument('--store', default = './store', help = 'Store root, relative to the data directory')
+    parser.add_argument('--store-format', default = 'parquet', choices = list(EXTENSIONS))
+    parser.add_argument('--cache', default = './.stage_cache', help = 'Stage cache, relative to the data directory')
+    parser.add_argument('--no-cache', action = 'store_true', help = 'Rerun every stage')
+    parser.add_argument('--no-coulter', action = 'store_true', help = 'Skip the Coulter stages of every month')
+    parser.add_argument('--bootstrap', type = int, default = 0,
+                        help = 'Bootstrap replicates for the Coulter confidence intervals (0: off)')
+    parser.add_argument('--profile', default = None, choices = ['cprofile', 'pyinstrument'],
+                        help = 'Also write a profiler trace of every script next to the logs')
+    args = parser.parse_args()
+
+    try:
+        results = run_batch(args.months, args.day_types, args.indicators, args.workers,
+                            args.data_dir, args.store, coulter = not args.no_coulter,
+                            cache = None if args.no_cache else args.cache, store_format = args.store_format,
+                            bootstrap = args.bootstrap, profile = args.profile)
+    except FileNotFoundError as e:
+        # Stage scripts missing from the installation
+        sys.exit('yas.batch: ' + str(e))
+    for r in sorted(results, key = lambda r: (r['month'], r['day_type'], r['indicator'], r['stage'] or '')):
+        status = 'ok' if r['returncode'] == 0 else r['failed'] if r['returncode'] is None else 'FAILED at ' + r['failed']
+        print(r['month'], r['day_type'], r['indicator'], r['stage'] or '', str(r['seconds']) + 's', status)
+    sys.exit(0 if all(r['returncode'] == 0 for r in results) else 1)
@@ -0,0 +1,312 @@
+"""Vectorized Coulter inequity index over supply x demand scenarios.
+
+For a supply column s (e.g. Room_count) and a demand share column d
+(e.g. POP/allPOP, already summing to 1 over districts):
+
+    CI = 100 * sqrt(sum_i (s_i / sum(s) - d_i)^2) / sqrt(sum_i d_i^2 - 2 * min_i d_i^2 + 1)
+
+All supply x demand combinations are evaluated in one broadcasted pass; with
+groups (e.g. month x age band), the districts are sorted by group and the sums
+become segment reductions (np.add.reduceat) over the sorted rows, so hundreds
+of groups are still one pass.
+
+Uncertainty is estimated with a district bootstrap: every replicate draws the
+districts with replacement, held as a (replicates x districts) array of draw
+counts, so a block of replicates is one weighted NumPy expression instead of
+a DataFrame pass per replicate.
+
+allocate_units answers the planning question the index raises: where the
+next N units lower it the most. Units are placed greedily, scoring every
+district at once from three running sums (sum s^2, sum s*d, sum s), so a
+placement costs one (districts x D) expression instead of re-evaluating the
+index per candidate.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from yas.instrument import traced
+
+
+def coulter_values(supply, demand):
+    """Coulter index for every (supply, demand) column pair.
+
+    supply is a (districts x S) array of supply amounts, demand a
+    (districts x D) array of demand shares; returns an (S x D) array.
+    """
+    supply = np.asarray(supply, dtype = float)
+    demand = np.asarray(demand, dtype = float)
+
+    # Supply shares against every demand share: (districts, S, D)
+    share = supply / supply.sum(axis = 0)
+    diff = share[:, :, None] - demand[:, None, :]
+    upper = np.sqrt((diff ** 2).sum(axis = 0))
+
+    d2 = demand ** 2
+    down = np.sqrt(d2.sum(axis = 0) - 2 * d2.min(axis = 0) + 1)
+    return 100 * upper / down
+
+
+def grouped_coulter_values(supply, demand, starts):
+    """Coulter index per group of consecutive districts.
+
+    supply (districts x S) and demand (districts x D) are sorted by group;
+    starts holds the first row of every group. Returns a (groups x S x D)
+    array, equal to coulter_values() of every group on its own.
+    """
+    supply = np.asarray(supply, dtype = float)
+    demand = np.asarray(demand, dtype = float)
+    starts = np.asarray(starts)
+    sizes = np.diff(np.append(starts, len(supply)))
+
+    # Supply shares within each group against every demand share: (districts, S, D)
+    share = supply / np.repeat(np.add.reduceat(supply, starts, axis = 0), sizes, axis = 0)
+    diff = share[:, :, None] - demand[:, None, :]
+    upper = np.sqrt(np.add.reduceat(diff ** 2, starts, axis = 0))
+
+    d2 = demand ** 2
+    down = np.sqrt(np.add.reduceat(d2, starts, axis = 0) - 2 * np.minimum.reduceat(d2, starts, axis = 0) + 1)
+    return 100 * upper / down[:, None, :]
+
+
+def adjustment_values(supply, demand):
+    """Adjustment coefficients Ci = supply_i - demand_i * sum(supply).
+
+    Returns a (districts x S x D) array; a positive value indicates
+    oversupply, a negative value a shortage.
+    """
+    supply = np.asarray(supply, dtype = float)
+    demand = np.asarray(demand, dtype = float)
+    return supply[:, :, None] - demand[:, None, :] * supply.sum(axis = 0)[None, :, None]
+
+
+def demand_shares(flows, codes, value, end = 'D'):
+    """Share of every district in the total of a flow attribute (e.g. POP/allPOP).
+
+    flows are OD flows keyed by their O and D district codes; 'value' is
+    summed per district of 'codes' at the origin ('O'), the destination ('D')
+    or both ends ('OD'). Shares sum to 1 over 'codes'; districts without
+    flows get 0 and flows ending outside 'codes' are left out.
+    """
+    codes = pd.Index(codes).astype(str)
+    ends = {'O': ['O'], 'D': ['D'], 'OD': ['O', 'D']}[end]
+    totals = sum(flows.groupby(flows[e].astype(str))[value].sum().reindex(codes, fill_value = 0)
+                 for e in ends)
+    return (totals / totals.sum()).to_numpy()
+
+
+def weighted_values(supply, demand, weights):
+    """Coulter index and adjustment coefficients of bootstrap replicates.
+
+    weights is a (B x districts) array of draw counts. A district drawn w
+    times contributes w times to every sum, and demand shares are
+    re-normalized over the drawn districts. Returns ci (B x S x D) and
+    coef (B x districts x S x D), NaN for districts not drawn in a replicate;
+    weights of all ones give the point values.
+    """
+    supply = np.asarray(supply, dtype = float)
+    demand = np.asarray(demand, dtype = float)
+    w = np.asarray(weights, dtype = float)
+
+    s_total = w @ supply                                  # (B, S)
+    share_s = supply[None] / s_total[:, None, :]          # (B, n, S)
+    share_d = demand[None] / (w @ demand)[:, None, :]     # (B, n, D)
+
+    diff2 = (share_s[..., None] - share_d[:, :, None, :]) ** 2
+    upper = np.sqrt(np.einsum('bn,bnsd->bsd', w, diff2))
+
+    # Minimum over the districts actually drawn
+    d2 = share_d ** 2
+    d2_min = np.where(w[..., None] > 0, d2, np.inf).min(axis = 1)
+    down = np.sqrt(np.einsum('bn,bnd->bd', w, d2) - 2 * d2_min + 1)
+    ci = 100 * upper / down[:, None, :]
+
+    coef = supply[None, :, :, None] - share_d[:, :, None, :] * s_total[:, None, :, None]
+    # A district not drawn in a replicate has no coefficient there (NaN, skipped by the intervals)
+    coef = np.where(w[:, :, None, None] > 0, coef, np.nan)
+    return ci, coef
+
+
+def _bootstrap_block(supply, demand, seed, size):
+    # One block of replicates from its own seed (independent of the worker count)
+    rng = np.random.default_rng(seed)
+    n = len(supply)
+    weights = rng.multinomial(n, np.full(n, 1 / n), size = size)
+    return weighted_values(supply, demand, weights)
+
+
+def bootstrap_values(supply, demand, replicates = 10000, seed = 12345, workers = None,
+                     executor = 'thread', block = 1000):
+    """Bootstrap replicates of the Coulter index and the adjustment coefficients.
+
+    Replicates are computed in blocks of 'block' rows, optionally spread over
+    a 'thread' or 'process' pool; results only depend on seed and block.
+    Returns ci (replicates x S x D) and coef (replicates x districts x S x D).
+    """
+    supply = np.asarray(supply, dtype = float)
+    demand = np.asarray(demand, dtype = float)
+    sizes = [min(block, replicates - start) for start in range(0, replicates, block)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if workers == 1 or len(sizes) == 1:
+        parts = [_bootstrap_block(supply, demand, s, size) for s, size in zip(seeds, sizes)]
+    else:
+        pool = ThreadPoolExecutor if executor == 'thread' else ProcessPoolExecutor
+        with pool(max_workers = workers or os.cpu_count()) as ex:
+            parts = list(ex.map(_bootstrap_block, [supply] * len(sizes), [demand] * len(sizes),
+                                seeds, sizes))
+
+    return (np.concatenate([p[0] for p in parts]),
+            np.concatenate([p[1] for p in parts]))
+
+
+def _interval(values, level):
+    # Percentile interval over the replicate axis
+    alpha = (1 - level) / 2
+    return np.nanquantile(values, [alpha, 1 - alpha], axis = 0)
+
+
+@traced('coulter')
+def coulter_index(df, supply_cols, demand_cols, by = None):
+    """Tidy table of the Coulter index for every supply x demand scenario.
+
+    Returns one row per (supply, demand) pair, with a leading column per
+    'by' key when the index is computed separately per group (e.g. month or
+    age band).
+    """
+    if by is None:
+        ci = coulter_values(df[supply_cols].to_numpy(), df[demand_cols].to_numpy())
+        return pd.DataFrame({'supply': np.repeat(supply_cols, len(demand_cols)),
+                             'demand': np.tile(demand_cols, len(supply_cols)),
+                             'CI': ci.ravel()})
+
+    # Rows sorted by group (groups in order of appearance) for the segment reductions
+    grouped = df.groupby(by, sort = False, observed = True)
+    ids = grouped.ngroup().fillna(-1).to_numpy().astype(int)
+    rows = np.flatnonzero(ids >= 0)
+    rows = rows[np.argsort(ids[rows], kind = 'stable')]
+    starts = np.searchsorted(ids[rows], np.arange(grouped.ngroups))
+    ci = grouped_coulter_values(df[supply_cols].to_numpy()[rows], df[demand_cols].to_numpy()[rows], starts)
+
+    S, D = len(supply_cols), len(demand_cols)
+    keys = grouped.size().index
+    table = {name: np.repeat(keys.get_level_values(i).to_numpy(), S * D)
+             for i, name in enumerate([by] if isinstance(by, str) else by)}
+    table.update({'supply': np.tile(np.repeat(supply_cols, D), len(keys)),
+                  'demand': np.tile(demand_cols, len(keys) * S),
+                  'CI': ci.ravel()})
+    return pd.DataFrame(table)
+
+
+@traced('coulter', rows_out = lambda r: len(r[0]))
+def bootstrap_coulter(df, supply_cols, demand_cols, replicates = 10000, level = 0.95,
+                      seed = 12345, workers = None, executor = 'thread', id_col = 'CODE'):
+    """Coulter index and adjustment coefficients with bootstrap intervals.
+
+    Returns two tidy tables: the index per (supply, demand) scenario and the
+    coefficients per (id_col district, supply, demand), each with the point
+    value and the lower/upper bounds of the 'level' percentile interval.
+    """
+    supply = df[supply_cols].to_numpy(dtype = float)
+    demand = df[demand_cols].to_numpy(dtype = float)
+    ci_b, coef_b = bootstrap_values(supply, demand, replicates, seed, workers, executor)
+    ci_lo, ci_hi = _interval(ci_b, level)
+    coef_lo, coef_hi = _interval(coef_b, level)
+
+    n, S, D = len(df), len(supply_cols), len(demand_cols)
+    ci = pd.DataFrame({'supply': np.repeat(supply_cols, D),
+                       'demand': np.tile(demand_cols, S),
+                       'CI': coulter_values(supply, demand).ravel(),
+                       'lower': ci_lo.ravel(),
+                       'upper': ci_hi.ravel()})
+    coef = pd.DataFrame({id_col: np.repeat(df[id_col].to_numpy(), S * D),
+                         'supply': np.tile(np.repeat(supply_cols, D), n),
+                         'demand': np.tile(demand_cols, n * S),
+                         'Ci': adjustment_values(supply, demand).ravel(),
+                         'lower': coef_lo.ravel(),
+                         'upper': coef_hi.ravel()})
+    return ci, coef
+
+
+def allocate_units(supply, demand, budget, capacity = None, weights = None, step = 1):
+    """Greedy allocation of 'budget' new units minimizing the Coulter index.
+
+    supply is the (districts,) current supply (e.g. Room_count), demand a
+    (districts x D) array of demand shares and capacity the (districts,)
+    maximum of new units per district (None for no limit). With several
+    demand scenarios the objective is sum_d weights_d * CI_d (equal weights
+    by default). Units are placed 'step' at a time, each time in the district
+    giving the lowest objective.
+
+    With a = sum s^2, b_d = sum s * d and t = sum s, the squared numerator is
+    sum (s/t - d)^2 = a/t^2 - 2 b_d/t + sum d^2, so placing q units in district
+    k only changes a by 2 s_k q + q^2, b_d by q d_k and t by q.
+    Returns the (districts,) new units and the (placements x D) index after
+    every placement.
+    """
+    s = np.asarray(supply, dtype = float).copy()
+    demand = np.asarray(demand, dtype = float)
+    if demand.ndim == 1:
+        demand = demand[:, None]
+    n, D = demand.shape
+    left = np.full(n, np.inf) if capacity is None else np.asarray(capacity, dtype = float).copy()
+    w = np.full(D, 1 / D) if weights is None else np.asarray(weights, dtype = float)
+    budget = int(budget)
+    if budget > left.sum():
+        raise ValueError('Budget of %d units exceeds the total capacity of %d' % (budget, left.sum()))
+
+    d2 = demand ** 2
+    down = np.sqrt(d2.sum(axis = 0) - 2 * d2.min(axis = 0) + 1)
+    c = d2.sum(axis = 0)
+    a, b, t = (s ** 2).sum(), s @ demand, s.sum()
+
+    units = np.zeros(n, dtype = np.int64)
+    history = []
+    while budget > 0:
+        # Index of every district receiving its next placement: (districts, D)
+        q = np.minimum(min(step, budget), left)
+        t_new = t + q
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            upper2 = ((a + 2 * s * q + q ** 2) / t_new ** 2)[:, None] \
+                - 2 * (b + q[:, None] * demand) / t_new[:, None] + c
+            ci = 100 * np.sqrt(np.maximum(upper2, 0)) / down
+        score = np.where(q > 0, ci @ w, np.inf)
+
+        k = int(np.argmin(score))
+        qk = int(q[k])
+        a += 2 * s[k] * qk + qk ** 2
+        b = b + qk * demand[k]
+        t += qk
+        s[k] += qk
+        left[k] -= qk
+        units[k] += qk
+        budget -= qk
+        history.append(ci[k])
+    return units, np.array(history).reshape(-1, D)
+
+
+@traced('coulter', rows_out = lambda r: len(r[0]))
+def allocate_housing(df, demand_cols, budget, supply_col = 'Room_count', capacity = None,
+                     weights = None, step = 1, id_col = 'CODE'):
+    """Greedy allocation of new units as tidy tables.
+
+    capacity is a column of df or a (districts,) array of the maximum new
+    units per district. Returns the units per id_col district (with the
+    supply before and after) and the Coulter index per demand scenario
+    before and after the allocation.
+    """
+    supply = df[supply_col].to_numpy(dtype = float)
+    demand = df[demand_cols].to_numpy(dtype = float)
+    if isinstance(capacity, str):
+        capacity = df[capacity].to_numpy()
+    units, _ = allocate_units(supply, demand, budget, capacity, weights, step)
+
+    alloc = pd.DataFrame({id_col: df[id_col].to_numpy(), supply_col: supply.astype(df[supply_col].dtype),
+                          'units': units})
+    alloc[supply_col + '_new'] = alloc[supply_col] + units
+    ci = pd.DataFrame({'demand': demand_cols,
+                       'CI_before': coulter_values(supply[:, None], demand)[0],
+                       'CI_after': coulter_values((supply + units)[:, None], demand)[0]})
+    return alloc, ci
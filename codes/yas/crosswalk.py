@@ -0,0 +1,141 @@
+"""Administrative code crosswalk shared by the preprocessing stages.
+
+CODE_2023.01.01.csv is loaded once into hash maps between CODE_AD (10-digit
+administrative code), CODE_AD2 (5-digit SGG code) and the study region CODE.
+The code arrays are cached as a compact .npz keyed by the size and mtime of
+the source file and the code-change rules, which are applied declaratively to
+raw codes instead of being patched by list position; each map is only built
+on first use. Codes without a mapping are counted and listed by report()
+rather than silently skipped.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from yas.instrument import traced
+
+# Code-change rules applied to raw CODE_AD2 values: (old, new, reason)
+CODE_CHANGES = (
+    ('41730', '41670', 'Yeoju-gun became Yeoju-si (2013)'),
+)
+
+
+class Crosswalk:
+    """Bidirectional maps between CODE_AD, CODE_AD2 and CODE."""
+
+    def __init__(self, code_ad, code, changes = CODE_CHANGES):
+        self.code_ad = np.asarray(code_ad).astype(str)
+        self.code = np.asarray(code)
+        self.changes = {old: new for old, new, _ in changes}
+        self.rules = tuple(changes)
+        self.table = pd.DataFrame({'CODE_AD': self.code_ad,
+                                   'CODE_AD2': pd.Series(self.code_ad).str[:5],
+                                   'CODE': self.code})
+        self.maps = {}
+
+        # Unmapped values seen so far: (src, dst, value) -> rows
+        self.unmapped = {}
+
+    def lookup(self, src = 'CODE_AD2', dst = 'CODE'):
+        # Plain dict of the src -> dst map, built on first use; first match per
+        # key, as the former code[code[a] == x][b].tolist()[0] lookups
+        if (src, dst) not in self.maps:
+            first = self.table.drop_duplicates(src)
+            self.maps[(src, dst)] = dict(zip(first[src], first[dst]))
+        return self.maps[(src, dst)]
+
+    def normalize(self, values, src = 'CODE_AD2'):
+        """Apply the code-change rules to raw CODE_AD2 (or CODE_AD) values."""
+        values = pd.Series(values).astype(str)
+        if src == 'CODE_AD':
+            head = values.str[:5]
+            return head.map(self.changes).fillna(head) + values.str[5:]
+        return values.map(self.changes).fillna(values)
+
+    def map_series(self, values, src = 'CODE_AD2', dst = 'CODE'):
+        """Vectorized src -> dst mapping; unmapped values become NaN and are recorded."""
+        values = pd.Series(values)
+        if src in ('CODE_AD', 'CODE_AD2'):
+            values = self.normalize(values, src)
+        mapped = values.map(self.lookup(src, dst))
+        self._record(src, dst, values[mapped.isna()])
+        return mapped
+
+    def _record(self, src, dst, values):
+        # Count every row of an unmapped value for report()
+        for value, rows in pd.Series(values).value_counts(sort = False).items():
+            key = (src, dst, value)
+            self.unmapped[key] = self.unmapped.get(key, 0) + int(rows)
+
+    @traced('normalize', rows_out = lambda r: len(r[0]))
+    def normalize_od(self, sums, origins, destinations, src = 'CODE_AD2'):
+        """Apply the rules to OD sums keyed by raw codes and drop unmapped codes.
+
+        Returns (sums, origins, destinations) with renamed codes merged and
+        every origin/destination present in the src -> CODE map; dropped
+        codes are recorded for report() with the number of sums rows they drop.
+        """
+        codes = {}
+        for c in list(origins) + list(destinations):
+            codes.setdefault(c, None)
+        raw = pd.Series(list(codes))
+        new = self.normalize(raw, src)
+        known = new.map(self.lookup(src, 'CODE')).notna().to_numpy()
+        rename = dict(zip(raw, new))
+        keep = set(new[known])
+
+        def clean(items):
+            return list(dict.fromkeys(n for n in (rename[c] for c in items) if n in keep))
+
+        # Origin/destination are the last two index levels (leading levels, e.g. a band, are kept)
+        levels = [np.asarray(sums.index.get_level_values(i)) for i in range(sums.index.nlevels)]
+        o = pd.Index(levels[-2]).map(rename)
+        d = pd.Index(levels[-1]).map(rename)
+        bad_o, bad_d = ~np.asarray(o.isin(keep)), ~np.asarray(d.isin(keep))
+        # A row is counted once per unmapped code, also when it is both origin and destination
+        self._record(src, 'CODE', np.concatenate([o[bad_o], d[bad_d & ~(bad_o & (o == d))]]))
+        mask = ~(bad_o | bad_d)
+        keys = [level[mask] for level in levels[:-2]] + [o[mask], d[mask]]
+        sums = sums[mask].groupby(keys, sort = False).sum()
+        return sums, clean(origins), clean(destinations)
+
+    def report(self):
+        """Table of the unmapped values recorded so far (empty when all codes mapped)."""
+        rows = [[src, dst, value, n] for (src, dst, value), n in self.unmapped.items()]
+        return pd.DataFrame(rows, columns = ['from', 'to', 'value', 'rows'])
+
+    def save(self, path):
+        # Written under a per-process name and renamed, so a concurrent stage
+        # never opens a half-written file
+        tmp = path + '.tmp' + str(os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, code_ad = self.code_ad, code = self.code,
+                                rules = np.array(self.rules, dtype = str).reshape(-1, 3))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        a = np.load(path)
+        return cls(a['code_ad'], a['code'], [tuple(r) for r in a['rules']])
+
+
+def load_crosswalk(code_path = './CODE_2023.01.01.csv', cache_dir = './.crosswalk_cache',
+                   changes = CODE_CHANGES):
+    """Return the crosswalk, compiling and caching it on first use."""
+    stat = os.stat(code_path)
+    h = hashlib.sha256(json.dumps([os.path.abspath(code_path), stat.st_size, stat.st_mtime_ns,
+                                   list(changes)]).encode())
+    path = os.path.join(cache_dir, 'crosswalk_' + h.hexdigest()[:24] + '.npz')
+
+    if os.path.exists(path):
+        return Crosswalk.load(path)
+
+    code = pd.read_csv(code_path, encoding = 'cp949')
+    cw = Crosswalk(code['CODE_AD'], code['CODE'], changes)
+
+    os.makedirs(cache_dir, exist_ok = True)
+    cw.save(path)
+    return cw
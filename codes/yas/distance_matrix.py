@@ -0,0 +1,136 @@
+"""Compact, memory-mapped store for the node x node distance matrix.
+
+DistanceMatrix.csv is converted once, in row chunks, into a float32 .npy file
+with a sidecar of node IDs (<name>.nodes.npy) and the size/mtime of the
+source CSV (<name>.json). Later runs open the .npy with np.load(mmap_mode='r'),
+so nothing is parsed and every process reading it shares the same page-cached
+copy. Node IDs are mapped to rows explicitly instead of relying on num - 1.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from yas.instrument import traced
+
+
+class DistanceMatrix:
+    """Read-only memory-mapped distance matrix with a node ID -> row index."""
+
+    def __init__(self, path):
+        self.path = path
+        self.array = np.load(path, mmap_mode = 'r')
+        self.nodes = np.load(_sidecar(path, '.nodes.npy'))
+
+        # Dense lookup table from node ID to row (-1 for unknown IDs)
+        self._rows = np.full(int(self.nodes.max()) + 1, -1, dtype = np.int64)
+        self._rows[self.nodes] = np.arange(len(self.nodes))
+
+    def __reduce__(self):
+        # Worker processes re-open the file instead of receiving a pickled copy
+        return (DistanceMatrix, (self.path,))
+
+    def rows(self, ids):
+        """Row positions (0-based) of the node IDs; KeyError for unknown IDs."""
+        ids = np.asarray(ids, dtype = np.int64)
+        rows = np.full(ids.shape, -1, dtype = np.int64)
+        inside = (ids >= 0) & (ids < len(self._rows))
+        rows[inside] = self._rows[ids[inside]]
+        if (rows < 0).any():
+            raise KeyError('Node IDs not in the distance matrix: ' + str(np.unique(ids[rows < 0]).tolist()))
+        return rows
+
+    def row_numbers(self, ids):
+        # 1-based row numbers, the O/D convention of the Flow-LISA functions
+        return self.rows(ids) + 1
+
+    def pair(self, o, d):
+        """Distances between node IDs o and d (scalars or arrays)."""
+        return self.array[self.rows(o), self.rows(d)]
+
+
+def _sidecar(path, suffix):
+    return os.path.splitext(path)[0] + suffix
+
+
+def convert_distance_matrix(csv_path, npy_path = None, node_ids = None, dtype = np.float32,
+                            chunksize = 512, encoding = 'cp949'):
+    """Convert a CSV distance matrix into a .npy file plus node ID sidecar.
+
+    The CSV has one header row; a leading ID column (one column more than
+    rows) is used as node IDs. Without one, node IDs are 1..n, the num
+    convention of od_xy. Rows are streamed into the .npy in chunks.
+    """
+    npy_path = npy_path or _sidecar(csv_path, '.npy')
+    # Per-process temporary names: stages converting concurrently on a first run
+    # never write into the same file
+    tmp_suffix = '.tmp' + str(os.getpid())
+    tmp_path = npy_path + tmp_suffix + '.npy'
+    out, ids, start = None, [], 0
+
+    for chunk in pd.read_csv(csv_path, encoding = encoding, chunksize = chunksize):
+        values = chunk.to_numpy()
+        if out is None:
+            n_cols = values.shape[1]
+            # A square matrix has as many rows as columns; one extra column is the ID column
+            n = n_cols - 1 if _has_id_column(csv_path, n_cols, encoding) else n_cols
+            out = np.lib.format.open_memmap(tmp_path, mode = 'w+', dtype = dtype, shape = (n, n))
+        if values.shape[1] != out.shape[1]:
+            ids.append(values[:, 0])
+            values = values[:, 1:]
+        out[start:start + len(values)] = values
+        start += len(values)
+
+    if start != out.shape[0]:
+        raise ValueError('Distance matrix is not square: %d rows, %d columns' % (start, out.shape[1]))
+    out.flush()
+    del out
+
+    # Sidecars first and the matrix last, each renamed into place, so the .npy
+    # never appears next to the node index of another version
+    if node_ids is None:
+        node_ids = np.concatenate(ids) if ids else np.arange(1, start + 1)
+    nodes_path = _sidecar(npy_path, '.nodes.npy')
+    with open(nodes_path + tmp_suffix, 'wb') as f:
+        np.save(f, np.asarray(node_ids, dtype = np.int64))
+    os.replace(nodes_path + tmp_suffix, nodes_path)
+
+    stat = os.stat(csv_path)
+    meta_path = _sidecar(npy_path, '.json')
+    with open(meta_path + tmp_suffix, 'w') as f:
+        json.dump({'source': os.path.abspath(csv_path), 'size': stat.st_size,
+                   'mtime_ns': stat.st_mtime_ns, 'dtype': np.dtype(dtype).name}, f)
+    os.replace(meta_path + tmp_suffix, meta_path)
+
+    os.replace(tmp_path, npy_path)
+    return npy_path
+
+
+def _has_id_column(csv_path, n_cols, encoding):
+    # Count data rows without parsing the values
+    with open(csv_path, encoding = encoding) as f:
+        n_rows = sum(1 for _ in f) - 1
+    return n_cols == n_rows + 1
+
+
+@traced('load', rows_out = lambda r: r.array.shape[0])
+def load_distance_matrix(csv_path = './DistanceMatrix.csv', npy_path = None, dtype = np.float32):
+    """Open the memory-mapped matrix, converting the CSV first when it is new or changed."""
+    npy_path = npy_path or _sidecar(csv_path, '.npy')
+    meta_path = _sidecar(npy_path, '.json')
+
+    stale = True
+    if os.path.exists(npy_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if os.path.exists(csv_path):
+            stat = os.stat(csv_path)
+            stale = (meta['size'], meta['mtime_ns'], meta['dtype']) != \
+                    (stat.st_size, stat.st_mtime_ns, np.dtype(dtype).name)
+        else:
+            stale = False    # Only the converted matrix is shipped
+
+    if stale:
+        convert_distance_matrix(csv_path, npy_path, dtype = dtype)
+    return DistanceMatrix(npy_path)
@@ -0,0 +1,366 @@
+"""Shared Flow-LISA engine used by the pop (05) and card (06) based scripts.
+
+The spatial lag of flow i is the inverse-distance weighted sum of every other
+flow j, where the distance between two flows is dist_o + dist_d (origin to
+origin plus destination to destination). Pairs whose summed distance is 0 are
+skipped, exactly as in the original double loop.
+
+The bivariate mode relates one standardized flow attribute z_x to the lag of
+another, z_y: all attributes are lagged together in one (variables x flows)
+matrix product and every pair is scored and classified at once.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from yas.instrument import traced
+
+# Default memory budget (bytes) for one block of weight tiles
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+
+def block_rows(n_flows, max_bytes = DEFAULT_MAX_BYTES):
+    # Each row of a tile holds three float64 arrays of length n_flows
+    # (summed distance, weighted values and the non-zero mask)
+    row_bytes = 3 * 8 * max(n_flows, 1)
+    return int(max(1, min(n_flows, max_bytes // row_bytes)))
+
+
+def _summed_distance(p, o, d, start, stop):
+    # Float64 tile of dist_o + dist_d for flows start..stop-1 against every flow;
+    # only the tile is converted, so a float32 or memory-mapped p is never copied whole
+    dist = p[np.ix_(o[start:stop], o)].astype(float)
+    dist += p[np.ix_(d[start:stop], d)]
+    return dist
+
+
+def weight_tiles(p_array, O, D, max_bytes = DEFAULT_MAX_BYTES):
+    """Yield (start, stop, dist) row blocks of the summed OD distance matrix.
+
+    p_array is the node distance matrix, O and D the 1-based node IDs
+    (num_x / num_y) of every flow. dist[k, j] equals
+    p_array[O[start+k]-1][O[j]-1] + p_array[D[start+k]-1][D[j]-1].
+    """
+    p = np.asarray(p_array)
+    o = np.asarray(O, dtype = np.intp) - 1
+    d = np.asarray(D, dtype = np.intp) - 1
+    n = len(o)
+
+    rows = block_rows(n, max_bytes)
+    for start in range(0, n, rows):
+        stop = min(start + rows, n)
+        yield start, stop, _summed_distance(p, o, d, start, stop)
+
+
+@traced('lag', rows_in = lambda a, k, r: len(a[1]), rows_out = lambda r: r.shape[-1])
+def flow_lag(p_array, O, D, z, max_bytes = DEFAULT_MAX_BYTES):
+    """Return the inverse-distance spatial lag of z for every flow.
+
+    Equivalent to the nested loop previously found in 05/06, computed in row
+    blocks whose size is bounded by max_bytes. z may also be a (bands x flows)
+    matrix (e.g. one row per time band); every weight tile is then built once
+    and applied to all rows with one matrix product.
+    """
+    z = np.asarray(z, dtype = float)
+    lag = np.empty(z.shape)
+
+    for start, stop, dist in weight_tiles(p_array, O, D, max_bytes):
+        # Skip pairs without proximity (summed distance of 0)
+        nz = dist != 0
+        if z.ndim == 1:
+            zy = np.divide(z, dist, out = np.zeros_like(dist), where = nz)
+            lag[start:stop] = zy.sum(axis = 1)
+        else:
+            w = np.divide(1.0, dist, out = np.zeros_like(dist), where = nz)
+            lag[:, start:stop] = z @ w.T
+
+    return lag
+
+
+def weight_columns(p_array, O, D, cols, max_bytes = DEFAULT_MAX_BYTES):
+    """Yield (cols block, w) with the dense weight columns w[:, k] = W[:, cols[k]].
+
+    Only the len(cols) columns are built, in blocks bounded by max_bytes,
+    so the cost is O(n_flows * len(cols)) instead of a full O(n_flows^2) pass.
+    """
+    p = np.asarray(p_array)
+    o = np.asarray(O, dtype = np.intp) - 1
+    d = np.asarray(D, dtype = np.intp) - 1
+    cols = np.asarray(cols, dtype = np.intp)
+
+    step = block_rows(len(o), max_bytes)
+    for start in range(0, len(cols), step):
+        block = cols[start:start + step]
+        dist = p[np.ix_(o, o[block])].astype(float)
+        dist += p[np.ix_(d, d[block])]
+        yield block, np.divide(1.0, dist, out = np.zeros_like(dist), where = dist != 0)
+
+
+def restandardization(z_old, z_new, unchanged):
+    """(c, d) with z_new = c * z_old + d on the unchanged flows, or None.
+
+    When the raw values of only some flows change, re-standardizing shifts
+    every Z-score by the same affine map; it is fitted on the flows whose
+    raw value is unchanged. None when those flows cannot determine it.
+    """
+    x, y = np.asarray(z_old)[unchanged], np.asarray(z_new)[unchanged]
+    if len(x) < 2 or np.ptp(x) == 0:
+        return None
+    c, d = np.polyfit(x, y, 1)
+    return c, d
+
+
+@traced('lag', rows_in = lambda a, k, r: len(a[1]), rows_out = lambda r: len(r))
+def update_lag(p_array, O, D, lag_old, z_old, z_new, changed, row_sums,
+               max_bytes = DEFAULT_MAX_BYTES, weights = None):
+    """Lag of z_new from the lag of z_old, when only the 'changed' flows differ.
+
+    The lag is linear in z. With z_new = c * z_old + d + e, where e is zero
+    outside the changed flows, lag_new = c * lag_old + d * row_sums + W e.
+    row_sums is the lag of a vector of ones (W 1). Only the changed columns
+    of W are built, so k changed flows cost O(n * k). Returns None when the
+    re-standardization cannot be fitted (callers then compute the full lag).
+    'weights' (a CSR flow weight matrix) replaces the dense weights as in
+    permutation_pvalues.
+    """
+    z_old, z_new = np.asarray(z_old, dtype = float), np.asarray(z_new, dtype = float)
+    changed = np.asarray(changed, dtype = bool)
+    fit = restandardization(z_old, z_new, ~changed)
+    if fit is None:
+        return None
+    c, d = fit
+
+    cols = np.flatnonzero(changed)
+    e = (z_new - c * z_old - d)[cols]
+    lag = c * np.asarray(lag_old, dtype = float) + d * np.asarray(row_sums, dtype = float)
+    if weights is not None:
+        lag += weights[:, cols] @ e
+    else:
+        start = 0
+        for block, w in weight_columns(p_array, O, D, cols, max_bytes):
+            lag += w @ e[start:start + len(block)]
+            start += len(block)
+    return lag
+
+
+def permutation_table(n_flows, permutations = 999, seed = 12345):
+    """Draw the shared (permutations x n_flows-1) table of permuted positions.
+
+    The table is drawn once from 'seed' and reused for every flow, so the
+    pseudo p-values do not depend on how the flows are split across workers.
+    """
+    rng = np.random.default_rng(seed)
+    base = np.tile(np.arange(n_flows - 1, dtype = np.int32), (permutations, 1))
+    return rng.permuted(base, axis = 1)
+
+
+def _row_pvalue(z, i, cols, w, perm_ids, chunk):
+    # Folded pseudo p-value of flow i with neighbours 'cols' weighted by 'w'
+    observed = (w @ z[cols]) / z[i]
+
+    # Hold z_i fixed at flow i and permute the remaining values
+    own = cols == i
+    self_lag = w[own].sum() * z[i]
+    w_others = w[~own]
+    z_others = np.delete(z, i)
+    k = len(w_others)
+
+    permutations = len(perm_ids)
+    larger = 0
+    for s in range(0, permutations, chunk):
+        lag_sim = z_others[perm_ids[s:s + chunk, :k]] @ w_others + self_lag
+        larger += np.count_nonzero(lag_sim / z[i] >= observed)
+
+    if permutations - larger < larger:
+        larger = permutations - larger
+    return (larger + 1) / (permutations + 1)
+
+
+def _permute_block(p_array, o, d, z, perm_ids, start, stop, max_bytes):
+    # Pseudo p-values for the flows start..stop-1 using one dense weight tile
+    # (o and d are the 0-based row indices of the origin/destination nodes)
+    n = len(z)
+    dist = _summed_distance(p_array, o, d, start, stop)
+    nz = dist != 0
+    w = np.divide(1.0, dist, out = np.zeros_like(dist), where = nz)
+
+    chunk = int(max(1, min(len(perm_ids), max_bytes // (12 * max(n - 1, 1)))))
+    cols = np.arange(n)
+    return np.array([_row_pvalue(z, i, cols, w[k], perm_ids, chunk)
+                     for k, i in enumerate(range(start, stop))])
+
+
+def _permute_sparse_block(W, z, perm_ids, start, stop, max_bytes):
+    # Pseudo p-values for the flows start..stop-1 using the rows of a CSR matrix
+    p_sim = np.empty(stop - start)
+    for k, i in enumerate(range(start, stop)):
+        lo, hi = W.indptr[i], W.indptr[i + 1]
+        cols, w = W.indices[lo:hi], W.data[lo:hi]
+        chunk = int(max(1, min(len(perm_ids), max_bytes // (12 * max(hi - lo, 1)))))
+        p_sim[k] = _row_pvalue(z, i, cols, w, perm_ids, chunk)
+    return p_sim
+
+
+@traced('inference', rows_in = lambda a, k, r: len(a[1]), rows_out = lambda r: r.shape[-1])
+def permutation_pvalues(p_array, O, D, z, permutations = 999, seed = 12345,
+                        workers = None, max_bytes = DEFAULT_MAX_BYTES, weights = None):
+    """Conditional permutation pseudo p-values of the Flow-LISA statistic.
+
+    For each flow i, z_i is held fixed while the values of all other flows
+    are randomly reassigned to its neighbours 'permutations' times. Blocks of
+    flows are spread over a thread pool; the weight tile of a block is built
+    once and reused by every permutation, and NumPy releases the GIL for the
+    gather and mat-vec so the threads run in parallel over shared memory.
+
+    If 'weights' (a CSR flow weight matrix) is given, its rows define the
+    neighbours instead of the dense (dist_o + dist_d) tiles.
+    """
+    z = np.asarray(z, dtype = float)
+    n = len(z)
+    perm_ids = permutation_table(n, permutations, seed)
+
+    workers = workers or os.cpu_count() or 1
+    rows = block_rows(n, max_bytes // workers)
+    # Keep every worker busy even when the whole matrix fits in one block
+    rows = max(1, min(rows, -(-n // (4 * workers))))
+    blocks = [(start, min(start + rows, n)) for start in range(0, n, rows)]
+
+    if weights is None:
+        p = np.asarray(p_array)
+        o = np.asarray(O, dtype = np.intp) - 1
+        d = np.asarray(D, dtype = np.intp) - 1
+        task, args = _permute_block, (p, o, d, z, perm_ids)
+    else:
+        task, args = _permute_sparse_block, (weights, z, perm_ids)
+
+    p_sim = np.empty(n)
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        futures = {pool.submit(task, *args, start, stop, max_bytes // workers): (start, stop)
+                   for start, stop in blocks}
+        for future, (start, stop) in futures.items():
+            p_sim[start:stop] = future.result()
+
+    return p_sim
+
+
+# LISA quadrants and the label of non-significant flows, in category order
+QUADRANTS = ('HH', 'HL', 'LH', 'LL')
+NOT_SIGNIFICANT = 'NS'
+
+# Two-sided Z-score thresholds of the usual confidence levels (2.58 as in the
+# original 99% rule); other levels use the normal quantile
+Z_THRESHOLDS = {0.90: 1.645, 0.95: 1.96, 0.99: 2.58}
+
+
+def z_threshold(level):
+    if level in Z_THRESHOLDS:
+        return Z_THRESHOLDS[level]
+    from scipy.stats import norm
+    return float(norm.isf((1 - level) / 2))
+
+
+def quadrant_codes(z, lag):
+    """Index into QUADRANTS for every element (int8, arrays of any shape).
+
+    NaN compares as negative, as in the original if/else rules.
+    """
+    z, lag = np.asarray(z), np.asarray(lag)
+    return np.select([(z >= 0) & (lag >= 0), z >= 0, lag >= 0],
+                     np.arange(3, dtype = np.int8), default = np.int8(3)).astype(np.int8)
+
+
+def significant(level, fl_sig = None, p_values = None):
+    """Significance mask at a confidence level, from pseudo p-values
+    (p <= 1 - level) when given, else from the Flow-LISA Z-scores."""
+    if p_values is not None:
+        return np.asarray(p_values) <= round(1 - level, 10)
+    return np.abs(np.asarray(fl_sig)) >= z_threshold(level)
+
+
+@traced('classify', rows_out = lambda r: len(r[0]))
+def classify_lisa(z, lag, fl_sig = None, p_values = None, levels = (0.99,)):
+    """LISA quadrant and significant clusters at several confidence levels.
+
+    Returns (quadrant, {level: cluster}) as categoricals over QUADRANTS and
+    QUADRANTS + ('NS',); cluster is the quadrant where the flow is
+    significant at that level and 'NS' elsewhere. Inputs are flattened, so
+    (bands x flows) arrays give flows in row-major order.
+    """
+    if fl_sig is None and p_values is None and levels:
+        raise ValueError('Significant clusters need fl_sig or p_values')
+    codes = quadrant_codes(np.ravel(z), np.ravel(lag))
+    fl_sig = None if fl_sig is None else np.ravel(fl_sig)
+    p_values = None if p_values is None else np.ravel(p_values)
+
+    quadrant = pd.Categorical.from_codes(codes, categories = QUADRANTS)
+    clusters = {}
+    for level in levels:
+        cluster_codes = np.where(significant(level, fl_sig, p_values), codes, np.int8(len(QUADRANTS)))
+        clusters[level] = pd.Categorical.from_codes(cluster_codes,
+                                                    categories = QUADRANTS + (NOT_SIGNIFICANT,))
+    return quadrant, clusters
+
+
+def cluster_column(base, level, default = 0.99):
+    # Column of a confidence level: 'base' for the default level, else e.g. 'base_95'
+    return base if level == default else base + '_' + format(level * 100, 'g')
+
+
+def bivariate_scores(z, lag, pairs):
+    """Bivariate Flow-LISA scores z[a] * lag[b] of the (a, b) variable pairs.
+
+    z is a (variables x flows) matrix of standardized flow attributes and lag
+    its cross spatial lag, computed in one pass by flow_lag (or sparse_lag)
+    on the whole matrix, so every weight tile serves all variables. Returns
+    the (pairs x flows) scores and their Z-scores over the flows (as Fl_popsig
+    in 05/06).
+    """
+    a, b = np.asarray(pairs, dtype = np.intp).T
+    scores = np.asarray(z, dtype = float)[a] * np.asarray(lag, dtype = float)[b]
+    sig = (scores - scores.mean(axis = 1, keepdims = True)) / scores.std(axis = 1, ddof = 1, keepdims = True)
+    return scores, sig
+
+
+@traced('classify', rows_out = len)
+def bivariate_table(names, z, lag, p_values = None, pairs = None, levels = (0.99,)):
+    """Bivariate Flow-LISA scores and clusters of every ordered variable pair.
+
+    names label the rows of z and lag ((variables x flows) as in
+    bivariate_scores); pairs defaults to every (x, y) with x != y. For each
+    pair the table holds Fl_<x>_<y> (z_x * lag_y), its Z-score
+    Fl_<x>_<y>sig, the quadrant value_<x>_<y> of (z_x, lag_y) and the
+    significant clusters value2_<x>_<y> (see cluster_column).
+
+    p_values are the (variables x flows) permutation pseudo p-values of the
+    lags (permutation_pvalues of each variable). With z_x of a flow held
+    fixed, the folded test of z_x * lag_y only depends on lag_y, so the pair
+    (x, y) uses the p-values of y and K variables need K permutation runs,
+    not K^2.
+    """
+    k = len(names)
+    if pairs is None:
+        pairs = [(a, b) for a in range(k) for b in range(k) if a != b]
+    pairs = np.asarray(pairs, dtype = np.intp).reshape(-1, 2)
+    scores, sig = bivariate_scores(z, lag, pairs)
+
+    a, b = pairs.T
+    z, lag = np.asarray(z, dtype = float), np.asarray(lag, dtype = float)
+    p_pairs = None if p_values is None else np.asarray(p_values)[b]
+    # Every pair is classified in one call on the (pairs x flows) arrays
+    quadrant, clusters = classify_lisa(z[a], lag[b], fl_sig = sig, p_values = p_pairs, levels = levels)
+
+    n = z.shape[1]
+    columns = {}
+    for i, (x, y) in enumerate(pairs):
+        base = names[x] + '_' + names[y]
+        rows = slice(i * n, (i + 1) * n)
+        columns['Fl_' + base] = scores[i]
+        columns['Fl_' + base + 'sig'] = sig[i]
+        if p_pairs is not None:
+            columns['Fl_' + base + '_p'] = p_pairs[i]
+        columns['value_' + base] = quadrant[rows]
+        for level, cluster in clusters.items():
+            columns[cluster_column('value2_' + base, level)] = cluster[rows]
+    return pd.DataFrame(columns)
@@ -0,0 +1,104 @@
+"""Sparse flow-to-flow weight matrices for Flow-LISA at finer admin levels.
+
+Instead of treating every OD pair as a neighbour of every other pair, only
+the k nearest flows and/or the flows within a distance band (on the summed
+distance dist_o + dist_d) are kept. Weights are the inverse summed distance,
+stored as a SciPy CSR matrix so the spatial lag becomes a sparse mat-vec.
+
+Built matrices are cached as .npz files keyed by the hash of
+DistanceMatrix.csv, the num_x/num_y node IDs and the neighbour parameters.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from yas import flow_lisa, tiled_lag
+from yas.flow_lisa import DEFAULT_MAX_BYTES, weight_tiles
+from yas.instrument import traced
+from yas.stage_cache import file_hash
+
+
+@traced('weights', rows_in = lambda a, k, r: len(a[1]), extra = lambda r: {'nnz': int(r.nnz)})
+def build_flow_weights(p_array, O, D, k = None, band = None, max_bytes = DEFAULT_MAX_BYTES):
+    """Build the CSR inverse-distance weights of the k nearest / in-band flows.
+
+    Pairs with a summed distance of 0 are never neighbours (same rule as the
+    dense lag). With both k and band set, the k nearest flows within the band
+    are kept; with neither, every pair with a non-zero distance is kept.
+    """
+    n = len(O)
+    rows, cols, vals = [], [], []
+
+    for start, stop, dist in weight_tiles(p_array, O, D, max_bytes):
+        # Exclude non-neighbours by pushing their distance to infinity
+        dist[dist == 0] = np.inf
+        if band is not None:
+            dist[dist > band] = np.inf
+
+        if k is not None and k < n:
+            nearest = np.argpartition(dist, k - 1, axis = 1)[:, :k]
+        else:
+            nearest = np.broadcast_to(np.arange(n), dist.shape)
+        near_dist = np.take_along_axis(dist, nearest, axis = 1)
+
+        keep = np.isfinite(near_dist)
+        row_ids = np.arange(start, stop)[:, None]
+        rows.append(np.broadcast_to(row_ids, nearest.shape)[keep])
+        cols.append(nearest[keep])
+        vals.append(1.0 / near_dist[keep])
+
+    W = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                          shape = (n, n))
+    W.sort_indices()
+    return W
+
+
+def weights_key(distance_hash, O, D, k = None, band = None):
+    # Cache key from the distance matrix hash, the flow node IDs and the parameters
+    h = hashlib.sha256(distance_hash.encode())
+    h.update(np.asarray(O, dtype = np.int64).tobytes())
+    h.update(np.asarray(D, dtype = np.int64).tobytes())
+    h.update(json.dumps({'k': k, 'band': band}, sort_keys = True).encode())
+    return h.hexdigest()[:24]
+
+
+def load_flow_weights(distance_path, O, D, k = None, band = None,
+                      cache_dir = './weights_cache', p_array = None,
+                      max_bytes = DEFAULT_MAX_BYTES):
+    """Return the CSR flow weights, building and caching them on first use.
+
+    The distance matrix is only parsed (unless passed as p_array) when no
+    cached matrix exists for the same geography and parameters.
+    """
+    key = weights_key(file_hash(distance_path), O, D, k, band)
+    path = os.path.join(cache_dir, 'flow_weights_' + key + '.npz')
+
+    if os.path.exists(path):
+        return sparse.load_npz(path).tocsr()
+
+    if p_array is None:
+        p_array = np.array(pd.read_csv(distance_path, encoding = 'cp949'))
+    W = build_flow_weights(p_array, O, D, k, band, max_bytes)
+
+    os.makedirs(cache_dir, exist_ok = True)
+    sparse.save_npz(path, W)
+    return W
+
+
+@traced('lag', rows_out = lambda r: r.shape[-1])
+def sparse_lag(W, z):
+    # Spatial lag as a sparse mat-vec (z may also be a bands x flows matrix)
+    z = np.asarray(z, dtype = float)
+    return W @ z if z.ndim == 1 else (W @ z.T).T
+
+
+# Code the spatial lag depends on, for stage cache fingerprints: this module, the
+# tiled lag and the lag functions of flow_lisa, but not its LISA classification
+# (e.g. Z_THRESHOLDS), so a tweaked threshold keeps the cached lag
+LAG_CODE = [__file__, tiled_lag.__file__,
+            flow_lisa.block_rows, flow_lisa._summed_distance, flow_lisa.weight_tiles, flow_lisa.flow_lag,
+            flow_lisa.weight_columns, flow_lisa.restandardization, flow_lisa.update_lag]
\ No newline at end of file
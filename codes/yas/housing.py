@@ -0,0 +1,134 @@
+"""Housing supply per district backed by an STRtree over the SGG polygons.
+
+The district polygons are indexed once in a shapely STRtree; housing points
+are assigned to districts with one bulk tree query ('intersects', as the
+former sjoin) and summed with one groupby. The projects and their assigned
+district codes are kept in the store, so newly announced Happy Housing
+projects are added incrementally without re-reading and re-projecting the
+full housing shapefile. The saved state records a fingerprint of the source
+layers it was built from; when they change, the state is rebuilt.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+
+from yas.instrument import traced
+from yas.stage_cache import file_hash, value_hash
+
+# Tenants excluded from the youth supply: elderly (고령자), housing
+# vulnerable (주거) and existing residents (기존)
+EXCLUDED_TENANTS = ('고령자', '주거', '기존')
+
+# Files making up a shapefile layer
+SHAPEFILE_PARTS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+
+def source_fingerprint(paths):
+    """Hash of the source layers, each shapefile with its .shx/.dbf/.prj/.cpg files."""
+    files = [os.path.splitext(p)[0] + ext for p in paths for ext in SHAPEFILE_PARTS]
+    return value_hash({os.path.basename(f): file_hash(f) for f in files if os.path.exists(f)})
+
+
+def youth_projects(res):
+    """Youth-targeted projects of a Happy Housing layer with Room_size2 (total floor area)."""
+    res = res[~res['Room_who'].str.startswith(EXCLUDED_TENANTS)].reset_index(drop = True)
+    res['Room_count'] = res['Room_count'].astype(int)
+    res['Room_size'] = res['Room_size'].astype(int)
+    res['Room_size2'] = res['Room_size'] * res['Room_count']   # Total Area = Unit Size * Number of Units
+    return res
+
+
+class HousingSupply:
+    """Housing units and floor area per district, updated project by project.
+
+    codes and polygons are the district codes and geometries (in the CRS of
+    the points added later). projects holds one row per housing project with
+    its (hex) WKB geometry, Room_count, Room_size2 and assigned district CODE
+    (a project on a shared boundary is counted in every touching district).
+    sources is the source_fingerprint of the layers the state was built from.
+    """
+
+    def __init__(self, codes, polygons, projects = None, sources = None):
+        self.codes = np.asarray(codes).astype(str)
+        self.polygons = np.asarray(polygons)
+        self.tree = STRtree(self.polygons)
+        if projects is None:
+            projects = pd.DataFrame({'wkb': pd.Series(dtype = object),
+                                     'Room_count': pd.Series(dtype = 'int64'),
+                                     'Room_size2': pd.Series(dtype = 'int64'),
+                                     'CODE': pd.Series(dtype = str)})
+        self.projects = projects
+        self.sources = sources
+        self.totals = self._sums(projects)
+
+    @staticmethod
+    def _sums(projects):
+        return projects.groupby('CODE')[['Room_count', 'Room_size2']].sum()
+
+    def assign(self, points):
+        """District codes of the points: (point position, CODE) for every intersecting polygon."""
+        point_ids, poly_ids = self.tree.query(np.asarray(points), predicate = 'intersects')
+        return point_ids, self.codes[poly_ids]
+
+    @traced('join', rows_in = lambda a, k, r: len(a[1]), rows_out = lambda r: r)
+    def add(self, points, room_count, room_size2):
+        """Add housing projects and update the district totals.
+
+        Projects already recorded (same geometry and values) are skipped, so
+        adding the same announcement twice does not double count it.
+        Returns the number of new project rows.
+        """
+        new = pd.DataFrame({'wkb': shapely.to_wkb(np.asarray(points), hex = True),
+                            'Room_count': np.asarray(room_count, dtype = 'int64'),
+                            'Room_size2': np.asarray(room_size2, dtype = 'int64')})
+        known = self.projects[['wkb', 'Room_count', 'Room_size2']].drop_duplicates()
+        new = new.merge(known, how = 'left', indicator = True)
+        new = new[new['_merge'] == 'left_only'].drop(columns = '_merge').reset_index(drop = True)
+        if new.empty:
+            return 0
+
+        point_ids, codes = self.assign(shapely.from_wkb(new['wkb'].to_numpy()))
+        new = new.iloc[point_ids].assign(CODE = codes).reset_index(drop = True)
+
+        self.projects = pd.concat([self.projects, new], ignore_index = True)
+        self.totals = self.totals.add(self._sums(new), fill_value = 0)
+        return len(new)
+
+    def table(self):
+        """[CODE, Room_count, Room_size] per district in polygon order; 0 without housing."""
+        codes = pd.unique(self.codes)
+        # Totals come back as float after add() aligns them with new districts
+        totals = self.totals.reindex(codes, fill_value = 0).astype('int64')
+        return pd.DataFrame({'CODE': codes,
+                             'Room_count': totals['Room_count'].to_numpy(),
+                             'Room_size': totals['Room_size2'].to_numpy()})
+
+    def save(self, store, name = 'SIG_happyhouse'):
+        # District polygons and assigned projects are kept next to the supply table
+        store.write(pd.DataFrame({'CODE': self.codes, 'wkb': shapely.to_wkb(self.polygons, hex = True),
+                                  'sources': self.sources}),
+                    name + '_districts', indicator = 'housing')
+        store.write(self.projects, name + '_projects', indicator = 'housing')
+        store.write(self.table(), name, indicator = 'housing')
+
+    @classmethod
+    def load(cls, store, name = 'SIG_happyhouse', sources = None):
+        """Supply state saved by save(), or None when there is none yet.
+
+        With a sources fingerprint, a state built from other source layers
+        (or saved without a fingerprint) is not used either, so the caller
+        rebuilds it.
+        """
+        if not (store.exists(name + '_districts', indicator = 'housing')
+                and store.exists(name + '_projects', indicator = 'housing')):
+            return None
+        districts = store.read(name + '_districts', indicator = 'housing')
+        saved = districts['sources'].iloc[0] if 'sources' in districts and len(districts) else None
+        if sources is not None and saved != sources:
+            return None
+        projects = store.read(name + '_projects', indicator = 'housing')
+        projects['CODE'] = projects['CODE'].astype(str)
+        return cls(districts['CODE'], shapely.from_wkb(districts['wkb'].to_numpy()), projects, saved)
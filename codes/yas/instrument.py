@@ -0,0 +1,217 @@
+"""Stage and step instrumentation for the pipeline.
+
+A stage is one run of a numbered script; steps are the shared-module calls it
+makes (load, filter, aggregate, lag, classify, export). Shared functions are
+marked with @traced('<step>'), so scripts need no changes: while a stage is
+active every traced call records its wall time, the process peak RSS, rows
+in/out and throughput, and writes one JSON line per step to the profile log.
+Without an active stage a traced call only costs one attribute check.
+
+Usage: python -m yas.instrument [--profile cprofile|pyinstrument] [--log FILE] SCRIPT
+
+runs SCRIPT as a stage (settings YAS_PROFILE / YAS_PROFILE_LOG do the same
+for the batch runner) and prints a per-step summary on stderr.
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import runpy
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:    # Not available on Windows; RSS is then not reported
+    resource = None
+
+from yas.settings import setting
+
+logger = logging.getLogger('yas.instrument')
+
+# Stage currently being recorded (None outside of stage())
+_active = None
+
+
+def peak_rss_mb():
+    # High-water mark of the resident set size of this process. Linux reports it as
+    # VmHWM; ru_maxrss would also keep the high-water mark of the process it was forked from
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 ** 2 if sys.platform == 'darwin' else 1024), 1)
+
+
+def count_rows(value):
+    # Rows of a DataFrame / Series / array (first dimension), else None
+    shape = getattr(value, 'shape', None)
+    if shape:
+        return int(shape[0])
+    return None
+
+
+class StageRun:
+    """Steps recorded for one stage, written as JSON lines to log_path."""
+
+    def __init__(self, name, log_path = None):
+        self.name = name
+        self.log_path = log_path
+        self.steps = []
+        self.depth = 0
+
+    def emit(self, record):
+        record = dict(record, stage = self.name, time = time.strftime('%Y-%m-%dT%H:%M:%S'))
+        logger.debug(json.dumps(record, ensure_ascii = False))
+        if self.log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok = True)
+            with open(self.log_path, 'a', encoding = 'utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii = False) + '\n')
+
+    def summary(self):
+        """Total seconds, calls, rows (out, else in) and peak RSS per step name."""
+        totals = {}
+        for s in self.steps:
+            t = totals.setdefault(s['step'], {'step': s['step'], 'calls': 0, 'seconds': 0.0,
+                                              'rows': 0, 'peak_rss_mb': 0})
+            t['calls'] += 1
+            t['seconds'] = round(t['seconds'] + s['seconds'], 4)
+            t['rows'] += (s['rows_out'] if s['rows_out'] is not None else s['rows_in']) or 0
+            t['peak_rss_mb'] = max(t['peak_rss_mb'], s.get('peak_rss_mb') or 0)
+        return list(totals.values())
+
+
+@contextmanager
+def step(name, rows_in = None):
+    """Record one step of the active stage; set rec['rows_out'] inside the block.
+
+    Does nothing (but still yields a dict) when no stage is active.
+    """
+    rec = {'step': name, 'rows_in': rows_in, 'rows_out': None}
+    run = _active
+    if run is None:
+        yield rec
+        return
+
+    run.depth += 1
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        yield rec
+    finally:
+        seconds = time.perf_counter() - start
+        run.depth -= 1
+        rss = peak_rss_mb()
+        rows = rec['rows_out'] if rec['rows_out'] is not None else rec['rows_in']
+        rec.update({'seconds': round(seconds, 4), 'depth': run.depth,
+                    'peak_rss_mb': rss,
+                    'rss_growth_mb': None if rss is None else round(rss - rss_before, 1),
+                    'rows_per_s': round(rows / seconds) if rows and seconds > 0 else None})
+        run.steps.append(rec)
+        run.emit(rec)
+
+
+def traced(name, rows_in = None, rows_out = None, extra = None):
+    """Decorator marking a shared function as a pipeline step.
+
+    rows_in(args, kwargs, result) and rows_out(result) override the default
+    row counts (rows of the first array-like argument and of the result);
+    extra(result) may return a dict of further fields for the log record.
+    """
+    def wrap(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+
+            n_in = next((count_rows(a) for a in args if count_rows(a) is not None), None)
+            with step(name, n_in) as rec:
+                rec['call'] = func.__qualname__
+                result = func(*args, **kwargs)
+                if rows_in is not None:
+                    rec['rows_in'] = rows_in(args, kwargs, result)
+                rec['rows_out'] = rows_out(result) if rows_out is not None else count_rows(result)
+                if extra is not None:
+                    rec.update(extra(result))
+            return result
+        return inner
+    return wrap
+
+
+@contextmanager
+def stage(name, log_path = None, profile = None, profile_dir = '.'):
+    """Record every traced step of the enclosed code as stage 'name'.
+
+    profile is None, 'cprofile' (writes <name>.prof) or 'pyinstrument'
+    (writes <name>.html) into profile_dir.
+    """
+    global _active
+    run = StageRun(name, log_path)
+    previous, _active = _active, run
+
+    profiler = None
+    if profile:
+        os.makedirs(profile_dir, exist_ok = True)
+    if profile == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield run
+        failed = False
+    finally:
+        seconds = time.perf_counter() - start
+        _active = previous
+        if profile == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats(os.path.join(profile_dir, name + '.prof'))
+        elif profile == 'pyinstrument':
+            profiler.stop()
+            with open(os.path.join(profile_dir, name + '.html'), 'w', encoding = 'utf-8') as f:
+                f.write(profiler.output_html())
+        run.emit({'step': 'total', 'seconds': round(seconds, 4), 'peak_rss_mb': peak_rss_mb(),
+                  'steps': len(run.steps), 'failed': failed})
+
+
+def format_summary(run):
+    lines = ['%-14s %6s %10s %12s %12s' % ('step', 'calls', 'seconds', 'rows', 'peak_rss_mb')]
+    for t in run.summary():
+        lines.append('%-14s %6d %10.3f %12d %12s' % (t['step'], t['calls'], t['seconds'],
+                                                     t['rows'], t['peak_rss_mb']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run a pipeline script with stage/step instrumentation.')
+    parser.add_argument('script')
+    parser.add_argument('--profile', default = setting('PROFILE') or None, choices = ['cprofile', 'pyinstrument'])
+    parser.add_argument('--log', default = setting('PROFILE_LOG') or None, help = 'JSON-lines profile log')
+    parser.add_argument('--profile-dir', default = '.', help = 'Where cProfile/pyinstrument traces are written')
+    args = parser.parse_args()
+
+    # Scripts import the yas package from their own directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    name = os.path.splitext(os.path.basename(args.script))[0]
+
+    # The shared modules import this file as 'yas.instrument', whose stage state
+    # is separate from this '__main__' copy
+    from yas import instrument
+    with instrument.stage(name, args.log, args.profile, args.profile_dir) as run:
+        runpy.run_path(args.script, run_name = '__main__')
+    print(format_summary(run), file = sys.stderr)
@@ -0,0 +1,50 @@
+"""OD flow tables shared by the pop (01) and card (02) preprocessing.
+
+The OD sums streamed from the raw files (streaming.ODAccumulator, one groupby
+per chunk instead of a boolean scan per OD cell) are laid out on the full
+origin x destination grid, so that zero flows are kept.
+"""
+import pandas as pd
+
+from yas.instrument import traced
+
+
+@traced('aggregate')
+def od_grid(sums, origins, destinations, code_map, value_name):
+    """Lay OD sums out on the full origins x destinations grid.
+
+    Rows follow the order of the former nested loop (origins outer,
+    destinations inner); pairs without any record get 0. Origin and
+    destination codes are converted through code_map (e.g. the crosswalk's
+    CODE_AD2 -> CODE lookup).
+    """
+    missing = sorted(set(origins).union(destinations).difference(code_map))
+    if missing:
+        raise KeyError('No study region CODE for CODE_AD2: ' + ', '.join(map(str, missing)))
+
+    grid = pd.MultiIndex.from_product([list(origins), list(destinations)])
+    values = sums.reindex(grid, fill_value = 0)
+
+    return pd.DataFrame({'O': grid.get_level_values(0).map(code_map),
+                         'D': grid.get_level_values(1).map(code_map),
+                         value_name: values.to_numpy()})
+
+
+@traced('aggregate')
+def od_band_grid(sums, bands, origins, destinations, code_map, value_name):
+    """Lay (band, origin, destination) sums out on the full bands x OD grid.
+
+    Returns a long [band, O, D, value_name] table, band by band in the
+    order of od_grid; pairs without any record in a band get 0.
+    """
+    missing = sorted(set(origins).union(destinations).difference(code_map))
+    if missing:
+        raise KeyError('No study region CODE for CODE_AD2: ' + ', '.join(map(str, missing)))
+
+    grid = pd.MultiIndex.from_product([list(bands), list(origins), list(destinations)])
+    values = sums.reindex(grid, fill_value = 0)
+
+    return pd.DataFrame({'band': grid.get_level_values(0),
+                         'O': grid.get_level_values(1).map(code_map),
+                         'D': grid.get_level_values(2).map(code_map),
+                         value_name: values.to_numpy()})
@@ -0,0 +1,45 @@
+"""Calendar helpers deriving the analysed days from a month (YYYYMM)."""
+import calendar
+
+# DAY labels of the floating population data treated as weekend
+WEEKEND_DAYS = ('토', '일')
+
+DAY_TYPES = ('weekday', 'weekend')
+
+# Day types of data with calendar dates (card TA_D); 'holiday' keeps only the listed holidays
+CALENDAR_DAY_TYPES = DAY_TYPES + ('holiday',)
+
+
+def parse_holidays(value):
+    # Holidays as YYYYMMDD ints from a comma/space separated setting, e.g. '20221225, 20230101'
+    return [int(h) for h in str(value or '').replace(',', ' ').split()]
+
+
+def month_dates(ym, day_type = 'weekday', holidays = ()):
+    """Return the YYYYMMDD dates (int) of a month that belong to day_type.
+
+    Saturdays, Sundays and any date listed in 'holidays' count as weekend;
+    'holiday' returns only the listed holidays of the month. A day type
+    without any date in the month (e.g. 'holiday' without listed holidays)
+    raises a ValueError instead of yielding empty flows.
+    """
+    if day_type not in CALENDAR_DAY_TYPES:
+        raise ValueError('Unknown day type: ' + str(day_type))
+
+    year, month = int(str(ym)[:4]), int(str(ym)[4:6])
+    holidays = {int(h) for h in holidays}
+
+    dates = []
+    for day in range(1, calendar.monthrange(year, month)[1] + 1):
+        date = year * 10000 + month * 100 + day
+        if day_type == 'holiday':
+            if date in holidays:
+                dates.append(date)
+            continue
+        weekend = calendar.weekday(year, month, day) >= 5 or date in holidays
+        if weekend == (day_type == 'weekend'):
+            dates.append(date)
+    if not dates:
+        raise ValueError('No %s dates in %s%s' % (day_type, ym, ' (no holidays listed)' if day_type == 'holiday' else ''))
+    return dates
+
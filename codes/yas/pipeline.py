@@ -0,0 +1,234 @@
+"""Command line interface running the numbered stages as a dependency graph.
+
+Each stage is one numbered script; a stage runs after the stages writing
+its input files, and stages whose upstream stages have finished run
+concurrently in their own processes, so
+pop (01), card (02), resident (03) and housing (04) preprocessing, or the
+pop (05) and card (06) Flow-LISA, no longer wait for each other. Inputs and outputs of every
+stage are listed in batch.STAGE_FILES; they define the dependency graph and
+drive the stage cache.
+
+Usage:
+    yas run --months 202211 --day-types weekday weekend --data-dir ../data --workers 4
+    yas run --months 202211 --stages 02 06 --set CARD_TIME_BAND=TIME_CCD
+    yas dag
+
+(or python -m yas.pipeline ... from codes/ without installing). Heavy modules (pandas,
+geopandas) are only imported by the stage processes, so the CLI starts fast.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from yas.period import DAY_TYPES
+from yas.settings import available_cpus
+
+# Stage -> (script, indicator). Upstream stages are those writing one of a stage's
+# input files in batch.STAGE_FILES, e.g. 05/06/09 read the flows of 01/02 and 12
+# joins the resident population of 03, the housing supply of 04 and the 01/02
+# flows into the district table read by 07/08/10
+STAGES = {'01': ('01_pop_preprocessing.py', 'pop'),
+          '02': ('02_card_preprocessing.py', 'card'),
+          '03': ('03_youth_resident_preprocessing.py', 'coulter'),
+          '04': ('04_happy_housing_preprocessing.py', 'housing'),
+          '05': ('05_pop_based_SFlowLISA.py', 'pop'),
+          '06': ('06_card_based_SFlowLISA.py', 'card'),
+          '07': ('07_Coulter_inequity_index.py', 'coulter'),
+          '08': ('08_Coulter_adjustment_coefficient.py', 'coulter'),
+          '09': ('09_time_band_SFlowLISA.py', 'pop'),
+          '10': ('10_housing_allocation.py', 'coulter'),
+          '11': ('11_bivariate_SFlowLISA.py', 'housing'),
+          '12': ('12_coulter_district_table.py', 'coulter')}
+
+# Stages run once per month (with the first day type) rather than per day type
+MONTHLY = ('03', '04')
+
+# Stages whose outputs carry no month (the housing supply); run once, with the first month
+STATIC = ('04',)
+
+# Stages whose data carry calendar dates (card TA_D); only these run for 'holiday'
+CALENDAR_STAGES = ('02', '06')
+
+
+def stage_days(stage, day_types):
+    # Day types a stage runs for: 'holiday' only where there are calendar dates,
+    # monthly stages once (with the first remaining day type)
+    days = [d for d in day_types if d in DAY_TYPES or stage in CALENDAR_STAGES]
+    return days[:1] if stage in MONTHLY else days
+
+
+def _file_edges(tasks, store_format = 'parquet'):
+    # {task: [upstream tasks]}: the tasks writing one of the task's input files
+    from yas.batch import stage_files
+
+    files = {}
+    for stage, month, day in tasks:
+        script, indicator = STAGES[stage]
+        context = {'month': month, 'day_type': day, 'indicator': indicator,
+                   'store': '{store}', 'store_format': store_format}
+        files[(stage, month, day)] = stage_files(script, context, data_dir = '')
+
+    producers = {}
+    for task, (_, outputs) in files.items():
+        for path in outputs:
+            producers.setdefault(path, []).append(task)
+    return {task: sorted({up for path in inputs for up in producers.get(path, ()) if up != task})
+            for task, (inputs, _) in files.items()}
+
+
+def task_graph(stages, months, day_types, store_format = 'parquet'):
+    """{(stage, month, day_type): [upstream tasks]} for the selected stages.
+
+    A task depends on the selected tasks writing one of its input files, so
+    the edges follow the tables actually handed over (e.g. 07 of a month
+    and day type after 12 of that month and day type). Upstream stages that are not selected are
+    expected to have run before; their outputs are read as they are.
+    """
+    tasks = [(stage, month, day) for month in months for stage in stages
+             if stage not in STATIC or month == months[0]
+             for day in stage_days(stage, day_types)]
+    return _file_edges(tasks, store_format)
+
+
+def run_graph(graph, data_dir = '.', store = './store', store_format = 'parquet',
+              cache = './.stage_cache', workers = None, profile = None, settings = None):
+    """Run every task once its upstream tasks succeeded; return one result dict per task.
+
+    Tasks downstream of a failure are skipped; a task whose run raises
+    fails like a failing script. settings are extra YAS_* overrides
+    (e.g. {'POP_TIME_BAND': 'type'}) passed to every stage.
+    """
+    from yas.batch import check_scripts, run_chain
+
+    check_scripts(sorted({STAGES[stage][0] for stage, _, _ in graph}))
+
+    data_dir = os.path.abspath(data_dir)
+    store = os.path.abspath(os.path.join(data_dir, store))
+    cache = os.path.abspath(os.path.join(data_dir, cache)) if cache else None
+    log_dir = os.path.join(store, 'logs')
+    # Stages share the cores, so the process pools of a stage (e.g. the tiled lag) get their part
+    workers = workers or available_cpus()
+    resources = {'stage_cpus': max(1, available_cpus() // workers)}
+
+    def submit(pool, task):
+        stage, month, day_type = task
+        script, indicator = STAGES[stage]
+        context = dict(settings or {}, month = month, day_type = day_type, indicator = indicator,
+                       store = store, store_format = store_format)
+        log_path = os.path.join(log_dir, '_'.join([month, day_type, stage]) + '.log')
+        return pool.submit(run_chain, [script], context, data_dir, log_path, cache, profile, resources)
+
+    results, status = [], {}
+    todo = dict(graph)
+    running = {}
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        while todo or running:
+            for task, upstream in list(todo.items()):
+                if any(status.get(up) not in (None, 0) for up in upstream):
+                    # An upstream task failed or was skipped
+                    status[task] = 'skipped'
+                    results.append(_result(task, None, 0, 'upstream failed'))
+                    del todo[task]
+                elif all(status.get(up) == 0 for up in upstream):
+                    running[submit(pool, task)] = task
+                    del todo[task]
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                try:
+                    code, seconds, failed = future.result()
+                except Exception as e:
+                    # The task could not run (e.g. its log directory is not writable)
+                    code, seconds, failed = 1, 0.0, type(e).__name__ + ': ' + str(e)
+                status[task] = code
+                results.append(_result(task, code, seconds, failed))
+                print(*task, 'ok' if code == 0 else 'FAILED', str(round(seconds, 2)) + 's', flush = True)
+    return results
+
+
+def _result(task, code, seconds, failed):
+    stage, month, day_type = task
+    return {'stage': stage, 'month': month, 'day_type': day_type, 'returncode': code,
+            'seconds': round(seconds, 2), 'failed': failed}
+
+
+def describe(stages, store_format = 'parquet'):
+    """Text listing of the stages with their upstream stages, inputs and outputs."""
+    from yas.batch import stage_files
+
+    edges = _file_edges([(stage, '{month}', '{day_type}') for stage in STAGES], store_format)
+    lines = []
+    for stage in stages:
+        script, indicator = STAGES[stage]
+        context = {'month': '{month}', 'day_type': '{day_type}', 'indicator': indicator,
+                   'store': '{store}', 'store_format': store_format}
+        inputs, outputs = stage_files(script, context, data_dir = '')
+        upstream = [up for up, _, _ in edges[(stage, '{month}', '{day_type}')]]
+        lines.append('%s %s (after: %s)' % (stage, script, ', '.join(upstream) or '-'))
+        lines += ['    in:  ' + p for p in inputs] + ['    out: ' + p for p in outputs]
+    return '\n'.join(lines)
+
+
+def _parse_settings(items):
+    # KEY=VALUE pairs of --set into a settings dict
+    settings = {}
+    for item in items or []:
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise SystemExit('--set expects KEY=VALUE, got ' + item)
+        settings[name.strip().lower()] = value
+    return settings
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'yas', description = 'Run the analysis pipeline stages.')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    run = commands.add_parser('run', help = 'Run stages for one or more months')
+    run.add_argument('--months', nargs = '+', required = True, help = 'YYYYMM months')
+    run.add_argument('--day-types', nargs = '+', default = ['weekday'], choices = ['weekday', 'weekend', 'holiday'])
+    run.add_argument('--stages', nargs = '+', default = list(STAGES), choices = list(STAGES))
+    run.add_argument('--workers', type = int, default = None, help = 'Concurrent stages (default: available CPU cores)')
+    run.add_argument('--data-dir', default = '.', help = 'Directory holding the raw input files')
+    run.add_argument('--store', default = './store', help = 'Store root, relative to the data directory')
+    run.add_argument('--store-format', default = 'parquet', choices = ['parquet', 'feather', 'csv'])
+    run.add_argument('--cache', default = './.stage_cache', help = 'Stage cache, relative to the data directory')
+    run.add_argument('--no-cache', action = 'store_true', help = 'Rerun every stage')
+    run.add_argument('--profile', default = None, choices = ['cprofile', 'pyinstrument'])
+    run.add_argument('--set', nargs = '*', metavar = 'KEY=VALUE',
+                     help = 'Further YAS_* settings, e.g. POP_TIME_BAND=type LAG_BASE=202210')
+
+    dag = commands.add_parser('dag', help = 'List the stages with their inputs and outputs')
+    dag.add_argument('--stages', nargs = '+', default = list(STAGES), choices = list(STAGES))
+
+    args = parser.parse_args(argv)
+    if args.command == 'dag':
+        print(describe(args.stages))
+        return 0
+
+    stages = sorted(args.stages)
+    graph = task_graph(stages, args.months, args.day_types, args.store_format)
+    start = time.perf_counter()
+    try:
+        results = run_graph(graph, args.data_dir, args.store, args.store_format,
+                            cache = None if args.no_cache else args.cache, workers = args.workers,
+                            profile = args.profile, settings = _parse_settings(args.set))
+    except FileNotFoundError as e:
+        # Stage scripts missing from the installation
+        print('yas:', e, file = sys.stderr)
+        return 2
+
+    for r in sorted(results, key = lambda r: (r['month'], r['day_type'], r['stage'])):
+        status = 'ok' if r['returncode'] == 0 else r['failed'] or 'FAILED'
+        print(r['month'], r['day_type'], r['stage'], str(r['seconds']) + 's', status)
+    print('Total', str(round(time.perf_counter() - start, 2)) + 's')
+    return 0 if all(r['returncode'] == 0 for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Resident population by age band from the monthly 연령별인구현황 files.
+
+The age columns (e.g. '2022년11월_계_20세', '2022년11월_계_100세 이상') are
+parsed from the header, so any month, and files holding several months, are
+read without hand-written column lists. Only the columns of the requested
+bands are read, and band totals are one matrix product of the
+(regions x ages) counts with an (ages x bands) indicator matrix.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+# '<YYYY>년<MM>월_<계|남|여>_<age>세', the oldest age ending in ' 이상' (and over)
+AGE_COLUMN = re.compile(r'^(\d{4})년(\d{1,2})월_(계|남|여)_(\d+)세( 이상)?$')
+
+# Youth definitions: the study's 20-39 and the 19-34 of the Youth Basic Act
+STUDY_YOUTH = {'RPOP': (20, 39)}
+YOUTH_19_34 = {'youth_19_34': (19, 34)}
+
+
+def five_year_bands(start = 0, stop = 100):
+    """{'0-4': (0, 4), ..., '95-99': (95, 99), '100+': (100, None)} style bands."""
+    bands = {'%d-%d' % (lo, lo + 4): (lo, lo + 4) for lo in range(start, stop, 5)}
+    bands['%d+' % stop] = (stop, None)
+    return bands
+
+
+def parse_age_columns(columns, sex = '계'):
+    """Table of the age columns: column, month (YYYYMM), sex, age, open (age and over)."""
+    rows = []
+    for col in columns:
+        m = AGE_COLUMN.match(str(col).strip())
+        if m and m.group(3) == sex:
+            rows.append((col, m.group(1) + m.group(2).zfill(2), m.group(3), int(m.group(4)),
+                         m.group(5) is not None))
+    return pd.DataFrame(rows, columns = ['column', 'month', 'sex', 'age', 'open'])
+
+
+def band_matrix(ages, bands):
+    """(ages x bands) 0/1 matrix; a band (lo, hi) covers lo <= age <= hi, hi None for no upper limit.
+
+    An open-ended column ('100세 이상') is only counted by bands without an
+    upper limit or reaching past its age.
+    """
+    age, is_open = ages['age'].to_numpy(), ages['open'].to_numpy()
+    m = np.zeros((len(ages), len(bands)), dtype = np.int64)
+    for k, (lo, hi) in enumerate(bands.values()):
+        upper = np.inf if hi is None else hi
+        m[:, k] = (age >= lo) & (age <= upper) & (~is_open | (upper > age))
+    return m
+
+
+def read_band_totals(path, bands = STUDY_YOUTH, sex = '계', encoding = 'cp949', months = None):
+    """Band totals per region and month of one 연령별인구현황 file.
+
+    Returns CODE_AD (the 10-digit code of '행정구역'), month and one column
+    per band. Ages a band needs but the file lacks raise a ValueError rather
+    than silently lowering the total.
+    """
+    header = pd.read_csv(path, encoding = encoding, nrows = 0).columns
+    ages = parse_age_columns(header, sex)
+    if months is not None:
+        ages = ages[ages['month'].isin([str(m) for m in months])]
+    if ages.empty:
+        raise ValueError('No age columns for ' + str(months or 'any month') + ' in ' + str(path))
+
+    tables = []
+    for month, cols in ages.groupby('month', sort = True):
+        m = band_matrix(cols, bands)
+        for k, (label, (lo, hi)) in enumerate(bands.items()):
+            top = cols['age'].max() if hi is None else hi
+            missing = sorted(set(range(lo, top + 1)) - set(cols['age']))
+            if missing:
+                raise ValueError('Band %s needs ages %s missing in %s (%s)' % (label, missing, path, month))
+        used = cols[m.any(axis = 1)]
+
+        df = pd.read_csv(path, encoding = encoding, thousands = ',',
+                         usecols = ['행정구역'] + used['column'].tolist())
+        counts = df[used['column']].apply(pd.to_numeric, errors = 'coerce').fillna(0).to_numpy(np.int64)
+        totals = pd.DataFrame(counts @ band_matrix(used, bands), columns = list(bands))
+
+        # Administrative code from '행정구역' (format: 'Area Name (Code)')
+        totals.insert(0, 'CODE_AD', df['행정구역'].str.split('(').str[1].str.split(')').str[0].to_numpy())
+        totals.insert(1, 'month', month)
+        tables.append(totals)
+    return pd.concat(tables, ignore_index = True)
+
+
+def monthly_band_totals(paths, bands = STUDY_YOUTH, sex = '계', encoding = 'cp949'):
+    """Band totals of several files (e.g. one per month), read one file at a time."""
+    return pd.concat([read_band_totals(p, bands, sex, encoding) for p in paths], ignore_index = True)
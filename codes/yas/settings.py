@@ -0,0 +1,32 @@
+"""Run settings shared by the numbered scripts.
+
+Every script keeps its own defaults (month, day type, indicator, store); the
+batch runner overrides them per run through YAS_* environment variables, so
+the scripts can still be run by hand without any arguments.
+"""
+import os
+
+PREFIX = 'YAS_'
+
+
+def setting(name, default = None):
+    # Value of the YAS_<name> environment variable, or the script's default
+    return os.environ.get(PREFIX + name, default)
+
+
+def run_env(**values):
+    # Environment variables for a run, e.g. run_env(MONTH = '202211')
+    return {PREFIX + name.upper(): str(value) for name, value in values.items()}
+
+
+def available_cpus():
+    # CPU cores this process may run on (its affinity mask where the OS has one)
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def stage_cpus():
+    # Cores of one stage: the share the runner sets in YAS_STAGE_CPUS when stages
+    # run concurrently, or every available core for a script run by hand
+    return int(setting('STAGE_CPUS', '0')) or available_cpus()
@@ -0,0 +1,257 @@
+"""Content-addressed cache for pipeline stages and expensive steps.
+
+A stage is fingerprinted by the hashes of its input files, its parameters and
+its code. When the fingerprint was seen before, the cached outputs are copied
+back instead of recomputing; otherwise the stage runs and its outputs are
+stored under <root>/<key>/. The cache is kept below a size limit by evicting
+the least recently used entries, and the last fingerprint of every stage is
+kept so that a rerun can be explained (which input or parameter changed).
+"""
+import ast
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+# Default size limit of the cache directory (bytes)
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+
+
+def file_hash(path, block_size = 1024 ** 2):
+    # SHA-256 of a file, read in blocks
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _write_json(path, value, **kwargs):
+    # Written to a temporary file and renamed, so readers never see a partial file
+    tmp = path + '.tmp' + str(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(value, f, **kwargs)
+    os.replace(tmp, path)
+
+
+def value_hash(value):
+    # Hash of a parameter value: arrays by their bytes, everything else as JSON
+    h = hashlib.sha256()
+    if isinstance(value, (list, tuple)) and value and not isinstance(value[0], str):
+        value = np.asarray(value)
+    if isinstance(value, np.ndarray):
+        h.update(str(value.dtype).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    else:
+        h.update(json.dumps(value, sort_keys = True, default = str).encode())
+    return h.hexdigest()
+
+
+def code_files(script, code_dir = None):
+    """Return the script and every local module it imports (recursively).
+
+    Modules are looked up under code_dir, by default the directory holding
+    the yas package and the numbered scripts.
+    """
+    code_dir = code_dir or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    seen, todo = [], [os.path.abspath(script)]
+    while todo:
+        path = todo.pop()
+        if path in seen:
+            continue
+        seen.append(path)
+        with open(path, encoding = 'utf-8') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            names = []
+            if isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                # 'from yas import flow_weights' imports the module yas.flow_weights
+                names = [node.module] + [node.module + '.' + a.name for a in node.names]
+            for name in names:
+                local = os.path.join(code_dir, *name.split('.')) + '.py'
+                if os.path.exists(local):
+                    todo.append(local)
+    return sorted(seen)
+
+
+class StageCache:
+    """Local stage/step cache with size-based LRU eviction."""
+
+    def __init__(self, root = './.stage_cache', max_bytes = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        os.makedirs(os.path.join(root, 'history'), exist_ok = True)
+
+    def hash_file(self, path):
+        # File hashes are memoized by (size, mtime) so multi-GB raw files are
+        # only read again when they change
+        if not os.path.exists(path):
+            return 'missing'
+        stat = os.stat(path)
+        memo = os.path.join(self.root, 'file_hashes',
+                            hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + '.json')
+        if os.path.exists(memo):
+            with open(memo) as f:
+                m = json.load(f)
+            if m['size'] == stat.st_size and m['mtime_ns'] == stat.st_mtime_ns:
+                return m['hash']
+
+        digest = file_hash(path)
+        os.makedirs(os.path.dirname(memo), exist_ok = True)
+        _write_json(memo, {'path': os.path.abspath(path), 'size': stat.st_size,
+                           'mtime_ns': stat.st_mtime_ns, 'hash': digest})
+        return digest
+
+    def fingerprint(self, inputs = None, params = None, code = None):
+        """Fingerprint of a stage: {'input:<name>': hash, 'param:<name>': hash, 'code:<file>': hash}.
+
+        code lists files, hashed whole, or functions, hashed by their source
+        ('code:<module>.<function>'), for steps depending on part of a module.
+        """
+        fp = {}
+        for name, path in (inputs or {}).items():
+            fp['input:' + name] = self.hash_file(path)
+        for name, value in (params or {}).items():
+            fp['param:' + name] = value_hash(value)
+        for item in code or []:
+            if callable(item):
+                fp['code:' + item.__module__ + '.' + item.__qualname__] = value_hash(inspect.getsource(item))
+            else:
+                fp['code:' + os.path.basename(item)] = self.hash_file(item)
+        return fp
+
+    @staticmethod
+    def key(stage, fingerprint):
+        return value_hash([stage, sorted(fingerprint.items())])[:32]
+
+    def _history_path(self, stage):
+        return os.path.join(self.root, 'history', hashlib.sha1(stage.encode()).hexdigest() + '.json')
+
+    def explain(self, stage, fingerprint):
+        """Reasons why the stage has to run for this fingerprint (empty list on a hit)."""
+        key = self.key(stage, fingerprint)
+        if os.path.exists(os.path.join(self.root, key, 'manifest.json')):
+            return []
+
+        path = self._history_path(stage)
+        if not os.path.exists(path):
+            return ['no previous run recorded']
+        with open(path) as f:
+            last = json.load(f)['fingerprint']
+
+        reasons = []
+        for name in sorted(set(fingerprint) | set(last)):
+            if name not in last:
+                reasons.append(name + ' added')
+            elif name not in fingerprint:
+                reasons.append(name + ' removed')
+            elif last[name] != fingerprint[name]:
+                reasons.append(name + ' changed')
+        return reasons or ['cached output was evicted']
+
+    def _record(self, stage, fingerprint):
+        _write_json(self._history_path(stage), {'stage': stage, 'time': time.time(), 'fingerprint': fingerprint},
+                    indent = 1)
+
+    @staticmethod
+    def _publish(tmp, entry):
+        # Move a fully written entry into place; another process may have stored the same entry first
+        try:
+            if not os.path.exists(entry):
+                os.replace(tmp, entry)
+                return
+        except OSError:
+            pass
+        shutil.rmtree(tmp, ignore_errors = True)
+
+    def restore(self, stage, fingerprint, outputs):
+        """Copy cached outputs back to their paths; return False on a miss."""
+        entry = os.path.join(self.root, self.key(stage, fingerprint))
+        manifest = os.path.join(entry, 'manifest.json')
+        if not os.path.exists(manifest):
+            return False
+
+        with open(manifest) as f:
+            files = json.load(f)['files']
+        for path in outputs:
+            if files.get(path) is None:
+                continue
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+            shutil.copy2(os.path.join(entry, files[path]), path)
+
+        # Touch the entry so it becomes the most recently used
+        os.utime(manifest)
+        self._record(stage, fingerprint)
+        return True
+
+    def save(self, stage, fingerprint, outputs):
+        """Store the existing output files of a finished stage."""
+        key = self.key(stage, fingerprint)
+        entry = os.path.join(self.root, key)
+        tmp = entry + '.tmp' + str(os.getpid())
+        os.makedirs(tmp, exist_ok = True)
+
+        files = {}
+        for i, path in enumerate(outputs):
+            if os.path.exists(path):
+                files[path] = str(i) + '_' + os.path.basename(path)
+                shutil.copy2(path, os.path.join(tmp, files[path]))
+            else:
+                files[path] = None
+        with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+            json.dump({'stage': stage, 'fingerprint': fingerprint, 'files': files}, f, indent = 1)
+
+        self._publish(tmp, entry)
+        self._record(stage, fingerprint)
+        self.evict()
+
+    def memoize(self, stage, fingerprint, compute):
+        """Return the cached array for the fingerprint, or compute and cache it."""
+        entry = os.path.join(self.root, self.key(stage, fingerprint))
+        if os.path.exists(os.path.join(entry, 'manifest.json')):
+            os.utime(os.path.join(entry, 'manifest.json'))
+            self._record(stage, fingerprint)
+            return np.load(os.path.join(entry, 'result.npy'))
+
+        # The entry is written next to its final place and renamed, as in save()
+        result = np.asarray(compute())
+        tmp = entry + '.tmp' + str(os.getpid())
+        os.makedirs(tmp, exist_ok = True)
+        np.save(os.path.join(tmp, 'result.npy'), result)
+        with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+            json.dump({'stage': stage, 'fingerprint': fingerprint, 'files': {}}, f, indent = 1)
+
+        self._publish(tmp, entry)
+        self._record(stage, fingerprint)
+        self.evict()
+        return result
+
+    def entries(self):
+        # (last use, size, path) of every cache entry
+        out = []
+        for name in os.listdir(self.root):
+            entry = os.path.join(self.root, name)
+            manifest = os.path.join(entry, 'manifest.json')
+            # Skip unfinished entries still being written by another process
+            if '.tmp' in name or not os.path.exists(manifest):
+                continue
+            size = sum(os.path.getsize(os.path.join(d, f))
+                       for d, _, fs in os.walk(entry) for f in fs)
+            out.append((os.path.getmtime(manifest), size, entry))
+        return sorted(out)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors = True)
+            total -= size
@@ -0,0 +1,83 @@
+"""Storage layer for the hand-off tables passed between pipeline stages.
+
+Intermediate tables are written as typed Parquet (or Arrow IPC/Feather, which
+can be memory-mapped) under <root>/<indicator>/<month>/<name>.<ext>, which
+avoids the cp949 encoding and float text round-trips of CSV. CSV is kept as a
+backend and through export_csv() for the final deliverables.
+"""
+import os
+
+import pandas as pd
+
+from yas.instrument import traced
+
+# File extension per backend
+EXTENSIONS = {'parquet': '.parquet', 'feather': '.arrow', 'csv': '.csv'}
+
+
+class TableStore:
+    """Month/indicator partitioned table store.
+
+    fmt is 'parquet' (default), 'feather' (Arrow IPC) or 'csv'. Parquet and
+    Feather need pyarrow.
+    """
+
+    def __init__(self, root = './store', fmt = 'parquet'):
+        if fmt not in EXTENSIONS:
+            raise ValueError('Unknown storage format: ' + str(fmt))
+        self.root = root
+        self.fmt = fmt
+
+    def path(self, name, month = None, indicator = None):
+        parts = [self.root]
+        if indicator is not None:
+            parts.append('indicator=' + str(indicator))
+        if month is not None:
+            parts.append('month=' + str(month))
+        return os.path.join(*parts, name + EXTENSIONS[self.fmt])
+
+    def exists(self, name, month = None, indicator = None):
+        return os.path.exists(self.path(name, month, indicator))
+
+    @traced('export')
+    def write(self, df, name, month = None, indicator = None):
+        path = self.path(name, month, indicator)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+
+        if self.fmt == 'parquet':
+            df.to_parquet(path, index = False)
+        elif self.fmt == 'feather':
+            df.reset_index(drop = True).to_feather(path)
+        else:
+            df.to_csv(path, encoding = 'cp949', index = False)
+        return path
+
+    @traced('load')
+    def read(self, name, month = None, indicator = None, legacy_csv = None, columns = None):
+        """Read a table; fall back to a legacy cp949 CSV when it is not stored yet.
+
+        legacy_csv may also be a list of paths, tried in order (e.g. a per-month
+        name before an older undated one); the first existing one is read.
+        """
+        path = self.path(name, month, indicator)
+
+        if not os.path.exists(path) and legacy_csv is not None:
+            candidates = [legacy_csv] if isinstance(legacy_csv, str) else list(legacy_csv)
+            legacy = next((p for p in candidates if os.path.exists(p)), candidates[0])
+            return pd.read_csv(legacy, encoding = 'cp949', usecols = columns)
+
+        if self.fmt == 'parquet':
+            return pd.read_parquet(path, columns = columns)
+        elif self.fmt == 'feather':
+            # Arrow IPC files are memory-mapped while reading; only the selected columns
+            # are converted (copied) into the pandas frame
+            from pyarrow import feather
+            return feather.read_table(path, columns = columns, memory_map = True).to_pandas()
+        return pd.read_csv(path, encoding = 'cp949', usecols = columns)
+
+
+@traced('export')
+def export_csv(df, path):
+    # Final deliverables keep the cp949 CSV format used by the mapping tools
+    df.to_csv(path, encoding = 'cp949', index = False)
+    return path
@@ -0,0 +1,184 @@
+"""Chunked readers for the multi-GB monthly raw files.
+
+The raw file is read in fixed-size chunks with explicit narrow dtypes; the
+day, SMA region-prefix, age (and, for card data, category) filters are
+applied inside each chunk and the surviving rows are folded into a running
+OD accumulator, so peak memory is bounded by the chunk size rather than the
+file size.
+"""
+import numpy as np
+import pandas as pd
+
+from yas.instrument import traced
+from yas.period import DAY_TYPES, WEEKEND_DAYS
+
+# Region prefixes of Seoul(11), Incheon(28) and Gyeonggi(41)
+SMA_PREFIXES = ('11', '28', '41')
+
+# Columns and dtypes needed from the floating population file
+POP_DTYPES = {'home_GU_CODE': 'int32',
+              'dst_HCODE': 'category',
+              'DAY': 'category',
+              'AGE': 'category',
+              'SEX': 'category',
+              'POP': 'float64'}
+
+# Columns and dtypes needed from the card transaction file (KRILA_<ym>.csv)
+CARD_DTYPES = {'TA_D': 'int32',
+               'CLNN_CTY_CD': 'category',
+               'MCT_SSG_CD': 'category',
+               'AGE_CD': 'category',
+               'RY_CD': 'category',
+               'TIME_CCD': 'category',
+               'TAMT': 'float64',
+               'CNT': 'int64'}
+
+
+class ODAccumulator:
+    """Running OD sums that keep origins/destinations in order of appearance.
+
+    When add() is given bands (one array, or a list of arrays for several
+    leading levels), sums are kept per (band, origin, destination). values
+    may be a DataFrame to sum several columns at once.
+    """
+
+    def __init__(self):
+        self.sums = None
+        self.origins = {}
+        self.destinations = {}
+
+    def add(self, o, d, values, bands = None):
+        # Record first-appearance order (as unique() on the full frame would)
+        self.origins.update(dict.fromkeys(pd.unique(o)))
+        self.destinations.update(dict.fromkeys(pd.unique(d)))
+
+        keys = [np.asarray(o), np.asarray(d)]
+        if bands is not None:
+            keys[:0] = [np.asarray(b) for b in bands] if isinstance(bands, list) else [np.asarray(bands)]
+        if isinstance(values, pd.DataFrame):
+            values = values.reset_index(drop = True)
+        else:
+            values = pd.Series(np.asarray(values))
+        part = values.groupby(keys, sort = False).sum()
+        self.sums = part if self.sums is None else self.sums.add(part, fill_value = 0)
+
+    def result(self):
+        sums = self.sums if self.sums is not None else pd.Series(dtype = float)
+        return sums, list(self.origins), list(self.destinations)
+
+
+def _prefix_mask(codes, prefixes = SMA_PREFIXES):
+    # Prefix test on a categorical column evaluated once per category
+    cats = codes.cat.categories.astype(str)
+    keep = np.asarray(cats.str.startswith(prefixes))
+    return np.append(keep, False)[codes.cat.codes.to_numpy()]
+
+
+@traced('load', rows_in = lambda a, k, r: int(r[3]['read']), rows_out = lambda r: len(r[0]),
+        extra = lambda r: {'filters': r[3].to_dict()})
+def read_pop_od(path, chunksize = 1_000_000, day_type = 'weekday', ages = ('20G', '30G'),
+                prefixes = SMA_PREFIXES, encoding = 'utf-8', sep = '|', band_col = None):
+    """Stream the floating population file into youth OD sums.
+
+    Returns (sums, origins, destinations, report). sums is indexed by
+    (home_GU_CODE, dst_HCODE2) as strings, origins/destinations follow the
+    order of first appearance and report counts rows read and kept per filter.
+    With band_col (e.g. the 'type' time slot), sums are indexed by
+    (band, home_GU_CODE, dst_HCODE2) instead, still in a single pass.
+    """
+    acc = ODAccumulator()
+    if day_type not in DAY_TYPES:
+        # Only the DAY label is available, no calendar date (so no 'holiday')
+        raise ValueError('Day type of the floating population data must be one of %s, got %s'
+                         % (DAY_TYPES, day_type))
+    report = {'read': 0, day_type: 0, 'region': 0, 'age': 0}
+
+    dtypes = dict(POP_DTYPES)
+    if band_col is not None:
+        dtypes[band_col] = 'category'
+    reader = pd.read_csv(path, sep = sep, encoding = encoding, usecols = list(dtypes),
+                         dtype = dtypes, chunksize = chunksize)
+    for chunk in reader:
+        report['read'] += len(chunk)
+
+        # Weekdays exclude Saturday and Sunday; weekends keep only those days
+        weekend = chunk['DAY'].isin(WEEKEND_DAYS)
+        chunk = chunk[weekend if day_type == 'weekend' else ~weekend]
+        report[day_type] += len(chunk)
+
+        # Both origin and destination within the SMA
+        home = chunk['home_GU_CODE'].to_numpy()
+        in_sma = np.isin(home // 1000, [int(p) for p in prefixes])
+        chunk = chunk[in_sma & _prefix_mask(chunk['dst_HCODE'], prefixes)]
+        report['region'] += len(chunk)
+
+        # Youth population (20s and 30s)
+        chunk = chunk[chunk['AGE'].isin(ages)]
+        report['age'] += len(chunk)
+
+        # Standardize destination to 5-digit SGG level and fold into the sums
+        dst = chunk['dst_HCODE'].astype(str).str[:5]
+        bands = chunk[band_col].astype(str) if band_col is not None else None
+        acc.add(chunk['home_GU_CODE'].astype(str), dst, chunk['POP'], bands)
+
+    sums, origins, destinations = acc.result()
+    return sums, origins, destinations, pd.Series(report, name = 'rows')
+
+
+@traced('load', rows_in = lambda a, k, r: int(r[3]['read']), rows_out = lambda r: len(r[0]),
+        extra = lambda r: {'filters': r[3].to_dict()})
+def read_card_od(path, dates, chunksize = 1_000_000, ages = ('AGE_2',), categories = None,
+                 exclude_categories = ('ETC',), prefixes = SMA_PREFIXES, encoding = 'cp949',
+                 by = (), values = ('TAMT', 'CNT')):
+    """Stream the card transaction file into youth OD sums of TAMT and CNT.
+
+    Rows are kept when TA_D is one of 'dates' (see period.month_dates), AGE_CD
+    is in 'ages', RY_CD is in 'categories' (all when None) and not in
+    'exclude_categories', and both CLNN_CTY_CD and MCT_SSG_CD are within the
+    SMA. Returns (sums, origins, destinations, report) like read_pop_od, with
+    sums a DataFrame of the 'values' columns indexed by (CLNN_CTY_CD,
+    MCT_SSG_CD) as strings; columns in 'by' (e.g. ['RY_CD', 'TIME_CCD'])
+    are kept as leading index levels, still in a single pass.
+    """
+    acc = ODAccumulator()
+    report = {'read': 0, 'date': 0, 'age': 0, 'category': 0, 'region': 0}
+
+    by = list(by)
+    usecols = ['TA_D', 'CLNN_CTY_CD', 'MCT_SSG_CD', 'AGE_CD', 'RY_CD'] + by + list(values)
+    dtypes = {c: CARD_DTYPES[c] for c in dict.fromkeys(usecols)}
+    reader = pd.read_csv(path, encoding = encoding, usecols = list(dtypes), dtype = dtypes,
+                         chunksize = chunksize)
+    dates = np.asarray(list(dates), dtype = np.int32)
+    if len(dates) == 0:
+        raise ValueError('No dates to keep in ' + str(path))
+    for chunk in reader:
+        report['read'] += len(chunk)
+
+        # Days of the requested day type (from the calendar, not hand-written dates)
+        chunk = chunk[np.isin(chunk['TA_D'].to_numpy(), dates)]
+        report['date'] += len(chunk)
+
+        # Youth age group
+        chunk = chunk[chunk['AGE_CD'].isin(ages)]
+        report['age'] += len(chunk)
+
+        # Consumption categories
+        keep = ~chunk['RY_CD'].isin(exclude_categories)
+        if categories is not None:
+            keep &= chunk['RY_CD'].isin(categories)
+        chunk = chunk[keep]
+        report['category'] += len(chunk)
+
+        # Both card holder and merchant region within the SMA
+        chunk = chunk[_prefix_mask(chunk['CLNN_CTY_CD'], prefixes) & _prefix_mask(chunk['MCT_SSG_CD'], prefixes)]
+        report['region'] += len(chunk)
+
+        levels = [chunk[c].astype(str) for c in by] or None
+        acc.add(chunk['CLNN_CTY_CD'].astype(str), chunk['MCT_SSG_CD'].astype(str),
+                chunk[list(values)], levels)
+
+    sums, origins, destinations = acc.result()
+    if sums.empty:
+        sums = pd.DataFrame(columns = list(values), dtype = float)
+    return sums, origins, destinations, pd.Series(report, name = 'rows')
+
@@ -0,0 +1,173 @@
+"""Out-of-core, checkpointed Flow-LISA lag for flow sets beyond RAM.
+
+At eup-myeon-dong level there are over a million flows, so even the row
+blocks of flow_lisa.flow_lag span the whole (flows x flows) matrix. Here the
+lag is split into row blocks of 'row_block' flows; every block is one task
+that streams (rows x columns) weight tiles from the memory-mapped distance
+matrix, bounded by max_bytes, and writes its partial lag to
+<work_dir>/parts/ with an atomic rename. Finished part files are the
+checkpoint: an interrupted run started again with the same inputs only
+computes the missing blocks. The parts are finally reduced into
+<work_dir>/lag.npy, which is returned memory-mapped.
+
+Tasks run on a local process pool of 'workers' processes (by default every
+core available to the calling process), or on any concurrent.futures executor
+passed as 'executor', e.g. scheduler_executor() of a dask.distributed cluster.
+Workers re-open the distance matrix and the flow arrays from disk instead of
+receiving pickled copies.
+"""
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from yas.flow_lisa import DEFAULT_MAX_BYTES
+from yas.instrument import traced
+from yas.settings import available_cpus
+from yas.stage_cache import value_hash
+
+logger = logging.getLogger('yas.tiled_lag')
+
+# Flows per task (one checkpoint per finished block)
+DEFAULT_ROW_BLOCK = 4096
+
+
+def scheduler_executor(address):
+    """concurrent.futures executor running the tiles on a dask.distributed scheduler.
+
+    Needs the optional 'dask' dependency (pip install -e .[dask]).
+    """
+    from dask.distributed import Client
+    return Client(address).get_executor()
+
+
+def _part_path(work_dir, start, stop):
+    return os.path.join(work_dir, 'parts', '%012d_%012d.npy' % (start, stop))
+
+
+def _lag_block(dm, work_dir, start, stop, max_bytes):
+    # Lag of the flows start..stop-1, streamed over column tiles, saved as one part file
+    p = dm.array
+    o = np.load(os.path.join(work_dir, 'o.npy'), mmap_mode = 'r')
+    d = np.load(os.path.join(work_dir, 'd.npy'), mmap_mode = 'r')
+    z = np.load(os.path.join(work_dir, 'z.npy'), mmap_mode = 'r')
+    n, rows = len(o), stop - start
+    o_rows, d_rows = np.asarray(o[start:stop]), np.asarray(d[start:stop])
+
+    # Each tile holds three float64 (rows x cols) arrays, as in flow_lisa.block_rows
+    cols = int(max(1, max_bytes // (3 * 8 * rows)))
+    lag = np.zeros(z.shape[:-1] + (rows,))
+    for c0 in range(0, n, cols):
+        c1 = min(c0 + cols, n)
+        dist = p[np.ix_(o_rows, o[c0:c1])].astype(float)
+        dist += p[np.ix_(d_rows, d[c0:c1])]
+        # Skip pairs without proximity (summed distance of 0)
+        w = np.divide(1.0, dist, out = np.zeros_like(dist), where = dist != 0)
+        lag += np.asarray(z[..., c0:c1]) @ w.T
+
+    path = _part_path(work_dir, start, stop)
+    np.save(path + '.tmp.npy', lag)
+    os.replace(path + '.tmp.npy', path)
+    return start, stop
+
+
+def _fingerprint(dm, o, d, z, row_block):
+    # Identity of a run: distance matrix file, flows, values and block layout
+    stat = os.stat(dm.path)
+    return value_hash([os.path.abspath(dm.path), stat.st_size, stat.st_mtime_ns,
+                       value_hash(o), value_hash(d), value_hash(z), row_block])
+
+
+def _prepare(work_dir, fingerprint, o, d, z, row_block):
+    """Write the manifest and flow arrays; keep the parts of a run with the same fingerprint."""
+    manifest_path = os.path.join(work_dir, 'manifest.json')
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    if manifest is not None and manifest['fingerprint'] == fingerprint:
+        return manifest
+
+    if manifest is not None:
+        logger.info('Inputs of %s changed; previous tiles are discarded', work_dir)
+    for name in ('parts', 'lag.npy'):
+        path = os.path.join(work_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    os.makedirs(os.path.join(work_dir, 'parts'), exist_ok = True)
+    for name, values in (('o', o), ('d', d), ('z', z)):
+        np.save(os.path.join(work_dir, name + '.npy'), values)
+    manifest = {'fingerprint': fingerprint, 'n_flows': len(o), 'shape': list(z.shape),
+                'row_block': row_block, 'done': False}
+    _write_manifest(work_dir, manifest)
+    return manifest
+
+
+def _write_manifest(work_dir, manifest):
+    path = os.path.join(work_dir, 'manifest.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+
+@traced('lag', rows_in = lambda a, k, r: len(a[1]), rows_out = lambda r: r.shape[-1])
+def tiled_lag(dm, O, D, z, work_dir, row_block = DEFAULT_ROW_BLOCK, max_bytes = DEFAULT_MAX_BYTES,
+              workers = None, executor = None, keep_parts = False):
+    """Flow-LISA lag of z (flows, or bands x flows) computed out of core in work_dir.
+
+    dm is a DistanceMatrix and O, D the 1-based row numbers of every flow, as
+    for flow_lisa.flow_lag, whose result this equals up to summation order.
+    Blocks of 'row_block' flows are spread over 'workers' processes (or the
+    given executor), each bounded by max_bytes; 'workers' defaults to the
+    cores available to this process, so concurrent stages pass their share.
+    Blocks already on disk from an earlier run with the same inputs are not
+    recomputed. Returns the lag as a read-only memory map of
+    <work_dir>/lag.npy; the part files are removed after the reduction
+    unless keep_parts.
+    """
+    o = np.asarray(O, dtype = np.intp) - 1
+    d = np.asarray(D, dtype = np.intp) - 1
+    z = np.asarray(z, dtype = float)
+    n = len(o)
+    os.makedirs(work_dir, exist_ok = True)
+
+    manifest = _prepare(work_dir, _fingerprint(dm, o, d, z, row_block), o, d, z, row_block)
+    lag_path = os.path.join(work_dir, 'lag.npy')
+    if manifest['done'] and os.path.exists(lag_path):
+        return np.load(lag_path, mmap_mode = 'r')
+
+    blocks = [(start, min(start + row_block, n)) for start in range(0, n, row_block)]
+    todo = [b for b in blocks if not os.path.exists(_part_path(work_dir, *b))]
+    logger.info('%d of %d tiles left in %s', len(todo), len(blocks), work_dir)
+
+    if todo:
+        os.makedirs(os.path.join(work_dir, 'parts'), exist_ok = True)
+        pool = executor or ProcessPoolExecutor(max_workers = workers or available_cpus())
+        try:
+            futures = [pool.submit(_lag_block, dm, work_dir, start, stop, max_bytes) for start, stop in todo]
+            for done, future in enumerate(as_completed(futures), 1):
+                start, stop = future.result()
+                logger.info('Tile %d-%d finished (%d/%d)', start, stop, done, len(todo))
+        finally:
+            if executor is None:
+                pool.shutdown(cancel_futures = True)
+
+    # Reduce the parts into one memory-mapped lag array
+    out = np.lib.format.open_memmap(lag_path + '.tmp.npy', mode = 'w+', dtype = float, shape = z.shape)
+    for start, stop in blocks:
+        out[..., start:stop] = np.load(_part_path(work_dir, start, stop))
+    out.flush()
+    del out
+    os.replace(lag_path + '.tmp.npy', lag_path)
+
+    manifest['done'] = True
+    _write_manifest(work_dir, manifest)
+    if not keep_parts:
+        shutil.rmtree(os.path.join(work_dir, 'parts'))
+    return np.load(lag_path, mmap_mode = 'r')
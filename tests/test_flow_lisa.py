@@ -0,0 +1,84 @@
+"""flow_lisa.flow_lag against the original double loop of 05/06."""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'codes'))
+
+from yas.flow_lisa import block_rows, flow_lag  # noqa: E402
+
+
+def loop_lag(p_array, O, D, Zpop):
+    # The nested loop that 05/06 used before flow_lag, kept verbatim
+    youth_x = []
+    for i in range(len(O)):
+        middle_y = []
+        for j in range(len(O)):
+            dist_o = p_array[O[i]-1][O[j]-1]
+            dist_d = p_array[D[i]-1][D[j]-1]
+            if(dist_o + dist_d) == 0: continue
+            zy = Zpop[j] * 1 / (dist_o + dist_d)
+            middle_y.append(zy)
+        youth_x.append(sum(middle_y))
+    return np.array(youth_x)
+
+
+def sample_flows(name, value):
+    # Flows of a data/ sample and a node distance matrix from their coordinates
+    pytest.importorskip('openpyxl')
+    # The samples are Excel workbooks despite the .csv suffix
+    od = pd.read_excel(os.path.join(ROOT, 'data', name), engine = 'openpyxl')
+    nodes = pd.concat([od[['num_x', 'O_x', 'O_y']].set_axis(['num', 'x', 'y'], axis = 1),
+                       od[['num_y', 'D_x', 'D_y']].set_axis(['num', 'x', 'y'], axis = 1)])
+    nodes = nodes.drop_duplicates('num')
+    xy = np.zeros((nodes['num'].max(), 2))
+    xy[nodes['num'] - 1] = nodes[['x', 'y']]
+    p_array = np.hypot(*(xy[:, None, :] - xy[None, :, :]).transpose(2, 0, 1))
+    return p_array, od['num_x'].to_numpy(), od['num_y'].to_numpy(), od[value].to_numpy()
+
+
+def budgets(n):
+    # The default budget (one block) and budgets of 1, 5 and 17 rows per block
+    return [None] + [rows * 3 * 8 * n for rows in (1, 5, 17)]
+
+
+@pytest.mark.parametrize('name, value', [('SIG_pay_weekday_202211.csv', 'Zyouth_P'),
+                                         ('SIG_mpop_weekday_202211.csv', 'Zmpop_P')])
+def test_flow_lag_matches_loop_on_samples(name, value):
+    p_array, O, D, z = sample_flows(name, value)
+    expected = loop_lag(p_array, O, D, z)
+    for max_bytes in budgets(len(O)):
+        kwargs = {} if max_bytes is None else {'max_bytes': max_bytes}
+        if max_bytes is not None:
+            # Small budgets must really split the flows into several blocks
+            assert block_rows(len(O), max_bytes) < len(O)
+        assert np.allclose(flow_lag(p_array, O, D, z, **kwargs), expected)
+
+
+def test_flow_lag_skips_zero_distances():
+    # Nodes 1 and 2 share a location and flow 0 is repeated as flow 3, so
+    # several pairs besides i == j have a summed distance of 0
+    p_array = np.array([[0.0, 0.0, 3.0, 4.0],
+                        [0.0, 0.0, 3.0, 4.0],
+                        [3.0, 3.0, 0.0, 5.0],
+                        [4.0, 4.0, 5.0, 0.0]])
+    O = np.array([1, 2, 3, 1, 4, 2])
+    D = np.array([3, 3, 4, 3, 1, 4])
+    z = np.array([1.5, -0.5, 2.0, 0.25, -1.0, 0.75])
+
+    expected = loop_lag(p_array, O, D, z)
+    for max_bytes in budgets(len(O)):
+        kwargs = {} if max_bytes is None else {'max_bytes': max_bytes}
+        assert np.allclose(flow_lag(p_array, O, D, z, **kwargs), expected)
+
+
+def test_flow_lag_of_bands_matches_loop():
+    # A (bands x flows) z is lagged row by row as the 1-D case
+    p_array, O, D, z = sample_flows('SIG_pay_weekday_202211.csv', 'Zyouth_P')
+    bands = np.vstack([z, z[::-1], np.sin(np.arange(len(z)))])
+    lag = flow_lag(p_array, O, D, bands, max_bytes = 5 * 3 * 8 * len(O))
+    assert np.allclose(lag, [loop_lag(p_array, O, D, row) for row in bands])
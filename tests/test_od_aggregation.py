@@ -0,0 +1,139 @@
+"""Streamed OD sums laid out by od_grid against the original nested loops of 01/02."""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'codes'))
+
+from yas.od_aggregation import od_grid  # noqa: E402
+from yas.streaming import read_card_od, read_pop_od  # noqa: E402
+
+# SGG codes of Seoul, Incheon and Gyeonggi, and one outside the SMA (Busan)
+SGG = ['11010', '11020', '11030', '28110', '28140', '41110', '41130', '26110']
+DAYS = ['월', '화', '수', '목', '금', '토', '일']
+
+
+def code_table():
+    # Administrative codes (10 digits) with their study region CODE
+    return pd.DataFrame({'CODE_AD': [int(c + '00000') for c in SGG], 'CODE': np.arange(101, 101 + len(SGG))})
+
+
+def raw_pop(path, rows = 400, seed = 0):
+    # Floating population file with weekend, non-SMA and non-youth rows to filter out
+    rng = np.random.default_rng(seed)
+    pop = pd.DataFrame({'home_GU_CODE': rng.choice(SGG, rows).astype(int),
+                        'dst_HCODE': [c + '%05d' % n for c, n in zip(rng.choice(SGG, rows), rng.integers(0, 99999, rows))],
+                        'AGE': rng.choice(['10G', '20G', '30G', '40G'], rows),
+                        'SEX': rng.choice(['M', 'F'], rows),
+                        'STD_YMD': 20220401 + rng.integers(0, 28, rows),
+                        'DAY': rng.choice(DAYS, rows),
+                        'type': rng.choice(['T1', 'T2'], rows),
+                        'POP': rng.gamma(0.5, 20, rows).round(3)})
+    pop.to_csv(path, sep = '|', index = False, encoding = 'utf-8')
+
+
+def raw_card(path, dates, rows = 400, seed = 1):
+    # Card transaction file with other days, ages, categories and non-SMA rows to filter out
+    rng = np.random.default_rng(seed)
+    card = pd.DataFrame({'TA_D': rng.choice(list(dates) + [20220404, 20220405], rows),
+                         'CLNN_CTY_CD': rng.choice(SGG, rows).astype(int),
+                         'MCT_SSG_CD': rng.choice(SGG, rows).astype(int),
+                         'AGE_CD': rng.choice(['AGE_1', 'AGE_2', 'AGE_3'], rows),
+                         'RY_CD': rng.choice(['FOOD', 'SHOP', 'ETC'], rows),
+                         'TIME_CCD': rng.choice(['T1', 'T2'], rows),
+                         'SEX_CD': rng.choice(['M', 'F'], rows),
+                         'TAMT': rng.integers(1000, 90000, rows),
+                         'CNT': rng.integers(1, 9, rows)})
+    card.to_csv(path, index = False, encoding = 'cp949')
+
+
+def loop_pop(path, code):
+    # Steps 4-6 of 01 before the streaming reader, kept verbatim (without tqdm)
+    code['CODE_AD'] = code['CODE_AD'].astype(str)
+    code['CODE_AD2'] = code['CODE_AD'].str[:5]
+    pop = pd.read_csv(path, encoding = 'utf-8', sep = '|')
+    pop['home_GU_CODE'] = pop['home_GU_CODE'].astype(str)
+    pop['dst_HCODE'] = pop['dst_HCODE'].astype(str)
+
+    pop = pop[(pop['DAY'] != '토') & (pop['DAY'] != '일')]
+    pop2 = pop[((pop['home_GU_CODE'].str.startswith('41')) | (pop['home_GU_CODE'].str.startswith('28')) | (pop['home_GU_CODE'].str.startswith('11'))) &
+               ((pop['dst_HCODE'].str.startswith('41')) | (pop['dst_HCODE'].str.startswith('28')) | (pop['dst_HCODE'].str.startswith('11')))]
+    pop_y = pop2[(pop2['AGE'] == '20G') | (pop2['AGE'] == '30G')].reset_index()
+    pop_y['dst_HCODE2'] = pop_y['dst_HCODE'].str[:5]
+    pop_y2 = pop_y[['home_GU_CODE', 'dst_HCODE2', 'AGE', 'SEX', 'STD_YMD', 'DAY', 'type', 'POP']]
+
+    y_o = pop_y2['home_GU_CODE'].unique()
+    y_d = pop_y2['dst_HCODE2'].unique()
+    y_od = []
+    for i in range(len(y_o)):
+        for j in range(len(y_d)):
+            y_sum = pop_y2[(pop_y2['home_GU_CODE'] == y_o[i]) & (pop_y2['dst_HCODE2'] == y_d[j])]['POP'].sum()
+            y_co = code[code['CODE_AD2'] == y_o[i]]['CODE'].tolist()[0]
+            y_cd = code[code['CODE_AD2'] == y_d[j]]['CODE'].tolist()[0]
+            y_od.append([y_co, y_cd, y_sum])
+    return pd.DataFrame(y_od, columns = ['O', 'D', 'POP'])
+
+
+def loop_card(path, code, dates):
+    # Steps 4-7 of 02 before the streaming reader, kept verbatim (without tqdm); the dates
+    # are passed instead of written out, and the manual 41670 correction of step 6 is left
+    # out as it only applies to the April 2022 code lists
+    code['CODE_AD'] = code['CODE_AD'].astype(str)
+    code['CODE_AD2'] = code['CODE_AD'].str[:5]
+    card = pd.read_csv(path, encoding = 'cp949')
+    card2 = card[(card['TA_D'].isin(dates)) & ((card['AGE_CD'] == 'AGE_2') & (card['RY_CD'] != 'ETC'))]
+    card2['CLNN_CTY_CD'] = card2['CLNN_CTY_CD'].astype(str)
+    card2['MCT_SSG_CD'] = card2['MCT_SSG_CD'].astype(str)
+    card3 = card2[((card2['CLNN_CTY_CD'].str.startswith('41')) | (card2['CLNN_CTY_CD'].str.startswith('28')) | (card2['CLNN_CTY_CD'].str.startswith('11'))) &
+                  ((card2['MCT_SSG_CD'].str.startswith('41')) | (card2['MCT_SSG_CD'].str.startswith('28')) | (card2['MCT_SSG_CD'].str.startswith('11')))].reset_index()
+
+    card_y = card3[['CLNN_CTY_CD', 'MCT_SSG_CD', 'RY_CD', 'TIME_CCD', 'SEX_CD', 'TAMT', 'CNT']]
+    c_o = card_y['CLNN_CTY_CD'].unique().tolist()
+    c_d = card_y['MCT_SSG_CD'].unique().tolist()
+    c_od = []
+    for i in range(len(c_o)):
+        for j in range(len(c_d)):
+            c_sum = card_y[(card_y['CLNN_CTY_CD'] == c_o[i]) & (card_y['MCT_SSG_CD'] == c_d[j])]['TAMT'].sum()
+            c_co = code[code['CODE_AD2'] == c_o[i]]['CODE'].tolist()[0]
+            c_cd = code[code['CODE_AD2'] == c_d[j]]['CODE'].tolist()[0]
+            c_od.append([c_co, c_cd, c_sum])
+    return pd.DataFrame(c_od, columns = ['O', 'D', 'PAY'])
+
+
+def code_map(code):
+    # CODE_AD2 -> CODE lookup as given by the crosswalk
+    return dict(zip(code['CODE_AD'].astype(str).str[:5], code['CODE']))
+
+
+def assert_same_flows(streamed, expected, value):
+    # Same OD pairs in the same row order, with the same sums
+    assert len(streamed) == len(expected)
+    assert (streamed['O'].astype(str).to_numpy() == expected['O'].astype(str).to_numpy()).all()
+    assert (streamed['D'].astype(str).to_numpy() == expected['D'].astype(str).to_numpy()).all()
+    assert np.allclose(streamed[value].to_numpy(dtype = float), expected[value].to_numpy(dtype = float))
+
+
+@pytest.mark.parametrize('chunksize', [1_000_000, 37])
+def test_pop_grid_matches_loop(tmp_path, chunksize):
+    path = str(tmp_path / 'pop.csv')
+    raw_pop(path)
+    expected = loop_pop(path, code_table())
+
+    sums, origins, destinations, _ = read_pop_od(path, chunksize = chunksize, day_type = 'weekday')
+    assert_same_flows(od_grid(sums, origins, destinations, code_map(code_table()), 'POP'), expected, 'POP')
+
+
+@pytest.mark.parametrize('chunksize', [1_000_000, 37])
+def test_card_grid_matches_loop(tmp_path, chunksize):
+    path = str(tmp_path / 'card.csv')
+    dates = [20220402, 20220403, 20220409, 20220410]
+    raw_card(path, dates)
+    expected = loop_card(path, code_table(), dates)
+
+    sums, origins, destinations, _ = read_card_od(path, dates, chunksize = chunksize)
+    assert_same_flows(od_grid(sums['TAMT'], origins, destinations, code_map(code_table()), 'PAY'),
+                      expected, 'PAY')